@@ -0,0 +1,167 @@
+import json
+import logging
+import threading
+from contextvars import ContextVar, copy_context
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("bookbuddy.accounting")
+
+
+class RequestAccount:
+    '''
+    The upstream calls per target and the SQL statements of one request.
+    Calls made on fan-out threads are counted as well, so the counters are locked.
+    '''
+
+    def __init__(self) -> None:
+        self.upstream: Dict[str, int] = {}
+        self.sql = 0
+        # a request over its budget is reported once, also when its streamed body is checked again
+        self.reported = False
+        self._lock = threading.Lock()
+
+    @property
+    def upstream_total(self) -> int:
+        return sum(self.upstream.values())
+
+    def count_upstream(self, target: str) -> None:
+        with self._lock:
+            self.upstream[target] = self.upstream.get(target, 0) + 1
+
+    def count_sql(self) -> None:
+        with self._lock:
+            self.sql += 1
+
+    def header(self) -> str:
+        '''
+        Returns: a str, the counters in the format of the debug header, like "upstream=3; sql=5; google_books_volume=3"
+        '''
+        targets = "".join(f"; {target}={count}" for target, count in sorted(self.upstream.items()))
+        return f"upstream={self.upstream_total}; sql={self.sql}{targets}"
+
+
+current_account: ContextVar[Optional[RequestAccount]] = ContextVar("current_account", default=None)
+
+
+class RequestBudgetExceeded(RuntimeError):
+    '''
+    Raised in test mode when a request makes more upstream calls or SQL statements than its budget allows.
+    '''
+
+
+class RequestAccounting:
+    '''
+    Counts the upstream calls and SQL statements of every request and checks them against a budget,
+    so a route that starts calling Google Books or the database in a loop is noticed.
+    A request over its budget logs a structured warning, in test mode it raises RequestBudgetExceeded.
+    The body of a streamed response is sent after the request ended, see stream for how it is counted.
+    '''
+
+    def __init__(self, upstream_budget: int = 25, sql_budget: int = 50) -> None:
+        self.upstream_budget = upstream_budget
+        self.sql_budget = sql_budget
+        self.budgets: Dict[str, Dict[str, int]] = {}
+        self.header = False
+        self.fail = False
+        self._listening = False
+
+    def init_app(self, app: Any) -> None:
+        '''
+        Configures the accounting from the Flask config.
+        REQUEST_BUDGET_UPSTREAM and REQUEST_BUDGET_SQL are the budgets of every route, REQUEST_BUDGETS maps
+        an endpoint to its own {"upstream": ..., "sql": ...} budget. REQUEST_COST_HEADER adds the X-Request-Cost header,
+        REQUEST_BUDGET_FAIL raises instead of logging, it defaults to True in test mode.
+        '''
+        self.upstream_budget = app.config.get("REQUEST_BUDGET_UPSTREAM", self.upstream_budget)
+        self.sql_budget = app.config.get("REQUEST_BUDGET_SQL", self.sql_budget)
+        self.budgets = app.config.get("REQUEST_BUDGETS", self.budgets)
+        self.header = app.config.get("REQUEST_COST_HEADER") or app.debug or app.testing
+        fail = app.config.get("REQUEST_BUDGET_FAIL")
+        self.fail = app.testing if fail is None else fail
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._end_request)
+        if not self._listening:
+            event.listen(Engine, "before_cursor_execute", self._count_sql)
+            self._listening = True
+
+    def count_upstream(self, target: str) -> None:
+        '''
+        Counts an upstream call for the current request, calls outside of a request are not counted.
+        '''
+        account = current_account.get()
+        if account is not None:
+            account.count_upstream(target)
+
+    def stream(self, chunks: Iterable[Any]) -> Iterator[Any]:
+        '''
+        Wraps the body of a streamed response, so the upstream calls and SQL statements made while it is sent
+        count for the request. Every chunk is made in a copy of the context of the request, like the fan-out calls.
+        The X-Request-Cost header is sent before the body, so it only has the work before the stream,
+        the budget is checked again with all of the work when the stream ends.
+        Returns: an iterator, the chunks
+        '''
+        account = current_account.get()
+        context = copy_context()
+        endpoint, method, path = request.endpoint, request.method, request.path
+        iterator = iter(chunks)
+
+        def generate() -> Iterator[Any]:
+            while True:
+                try:
+                    chunk = context.run(next, iterator)
+                except StopIteration:
+                    break
+                yield chunk
+            if account is not None:
+                self._check_budget(account, endpoint, method, path)
+
+        return generate()
+
+    def _count_sql(self, *args: Any) -> None:
+        account = current_account.get()
+        if account is not None:
+            account.count_sql()
+
+    def _start_request(self) -> None:
+        g.account_token = current_account.set(RequestAccount())
+
+    def _end_request(self, exception: Optional[BaseException]) -> None:
+        if "account_token" in g:
+            current_account.reset(g.pop("account_token"))
+
+    def _finish_request(self, response: Response) -> Response:
+        account = current_account.get()
+        if account is None:
+            return response
+        if self.header:
+            response.headers["X-Request-Cost"] = account.header()
+        self._check_budget(account, request.endpoint, request.method, request.path)
+        return response
+
+    def _check_budget(self, account: RequestAccount, endpoint: Optional[str], method: str, path: str) -> None:
+        budget = self.budgets.get(endpoint or "", {})
+        upstream_budget = budget.get("upstream", self.upstream_budget)
+        sql_budget = budget.get("sql", self.sql_budget)
+        if account.reported or (account.upstream_total <= upstream_budget and account.sql <= sql_budget):
+            return
+
+        account.reported = True
+        report = {
+            "event": "request_budget_exceeded",
+            "endpoint": endpoint,
+            "method": method,
+            "path": path,
+            "upstream": account.upstream,
+            "upstream_budget": upstream_budget,
+            "sql": account.sql,
+            "sql_budget": sql_budget,
+        }
+        if self.fail:
+            raise RequestBudgetExceeded(json.dumps(report))
+        logger.warning(json.dumps(report))
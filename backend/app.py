@@ -1,94 +1,309 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, render_template, request, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import requests
-from sqlalchemy.orm.attributes import flag_modified
-from google import genai
-from google.genai import types
+from sqlalchemy import Integer, bindparam, case, cast, func, insert, inspect, select, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 import os
 from dotenv import load_dotenv
-import requests
+from requests import RequestException
 import os
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from urllib.parse import urlencode
+from cache import LRUCache, RefreshingCache, VolumeCache
+from fanout import FanOut
+from upstream import google_books
+from pagination import collection_response
+from chat import ChatSessions, compact_reading_profile, sse_event
+from http_cache import Compress, etag_of, not_modified
+from metrics import Metrics
+from accounting import RequestAccounting
 # Run website --> python backend/app.py in cmd
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-# Start gemini API with system prompt for book recommendations
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-chat = client.chats.create(
-    model="gemini-2.0-flash",
-    config=types.GenerateContentConfig(
-        system_instruction="You are BookBuddy, a friendly and knowledgeable book recommendation assistant."
-    )
-)
-
 basedir = os.path.abspath(os.path.dirname(__file__))
 instance_dir = os.path.join(basedir, "instance")
-os.makedirs(instance_dir, exist_ok=True)
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(instance_dir, "bookbuddy.db")}'
 
-db = SQLAlchemy(app)
+bp = Blueprint("bookbuddy", __name__, cli_group=None)
+
+db = SQLAlchemy()
+volume_cache = VolumeCache()
+fan_out = FanOut()
+search_cache = RefreshingCache("SEARCH_CACHE")
+recommendation_cache = RefreshingCache("RECOMMENDATION_CACHE")
+# user id to (list revisions, reading profile) for the chat, rebuilt when one of the lists changes.
+reading_profile_cache = LRUCache()
+chat_sessions = ChatSessions()
+compress = Compress()
+metrics = Metrics()
+request_accounting = RequestAccounting()
+
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    '''
+    Creates the BookBuddy application, config overrides the settings that are read from the environment.
+    Nothing is connected here: the database is set up with upgrade_db (flask --app app upgrade-db) and the
+    Google Books and Gemini clients are created on first use, so gunicorn --preload workers fork from a cheap parent.
+    Returns: a Flask application
+    '''
+    app = Flask(__name__)
+    CORS(app, expose_headers=["X-Next-Cursor", "ETag", "X-Request-Cost"])  # Enable CORS for all routes
+
+    database_uri = f'sqlite:///{os.path.join(instance_dir, "bookbuddy.db")}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+
+    # Google Books volumes are cached in memory and in a separate SQLite file, so restarted workers start warm.
+    app.config['VOLUME_CACHE_PATH'] = os.path.join(instance_dir, "volume_cache.db")
+    app.config['VOLUME_CACHE_SIZE'] = int(os.getenv("VOLUME_CACHE_SIZE", 2048))
+    app.config['VOLUME_CACHE_TTL'] = int(os.getenv("VOLUME_CACHE_TTL", 60 * 60))
+    app.config['VOLUME_CACHE_PERSISTENT_TTL'] = int(os.getenv("VOLUME_CACHE_PERSISTENT_TTL", 7 * 24 * 60 * 60))
+    # The id's of volumes that exist are kept in the same file, reviews of known volumes skip the Google Books check.
+    app.config['VOLUME_REGISTRY_SIZE'] = int(os.getenv("VOLUME_REGISTRY_SIZE", 100_000))
+
+    # Book lists are hydrated concurrently, with a cap on calls in flight per request and an overall deadline.
+    app.config['FANOUT_MAX_WORKERS'] = int(os.getenv("FANOUT_MAX_WORKERS", 16))
+    app.config['FANOUT_MAX_IN_FLIGHT'] = int(os.getenv("FANOUT_MAX_IN_FLIGHT", 8))
+    app.config['FANOUT_DEADLINE'] = float(os.getenv("FANOUT_DEADLINE", 20))
+    # upgrade_db fetches the genres of favorites that have none stored yet within GENRE_FETCH_DEADLINE seconds.
+    app.config['GENRE_FETCH_DEADLINE'] = float(os.getenv("GENRE_FETCH_DEADLINE", 15 * 60))
+    app.config['BATCH_MAX_IDS'] = int(os.getenv("BATCH_MAX_IDS", 100))
+    # Every request may make REQUEST_BUDGET_UPSTREAM upstream calls and REQUEST_BUDGET_SQL SQL statements,
+    # more logs a warning, or fails in test mode. REQUEST_COST_HEADER adds the counts in the X-Request-Cost header.
+    app.config['REQUEST_BUDGET_UPSTREAM'] = int(os.getenv("REQUEST_BUDGET_UPSTREAM", 25))
+    app.config['REQUEST_BUDGET_SQL'] = int(os.getenv("REQUEST_BUDGET_SQL", 50))
+    app.config['REQUEST_COST_HEADER'] = os.getenv("REQUEST_COST_HEADER", "").lower() in ("1", "true", "yes")
+    # JSON responses of at least COMPRESS_MIN_SIZE bytes are sent with gzip to clients that accept it.
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+    app.config['COMPRESS_LEVEL'] = int(os.getenv("COMPRESS_LEVEL", 6))
+    # Bulk list changes are applied in one transaction, a request can hold at most BULK_MAX_OPERATIONS operations.
+    app.config['BULK_MAX_OPERATIONS'] = int(os.getenv("BULK_MAX_OPERATIONS", 1000))
+
+    # Collection endpoints return pages of PAGE_SIZE rows, clients can ask for at most MAX_PAGE_SIZE.
+    app.config['PAGE_SIZE'] = int(os.getenv("PAGE_SIZE", 100))
+    app.config['MAX_PAGE_SIZE'] = int(os.getenv("MAX_PAGE_SIZE", 500))
+
+    # Every Google Books call goes through one pooled keep-alive session, sized to the fan-out workers.
+    app.config['UPSTREAM_POOL_SIZE'] = int(os.getenv("UPSTREAM_POOL_SIZE", app.config['FANOUT_MAX_WORKERS']))
+    app.config['UPSTREAM_TIMEOUT'] = float(os.getenv("UPSTREAM_TIMEOUT", 10))
+    # UPSTREAM_MODE "record" saves the Google Books responses in UPSTREAM_FIXTURES, "replay" serves them offline
+    # with the latency of UPSTREAM_PROFILE. GOOGLE_BOOKS_URL and GEMINI_BASE_URL can point to a stand-in server.
+    app.config['UPSTREAM_MODE'] = os.getenv("UPSTREAM_MODE", "live")
+    app.config['UPSTREAM_FIXTURES'] = os.getenv("UPSTREAM_FIXTURES")
+    app.config['UPSTREAM_PROFILE'] = os.getenv("UPSTREAM_PROFILE", "none")
+    app.config['GOOGLE_BOOKS_URL'] = os.getenv("GOOGLE_BOOKS_URL", "https://www.googleapis.com/books/v1")
+    app.config['GEMINI_BASE_URL'] = os.getenv("GEMINI_BASE_URL")
+
+    # Search results are cached per normalized query, stale results are served while they are refreshed.
+    app.config['SEARCH_CACHE_SIZE'] = int(os.getenv("SEARCH_CACHE_SIZE", 1024))
+    app.config['SEARCH_CACHE_TTL'] = int(os.getenv("SEARCH_CACHE_TTL", 10 * 60))
+    app.config['SEARCH_CACHE_STALE_TTL'] = int(os.getenv("SEARCH_CACHE_STALE_TTL", 6 * 60 * 60))
+    app.config['SEARCH_CACHE_NEGATIVE_TTL'] = int(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", 60))
+
+    # Recommendations only depend on the genre, so they are cached per genre for every user.
+    app.config['RECOMMENDATION_CACHE_SIZE'] = int(os.getenv("RECOMMENDATION_CACHE_SIZE", 256))
+    app.config['RECOMMENDATION_CACHE_TTL'] = int(os.getenv("RECOMMENDATION_CACHE_TTL", 60 * 60))
+    app.config['RECOMMENDATION_CACHE_STALE_TTL'] = int(os.getenv("RECOMMENDATION_CACHE_STALE_TTL", 24 * 60 * 60))
+    app.config['READING_PROFILE_CACHE_SIZE'] = int(os.getenv("READING_PROFILE_CACHE_SIZE", 4096))
+
+    # The reading profile in the chat prompt is bounded: the most recent favorites first, then the most recent
+    # additions to the other lists, then a title for each of the top genres, within CHAT_CONTEXT_MAX_CHARS.
+    app.config['CHAT_CONTEXT_MAX_CHARS'] = int(os.getenv("CHAT_CONTEXT_MAX_CHARS", 4000))
+    app.config['CHAT_CONTEXT_FAVORITES'] = int(os.getenv("CHAT_CONTEXT_FAVORITES", 25))
+    app.config['CHAT_CONTEXT_RECENT'] = int(os.getenv("CHAT_CONTEXT_RECENT", 25))
+    app.config['CHAT_CONTEXT_GENRES'] = int(os.getenv("CHAT_CONTEXT_GENRES", 5))
+    app.config['CHAT_CONTEXT_GENRE_SAMPLE'] = int(os.getenv("CHAT_CONTEXT_GENRE_SAMPLE", 50))
+
+    # Every user has their own gemini chat session with a bounded history, idle sessions are dropped.
+    app.config['GEMINI_API_KEY'] = os.getenv("GEMINI_API_KEY")
+    app.config['CHAT_MODEL'] = os.getenv("CHAT_MODEL", "gemini-2.0-flash")
+    app.config['CHAT_MAX_TURNS'] = int(os.getenv("CHAT_MAX_TURNS", 10))
+    app.config['CHAT_MAX_HISTORY_CHARS'] = int(os.getenv("CHAT_MAX_HISTORY_CHARS", 20000))
+    app.config['CHAT_MEMORY_BUDGET'] = int(os.getenv("CHAT_MEMORY_BUDGET", 20_000_000))
+    app.config['CHAT_IDLE_TTL'] = int(os.getenv("CHAT_IDLE_TTL", 30 * 60))
+    # The first question of a session is cached on the question and the reading profile, so it is not sent to gemini again.
+    app.config['CHAT_ANSWER_CACHE_SIZE'] = int(os.getenv("CHAT_ANSWER_CACHE_SIZE", 1024))
+    app.config['CHAT_ANSWER_CACHE_TTL'] = int(os.getenv("CHAT_ANSWER_CACHE_TTL", 60 * 60))
+
+    app.config.update(config or {})
+    if app.config['SQLALCHEMY_DATABASE_URI'] == database_uri:
+        os.makedirs(instance_dir, exist_ok=True)
+
+    db.init_app(app)
+    volume_cache.init_app(app)
+    fan_out.init_app(app)
+    google_books.init_app(app)
+    search_cache.init_app(app, submit=fan_out.submit)
+    recommendation_cache.init_app(app, submit=fan_out.submit)
+    reading_profile_cache.max_size = app.config['READING_PROFILE_CACHE_SIZE']
+    reading_profile_cache.clear()
+    chat_sessions.init_app(app)
+    compress.init_app(app)
+
+    request_accounting.init_app(app)
+    metrics.init_app(app)
+    google_books.observer = lambda target, seconds, status: observe_upstream(f"google_books_{target}", seconds, status)
+    chat_sessions.observer = observe_upstream
+    metrics.register_cache("volume", volume_cache.stats)
+    metrics.register_cache("search", search_cache.stats)
+    metrics.register_cache("recommendation", recommendation_cache.stats)
+    metrics.register_cache("reading_profile", reading_profile_cache.stats)
+    metrics.register_cache("chat_answer", lambda: {stat[len("answer_cache_"):]: value for stat, value in chat_sessions.stats().items() if stat.startswith("answer_cache_")})
+    app.register_blueprint(bp)
+    return app
+
+def initial_revision() -> int:
+    '''
+    A list that is deleted and created again must not get a revision it had before, or the caches would serve
+    data of the old list. So a new list starts at the time in microseconds instead of at 0.
+    Returns: an int, the revision of a new list
+    '''
+    return time.time_ns() // 1000
 
 class Favorite(db.Model):
     '''
     Favorite model, to store list of book id's and the user the favorites belong to.
     '''
+    LIST_TYPE = "favorite"
+
     user = db.Column(db.String(100), primary_key=True)
+    # increased on every change of the list, caches of data derived from the list compare it
+    revision = db.Column(db.Integer, nullable=False, default=initial_revision, server_default="0")
+    # the book id's used to be stored here as json, they are now stored in BookListEntry.
     book_list_id = db.Column(db.JSON)
 
-    def to_dict(self) -> Dict[str, Any]:
+    def to_dict(self, book_ids: Optional[List[str]] = None) -> Dict[str, Any]:
         '''
         Converts the Favorite object to a dictionary representation.
+        The book id's are loaded from BookListEntry when they are not given.
         Returns: a dict, containing user and book_list_id
         '''
+        if book_ids is None:
+            book_ids = get_book_list(self.LIST_TYPE, self.user)
         return {
             "user": self.user,
-            "book_list_id": self.book_list_id
+            "book_list_id": {"list": book_ids}
         }
     
 class ReadBooks(db.Model):
     '''
     Read books model, stores list of book id's and the user the read books belong to.
     '''
+    LIST_TYPE = "read"
+
     user = db.Column(db.String(100), primary_key=True)
+    # increased on every change of the list, caches of data derived from the list compare it
+    revision = db.Column(db.Integer, nullable=False, default=initial_revision, server_default="0")
+    # the book id's used to be stored here as json, they are now stored in BookListEntry.
     book_list_id = db.Column(db.JSON)
 
-    def to_dict(self) -> Dict[str, Any]:
+    def to_dict(self, book_ids: Optional[List[str]] = None) -> Dict[str, Any]:
         '''
         Converts the ReadBooks object to a dictionary representation.
+        The book id's are loaded from BookListEntry when they are not given.
         Returns: a dict, containing user and book_list_id
         '''
+        if book_ids is None:
+            book_ids = get_book_list(self.LIST_TYPE, self.user)
         return {
             "user": self.user,
-            "book_list_id": self.book_list_id
+            "book_list_id": {"list": book_ids}
         }
     
 class WantToRead(db.Model):
     '''
     Want to read books model, stores list of book id's and the user the want to read books belong to.
     '''
+    LIST_TYPE = "want_to_read"
+
     user = db.Column(db.String(100), primary_key=True)
+    # increased on every change of the list, caches of data derived from the list compare it
+    revision = db.Column(db.Integer, nullable=False, default=initial_revision, server_default="0")
+    # the book id's used to be stored here as json, they are now stored in BookListEntry.
     book_list_id = db.Column(db.JSON)
 
-    def to_dict(self) -> Dict[str, Any]:
+    def to_dict(self, book_ids: Optional[List[str]] = None) -> Dict[str, Any]:
         '''
         Converts the WantToRead object to a dictionary representation.
+        The book id's are loaded from BookListEntry when they are not given.
         Returns: a dict, containing user and book_list_id
         '''
+        if book_ids is None:
+            book_ids = get_book_list(self.LIST_TYPE, self.user)
         return {
             "user": self.user,
-            "book_list_id": self.book_list_id
+            "book_list_id": {"list": book_ids}
         }
     
+class BookListEntry(db.Model):
+    '''
+    Book list entry model, stores one book id of one of the book lists of a user.
+    The list_type column tells which list the entry belongs to, a book can be in each list of a user only once.
+    '''
+    __table_args__ = (
+        db.UniqueConstraint("user", "list_type", "book_id", name="uq_book_list_entry_user_list_book"),
+        db.Index("ix_book_list_entry_user_list_position", "user", "list_type", "position"),
+        db.Index("ix_book_list_entry_list_book", "list_type", "book_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user = db.Column(db.String(100), nullable=False)
+    list_type = db.Column(db.String(20), nullable=False)
+    book_id = db.Column(db.String(100), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class BookPopularity(db.Model):
+    '''
+    Book popularity model, stores in how many favorite lists a book is.
+    The count is kept up to date when favorites change, so the most favorite books are read from an index.
+    '''
+    __table_args__ = (
+        db.Index("ix_book_popularity_favorite_count", "favorite_count", "book_id"),
+    )
+
+    book_id = db.Column(db.String(100), primary_key=True)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0)
+
+class UserGenre(db.Model):
+    '''
+    User genre model, stores in how many favorite books of a user a genre appears.
+    It is kept up to date when favorites change, so recommendations do not need to fetch the favorite books.
+    '''
+    __table_args__ = (
+        db.Index("ix_user_genre_user_count", "user", "genre_count"),
+    )
+
+    user = db.Column(db.String(100), primary_key=True)
+    genre = db.Column(db.String(200), primary_key=True)
+    genre_count = db.Column(db.Integer, nullable=False, default=0)
+
+class BookGenre(db.Model):
+    '''
+    Book genre model, stores the genres of a book in the order Google Books lists them.
+    The genres are stored when the book is added to favorites, so removals and rebuilds need no upstream call.
+    A favorite without a row is pending: its genres could not be fetched yet, it is not in the genre profile
+    and is retried on later favorite changes of the user and by upgrade_db.
+    '''
+    book_id = db.Column(db.String(100), primary_key=True)
+    genres = db.Column(db.JSON, nullable=False)
+
+BOOK_LIST_MODELS = {model.LIST_TYPE: model for model in (Favorite, ReadBooks, WantToRead)}
+
 class Review(db.Model):
     '''
     Review model, stores book reviews with user ratings and messages.
-    '''
+    A user can review a book once, the unique index also makes the lookups by user and book fast.
+    The rating and date indexes end with the id, so the sorted review pages are read in index order.
+    '''
+    __table_args__ = (
+        db.Index("ix_review_book_id_date", "book_id", "date"),
+        db.Index("uq_review_user_book_id", "user", "book_id", unique=True),
+        db.Index("ix_review_rating_id", "rating", "id"),
+        db.Index("ix_review_date_id", "date", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     book_id = db.Column(db.String(15), nullable=False)
     user = db.Column(db.String(30), nullable=False)
@@ -96,12 +311,39 @@ class Review(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow)
     message = db.Column(db.Text)
 
+class BookRating(db.Model):
+    '''
+    Book rating model, stores the review count, the sum of the ratings and a histogram of the ratings of a book.
+    It is kept up to date when reviews change, so rating badges do not need to read the reviews.
+    '''
+    book_id = db.Column(db.String(100), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Float, nullable=False, default=0.0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        '''
+        Converts the BookRating object to a dictionary representation.
+        Returns: a dict, containing book_id, count, sum, mean and the 1-5 histogram
+        '''
+        return {
+            "book_id": self.book_id,
+            "count": self.review_count,
+            "sum": self.rating_sum,
+            "mean": self.rating_sum / self.review_count if self.review_count else None,
+            "histogram": {str(stars): getattr(self, f"rating_{stars}") for stars in range(1, 6)}
+        }
+
 def search_url_build(query: str, order_by: Optional[str] = None, lg: Optional[str] = None, start_index: int = 0, max_results: int = 10, api_key: Optional[str] = None) -> str:
     '''
     Builds a search URL for the Google Books API with the given parameters.
     Returns: a str, the complete search URL
     '''
-    base_link = "https://www.googleapis.com/books/v1/volumes"
+    base_link = f"{google_books.base_url}/volumes"
     params = {
         "q": f"intitle:{query}",
         "startIndex": start_index,
@@ -124,11 +366,491 @@ def search_url_build(query: str, order_by: Optional[str] = None, lg: Optional[st
 
 
 
-with app.app_context():
+def get_book_list(list_type: str, user: str) -> List[str]:
+    '''
+    Returns: a list, the book id's of one of the lists of a user, in the order they were added
+    '''
+    rows = db.session.query(BookListEntry.book_id).filter_by(user=user, list_type=list_type).order_by(BookListEntry.position, BookListEntry.id)
+    return [row.book_id for row in rows]
+
+def get_book_lists(list_type: str, users: List[str]) -> Dict[str, List[str]]:
+    '''
+    Loads one of the lists for many users with a single query.
+    Returns: a dict, user to the list of book id's
+    '''
+    book_lists: Dict[str, List[str]] = {user: [] for user in users}
+    if not users:
+        return book_lists
+
+    rows = (db.session.query(BookListEntry.user, BookListEntry.book_id)
+            .filter(BookListEntry.list_type == list_type, BookListEntry.user.in_(users))
+            .order_by(BookListEntry.user, BookListEntry.position, BookListEntry.id))
+    for row in rows:
+        book_lists[row.user].append(row.book_id)
+    return book_lists
+
+def set_book_list(list_type: str, user: str, book_ids: List[str]) -> None:
+    '''
+    Replaces one of the lists of a user, duplicate book id's are stored once. The caller commits the session.
+    '''
+    book_ids = list(dict.fromkeys(book_ids))
+    if list_type == Favorite.LIST_TYPE:
+        # pending changes are not flushed yet, so the database is not locked during the upstream calls
+        with db.session.no_autoflush:
+            old_book_ids = get_book_list(list_type, user)
+            new_book_id_set, old_book_id_set = set(book_ids), set(old_book_ids)
+            added = [book_id for book_id in book_ids if book_id not in old_book_id_set]
+            removed = [book_id for book_id in old_book_ids if book_id not in new_book_id_set]
+            genres = learn_book_genres(added + pending_favorites(user)) if added else {}
+        update_favorite_aggregates(user, added, removed, {**genres, **known_book_genres(removed)})
+
+    BookListEntry.query.filter_by(user=user, list_type=list_type).delete()
+    if book_ids:
+        # one executemany, the orm would insert the entries one by one to read back their ids
+        db.session.execute(insert(BookListEntry), [{"user": user, "list_type": list_type, "book_id": book_id, "position": position}
+                                                   for position, book_id in enumerate(book_ids)])
+    bump_book_list_revision(list_type, user)
+
+def add_book_to_list(list_type: str, user: str, book_id: str) -> bool:
+    '''
+    Adds a book id to the end of one of the lists of a user and commits the session.
+    The unique constraint makes sure concurrent requests can not add the same book twice.
+    Returns: a bool, True if the book was added, False if it was already in the list
+    '''
+    # pending changes are not flushed yet, so the database is not locked during the upstream call
+    with db.session.no_autoflush:
+        if BookListEntry.query.filter_by(user=user, list_type=list_type, book_id=book_id).first():
+            return False
+        genres = learn_book_genres([book_id] + pending_favorites(user)) if list_type == Favorite.LIST_TYPE else {}
+
+    last_position = db.session.query(func.max(BookListEntry.position)).filter_by(user=user, list_type=list_type).scalar()
+    position = 0 if last_position is None else last_position + 1
+    db.session.add(BookListEntry(user=user, list_type=list_type, book_id=book_id, position=position))
+    if list_type == Favorite.LIST_TYPE:
+        update_favorite_aggregates(user, [book_id], [], genres)
+    bump_book_list_revision(list_type, user)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+def remove_book_from_list(list_type: str, user: str, book_id: str) -> bool:
+    '''
+    Removes a book id from one of the lists of a user and commits the session.
+    Returns: a bool, True if the book was removed, False if it was not in the list
+    '''
+    if not BookListEntry.query.filter_by(user=user, list_type=list_type, book_id=book_id).first():
+        return False
+
+    genres = known_book_genres([book_id]) if list_type == Favorite.LIST_TYPE else {}
+
+    removed = BookListEntry.query.filter_by(user=user, list_type=list_type, book_id=book_id).delete()
+    if removed and list_type == Favorite.LIST_TYPE:
+        update_favorite_aggregates(user, [], [book_id], genres)
+    bump_book_list_revision(list_type, user)
+    db.session.commit()
+    return removed > 0
+
+def apply_book_list_operations(list_type: str, user: str, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''
+    Applies add, remove and move operations to one of the lists of a user in order, in memory first,
+    then writes the changes with a few statements. The list is created when the user has none and an operation
+    changed it. The caller commits the session.
+    An operation is {"op": "add" | "remove", "book_id": ...} or {"op": "move", "book_id": ..., "position": ...},
+    moves use the 0 based position in the list after the operations before it.
+    Returns: a list, the result of every operation
+    '''
+    rows = (db.session.query(BookListEntry.id, BookListEntry.book_id, BookListEntry.position)
+            .filter_by(user=user, list_type=list_type).order_by(BookListEntry.position, BookListEntry.id).all())
+    book_ids = [row.book_id for row in rows]
+    old_book_ids = {row.book_id: row for row in rows}
+    in_list = set(book_ids)
+    moved = False
+
+    results = []
+    for operation in operations:
+        op = operation.get("op") if isinstance(operation, dict) else None
+        book_id = operation.get("book_id") if isinstance(operation, dict) else None
+        result: Dict[str, Any] = {"op": op, "book_id": book_id, "success": False}
+        results.append(result)
+        if op not in ("add", "remove", "move"):
+            result["error"] = "op should be add, remove or move"
+        elif not isinstance(book_id, str) or not book_id:
+            result["error"] = "book_id is missing"
+        elif op == "add":
+            if book_id in in_list:
+                result["error"] = "book is already in the list"
+            else:
+                book_ids.append(book_id)
+                in_list.add(book_id)
+                # a book that is removed and added again keeps its row but goes to the end of the list
+                moved = moved or book_id in old_book_ids
+                result["success"] = True
+        elif book_id not in in_list:
+            result["error"] = "book is not in the list"
+        elif op == "remove":
+            book_ids.remove(book_id)
+            in_list.discard(book_id)
+            result["success"] = True
+        else:
+            position = operation.get("position")
+            if not isinstance(position, int) or isinstance(position, bool) or position < 0:
+                result["error"] = "position should be a number of 0 or more"
+            else:
+                book_ids.remove(book_id)
+                book_ids.insert(min(position, len(book_ids)), book_id)
+                moved = True
+                result["success"] = True
+
+    added = [book_id for book_id in book_ids if book_id not in old_book_ids]
+    removed = [row.book_id for row in rows if row.book_id not in in_list]
+    if not added and not removed and not moved:
+        return results
+
+    if list_type == Favorite.LIST_TYPE:
+        # pending changes are not flushed yet, so the database is not locked during the upstream calls
+        with db.session.no_autoflush:
+            genres = learn_book_genres(added + pending_favorites(user)) if added else {}
+        update_favorite_aggregates(user, added, removed, {**genres, **known_book_genres(removed)})
+
+    model = BOOK_LIST_MODELS[list_type]
+    if not db.session.get(model, user):
+        # added after the upstream calls, a pending row would be flushed by the first query and lock the database
+        db.session.add(model(user=user))
+    if removed:
+        BookListEntry.query.filter(BookListEntry.id.in_([old_book_ids[book_id].id for book_id in removed])).delete(synchronize_session=False)
+    if moved:
+        # the whole list is renumbered, only the rows that get another position are updated
+        changed = [{"id": old_book_ids[book_id].id, "position": position} for position, book_id in enumerate(book_ids)
+                   if book_id in old_book_ids and old_book_ids[book_id].position != position]
+        if changed:
+            db.session.execute(update(BookListEntry), changed)
+        positions = {book_id: position for position, book_id in enumerate(book_ids)}
+    else:
+        # added books go to the end of the list, the other rows keep their position
+        next_position = max((row.position for row in rows), default=-1) + 1
+        positions = {book_id: next_position + index for index, book_id in enumerate(added)}
+    if added:
+        db.session.execute(insert(BookListEntry), [{"user": user, "list_type": list_type, "book_id": book_id, "position": positions[book_id]}
+                                                   for book_id in added])
+    bump_book_list_revision(list_type, user)
+    return results
+
+def bump_book_list_revision(list_type: str, user: str) -> None:
+    '''
+    Increases the revision of one of the lists of a user. The caller commits the session.
+    '''
+    model = BOOK_LIST_MODELS[list_type]
+    model.query.filter_by(user=user).update({model.revision: model.revision + 1}, synchronize_session=False)
+
+def get_book_list_revisions(user: str) -> tuple:
+    '''
+    Returns: a tuple, the revision of each list of the user, None for lists the user does not have
+    '''
+    return tuple(db.session.query(model.revision).filter_by(user=user).scalar() for model in BOOK_LIST_MODELS.values())
+
+def update_favorite_aggregates(user: str, added: List[str], removed: List[str], genres: Dict[str, List[str]]) -> None:
+    '''
+    Keeps the favorite counts of the books and the genre profile of the user up to date
+    after books were added to or removed from the favorites of user. The changes are summed first,
+    so every table gets a few statements however many books changed. The caller commits the session.
+    '''
+    favorite_changes: Dict[str, int] = {}
+    genre_changes: Dict[str, int] = {}
+    for book_ids, change in ((added, 1), (removed, -1)):
+        for book_id in book_ids:
+            favorite_changes[book_id] = favorite_changes.get(book_id, 0) + change
+            for genre in genres.get(book_id, []):
+                genre_changes[genre] = genre_changes.get(genre, 0) + change
+    change_favorite_counts(favorite_changes)
+    change_genre_counts(user, genre_changes)
+
+def book_genres(book: Dict[str, Any]) -> List[str]:
+    '''
+    Splits the categories of a book, like "Fiction / Fantasy / Epic", into genres.
+    Returns: a list, every genre of the book once
+    '''
+    genres_per_book: list = []
+    # check if book has categories
+    if "volumeInfo" in book and "categories" in book["volumeInfo"]:
+        # we only want to get one of each genre per book.
+        for genre in book["volumeInfo"]["categories"]:
+            for book_genre in genre.split('/'):
+                book_genre = book_genre.strip()
+                if book_genre not in genres_per_book:
+                    genres_per_book.append(book_genre)
+    return genres_per_book
+
+def fetch_book_genres(book_ids: List[str], deadline: Optional[float] = None) -> Dict[str, List[str]]:
+    '''
+    Fetches the books concurrently, mostly from the volume cache, and returns their genres.
+    Books that do not exist have no genres, books that failed or were not fetched before the deadline are left out.
+    Returns: a dict, book id to the list of genres
+    '''
+    if not book_ids:
+        return {}
+    books, _ = fan_out.map(fetch_volume, book_ids, deadline=deadline)
+    return {book_id: book_genres(book) for book_id, book in books.items()
+            if is_final_volume(book)}
+
+def known_book_genres(book_ids: List[str]) -> Dict[str, List[str]]:
+    '''
+    Returns: a dict, book id to the stored genres of the books, pending books are left out
+    '''
+    if not book_ids:
+        return {}
+    return {row.book_id: row.genres for row in BookGenre.query.filter(BookGenre.book_id.in_(set(book_ids)))}
+
+def pending_favorites(user: str, limit: int = 10) -> List[str]:
+    '''
+    Returns: a list, favorites of user whose genres could not be fetched yet, at most limit
+    '''
+    rows = (db.session.query(BookListEntry.book_id)
+            .outerjoin(BookGenre, BookGenre.book_id == BookListEntry.book_id)
+            .filter(BookListEntry.user == user, BookListEntry.list_type == Favorite.LIST_TYPE, BookGenre.book_id.is_(None))
+            .order_by(BookListEntry.position).limit(limit))
+    return [row.book_id for row in rows]
+
+def learn_book_genres(book_ids: List[str], deadline: Optional[float] = None) -> Dict[str, List[str]]:
+    '''
+    Stores the genres of the books that have none stored yet. Users that already have one of these books
+    as a pending favorite get its genres added to their genre profile. The caller commits the session.
+    Returns: a dict, book id to the genres of every book that is known now, books that failed are left out
+    '''
+    genres = known_book_genres(book_ids)
+    new_genres = fetch_book_genres([book_id for book_id in dict.fromkeys(book_ids) if book_id not in genres], deadline)
+    if not new_genres:
+        return genres
+
+    db.session.execute(sqlite_insert(BookGenre).on_conflict_do_nothing(),
+                       [{"book_id": book_id, "genres": book_genres} for book_id, book_genres in new_genres.items()])
+    favorites = (db.session.query(BookListEntry.user, BookListEntry.book_id)
+                 .filter(BookListEntry.list_type == Favorite.LIST_TYPE, BookListEntry.book_id.in_(list(new_genres))))
+    genre_changes: Dict[tuple, int] = {}
+    for favorite in favorites:
+        for genre in new_genres[favorite.book_id]:
+            genre_changes[(favorite.user, genre)] = genre_changes.get((favorite.user, genre), 0) + 1
+    apply_count_changes(UserGenre.__table__, "genre_count", [
+        ({"user": user, "genre": genre}, change) for (user, genre), change in genre_changes.items()
+    ])
+    return {**genres, **new_genres}
+
+def change_genre_counts(user: str, changes: Dict[str, int]) -> None:
+    '''
+    Adds the change of every genre to its count in the genre profile of user, genres that reach 0 are removed.
+    The caller commits the session.
+    '''
+    apply_count_changes(UserGenre.__table__, "genre_count", [
+        ({"user": user, "genre": genre}, change) for genre, change in changes.items()
+    ])
+    if any(change < 0 for change in changes.values()):
+        UserGenre.query.filter(UserGenre.user == user, UserGenre.genre_count <= 0).delete()
+
+def all_pending_favorites() -> List[str]:
+    '''
+    Returns: a list, every favorite book whose genres could not be fetched yet
+    '''
+    rows = (db.session.query(BookListEntry.book_id).distinct()
+            .outerjoin(BookGenre, BookGenre.book_id == BookListEntry.book_id)
+            .filter(BookListEntry.list_type == Favorite.LIST_TYPE, BookGenre.book_id.is_(None)))
+    return [row.book_id for row in rows]
+
+def rebuild_genre_profiles() -> None:
+    '''
+    Fetches the genres of the favorites that have none stored, then recomputes the genre profile of every user
+    from the stored genres. The fetch gets GENRE_FETCH_DEADLINE instead of the deadline of a request.
+    The caller commits the session.
+    '''
+    fetched = fetch_book_genres(all_pending_favorites(), current_app.config["GENRE_FETCH_DEADLINE"])
+    if fetched:
+        db.session.execute(sqlite_insert(BookGenre).on_conflict_do_nothing(),
+                           [{"book_id": book_id, "genres": genres} for book_id, genres in fetched.items()])
+
+    UserGenre.query.delete()
+    favorites = (db.session.query(BookListEntry.user, BookGenre.genres)
+                 .join(BookGenre, BookGenre.book_id == BookListEntry.book_id)
+                 .filter(BookListEntry.list_type == Favorite.LIST_TYPE))
+    genre_ranking: Dict[tuple, int] = {}
+    for favorite in favorites.yield_per(1000):
+        for genre in favorite.genres:
+            genre_ranking[(favorite.user, genre)] = genre_ranking.get((favorite.user, genre), 0) + 1
+    if genre_ranking:
+        db.session.execute(insert(UserGenre), [{"user": user, "genre": genre, "genre_count": count}
+                                               for (user, genre), count in genre_ranking.items()])
+
+def repair_genre_profiles() -> int:
+    '''
+    Retries the favorites whose genres could not be fetched, with GENRE_FETCH_DEADLINE,
+    and adds the genres that were fetched to the genre profiles. The caller commits the session.
+    Returns: an int, the amount of favorite books that are still pending
+    '''
+    pending = all_pending_favorites()
+    learned = learn_book_genres(pending, current_app.config["GENRE_FETCH_DEADLINE"]) if pending else {}
+    return len(pending) - len(learned)
+
+def change_favorite_counts(changes: Dict[str, int]) -> None:
+    '''
+    Adds the change of every book id to its favorite count. The caller commits the session.
+    '''
+    apply_count_changes(BookPopularity.__table__, "favorite_count", [
+        ({"book_id": book_id}, change) for book_id, change in changes.items()
+    ])
+
+def apply_count_changes(table: Any, column: str, changes: List[Tuple[Dict[str, Any], int]]) -> None:
+    '''
+    Adds changes to a count column, every change is (primary key values, change).
+    Increases are one upsert for all rows and decreases one update, so concurrent requests do not lose updates
+    and a decrease never creates a row.
+    '''
+    increases = [{**key, column: change} for key, change in changes if change > 0]
+    if increases:
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(increases[0].keys())[:-1],
+            set_={column: table.c[column] + statement.excluded[column]}
+        )
+        db.session.execute(statement, increases)
+
+    decreases = [{**{f"key_{name}": value for name, value in key.items()}, "change": change} for key, change in changes if change < 0]
+    if decreases:
+        statement = (update(table)
+                     .where(*[table.c[name] == bindparam(f"key_{name}") for name in changes[0][0]])
+                     .values({column: table.c[column] + bindparam("change")}))
+        db.session.execute(statement, decreases)
+
+def rebuild_favorite_counts() -> None:
+    '''
+    Recounts the favorite count of every book from BookListEntry. The caller commits the session.
+    '''
+    BookPopularity.query.delete()
+    favorite_counts = (select(BookListEntry.book_id, func.count(BookListEntry.id))
+                       .where(BookListEntry.list_type == Favorite.LIST_TYPE)
+                       .group_by(BookListEntry.book_id))
+    db.session.execute(insert(BookPopularity).from_select(["book_id", "favorite_count"], favorite_counts))
+
+def rating_bucket(rating: float) -> int:
+    '''
+    Returns: an int, the histogram bucket (1 to 5 stars) of a rating, ratings are rounded half up
+    '''
+    return min(max(int(rating + 0.5), 1), 5)
+
+def change_book_rating(book_id: str, rating: float, change: int) -> None:
+    '''
+    Adds (change=1) or removes (change=-1) a rating from the rating aggregate of a book,
+    with an upsert so concurrent reviews do not lose updates. The caller commits the session.
+    '''
+    bucket = f"rating_{rating_bucket(rating)}"
+    values = {"book_id": book_id, "review_count": max(change, 0), "rating_sum": rating * max(change, 0)}
+    values.update({f"rating_{stars}": 0 for stars in range(1, 6)})
+    values[bucket] = max(change, 0)
+
+    statement = sqlite_insert(BookRating).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[BookRating.book_id],
+        set_={
+            "review_count": BookRating.review_count + change,
+            "rating_sum": BookRating.rating_sum + rating * change,
+            bucket: getattr(BookRating, bucket) + change
+        }
+    )
+    db.session.execute(statement)
+
+def rebuild_book_ratings() -> None:
+    '''
+    Recomputes the rating aggregate of every book from the reviews. The caller commits the session.
+    '''
+    BookRating.query.delete()
+    # the same buckets as rating_bucket, computed by SQLite so millions of reviews are aggregated in one statement
+    bucket = func.min(func.max(cast(Review.rating + 0.5, Integer), 1), 5)
+    book_ratings = (select(Review.book_id, func.count(Review.id), func.sum(Review.rating),
+                           *[func.sum(case((bucket == stars, 1), else_=0)) for stars in range(1, 6)])
+                    .group_by(Review.book_id))
+    columns = ["book_id", "review_count", "rating_sum"] + [f"rating_{stars}" for stars in range(1, 6)]
+    db.session.execute(insert(BookRating).from_select(columns, book_ratings))
+
+def rename_book_list(list_type: str, old_user: str, new_user: str) -> None:
+    '''
+    Moves one of the lists of a user to another user name. The caller commits the session.
+    '''
+    BookListEntry.query.filter_by(user=old_user, list_type=list_type).update({"user": new_user})
+    if list_type == Favorite.LIST_TYPE:
+        UserGenre.query.filter_by(user=old_user).update({"user": new_user})
+
+def migrate_json_book_lists() -> int:
+    '''
+    Moves the book id's from the old book_list_id json columns to BookListEntry.
+    Migrated rows get an empty book_list_id, so running it again does nothing.
+    Returns: an int, the amount of book id's that were moved
+    '''
+    moved = 0
+    for list_type, model in BOOK_LIST_MODELS.items():
+        for book_list in model.query.filter(model.book_list_id.isnot(None)).all():
+            book_ids = (book_list.book_list_id or {}).get("list", [])
+            if not BookListEntry.query.filter_by(user=book_list.user, list_type=list_type).first():
+                set_book_list(list_type, book_list.user, book_ids)
+                moved += len(book_ids)
+            book_list.book_list_id = db.null()
+    db.session.commit()
+    return moved
+
+def create_missing_columns() -> None:
+    '''
+    Adds the columns that db.create_all() does not add to tables that already exist.
+    '''
+    for model in BOOK_LIST_MODELS.values():
+        columns = {column["name"] for column in inspect(db.engine).get_columns(model.__tablename__)}
+        if "revision" not in columns:
+            db.session.execute(text(f"ALTER TABLE {model.__tablename__} ADD COLUMN revision INTEGER NOT NULL DEFAULT 0"))
+    db.session.commit()
+
+def create_missing_indexes() -> None:
+    '''
+    Creates the indexes that db.create_all() does not add to tables that already exist.
+    Duplicate reviews of the same user and book are removed first, keeping the oldest one,
+    because they would break the unique index.
+    '''
+    existing_indexes = {index["name"] for index in inspect(db.engine).get_indexes(Review.__tablename__)}
+    if "uq_review_user_book_id" not in existing_indexes:
+        oldest_reviews = db.session.query(func.min(Review.id)).group_by(Review.user, Review.book_id)
+        Review.query.filter(Review.id.not_in(oldest_reviews)).delete(synchronize_session=False)
+        db.session.commit()
+
+    for index in Review.__table__.indexes:
+        if index.name not in existing_indexes:
+            index.create(db.engine)
+
+def upgrade_db() -> None:
+    '''
+    Creates the missing tables and migrates the data of older databases.
+    '''
     db.create_all()
+    create_missing_columns()
+    create_missing_indexes()
+    if not BookPopularity.query.first():
+        rebuild_favorite_counts()
+    if not BookRating.query.first():
+        rebuild_book_ratings()
+    # genre profiles from before the genres were stored per book are rebuilt once, later runs retry pending favorites
+    if not UserGenre.query.first() or not BookGenre.query.first():
+        rebuild_genre_profiles()
+    else:
+        repair_genre_profiles()
+    db.session.commit()
+    migrate_json_book_lists()
+
 
+@bp.cli.command("upgrade-db")
+def upgrade_db_command() -> None:
+    '''
+    Upgrades the database, run with: flask --app app upgrade-db
+    '''
+    upgrade_db()
+    print("Database is up to date.")
 
-@app.route("/")
+
+@bp.route("/")
 def home() -> Any:
     '''
     Home route that returns a welcome message.
@@ -137,18 +859,84 @@ def home() -> Any:
     return jsonify({"message": "Welcome to BookBuddy"})
 
 
+def observe_upstream(target: str, seconds: float, status: str) -> None:
+    '''
+    Records an upstream call in the metrics and in the accounting of the current request.
+    '''
+    metrics.observe_upstream(target, seconds, status)
+    request_accounting.count_upstream(target)
+
+
+@bp.route("/metrics", methods=["GET"])
+def get_metrics() -> Any:
+    '''
+    Returns the metrics of this worker in the Prometheus text format: requests and latency per route,
+    SQL queries per request, upstream calls per target and the counters of the caches.
+    '''
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def book_lists_response(model: Any, key: str) -> Any:
+    '''
+    Returns a page of the lists of one list type, ordered by user.
+    The book id's of the whole page are loaded with one query.
+    '''
+    def fetch_page(after: Optional[list], limit: int) -> list:
+        query = model.query.order_by(model.user)
+        if after:
+            query = query.filter(model.user > after[0])
+        return query.limit(limit).all()
+
+    def serialize_page(book_list_rows: list) -> list:
+        book_lists = get_book_lists(model.LIST_TYPE, [row.user for row in book_list_rows])
+        return [row.to_dict(book_lists[row.user]) for row in book_list_rows]
+
+    return collection_response(fetch_page, lambda row: [row.user], serialize_page, lambda items: {key: items})
+
+
+def bulk_book_list_response(model: Any, user_id: str) -> Any:
+    '''
+    Applies the operations in the request body to one of the lists of a user in one transaction,
+    the list is created when the user has none and one of the operations succeeds.
+    request body:
+    {
+        "operations": [
+            {"op": "add", "book_id": "book id 1"},
+            {"op": "move", "book_id": "book id 1", "position": 0},
+            {"op": "remove", "book_id": "book id 2"}
+        ]
+    }
+    Returns: a json response with the result of every operation and the list after the operations
+    '''
+    data = request.get_json(silent=True)
+    operations = data.get("operations") if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({"error": "operations should be a list"}), 400
+    if len(operations) > current_app.config['BULK_MAX_OPERATIONS']:
+        return jsonify({"error": f"a maximum of {current_app.config['BULK_MAX_OPERATIONS']} operations can be applied at once"}), 400
+
+    try:
+        results = apply_book_list_operations(model.LIST_TYPE, user_id, operations)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "the list was changed by another request, please try again"}), 409
+
+    book_list = db.session.get(model, user_id) or model(user=user_id)
+    return jsonify({"results": results, "data": book_list.to_dict()})
+
+
 #region favorite app routes
-@app.route("/favorites", methods=["GET"])
+@bp.route("/favorites", methods=["GET"])
 def get_favorites() -> Any:
     '''
-    Returns all favorites stored in the database.
-    The return is a list of book id's
+    Returns all favorites stored in the database, a page at a time.
+    The return is a list of book id's, see book_lists_response for the paging parameters.
     '''
-    favorites = Favorite.query.all()
-    return jsonify({"favorites": [favorite.to_dict() for favorite in favorites]})
+    return book_lists_response(Favorite, "favorites")
 
 
-@app.route("/favorites/<string:user_id>", methods=["GET"])
+@bp.route("/favorites/<string:user_id>", methods=["GET"])
 def get_favorite(user_id: str) -> Any:
     '''
     Returns users favorites according to user id.
@@ -161,7 +949,7 @@ def get_favorite(user_id: str) -> Any:
     else:
         return jsonify({"error": f"favorite not found for user: {user_id}"}), 404
 
-@app.route("/favorite_books/<string:user_id>", methods=["GET"])
+@bp.route("/favorite_books/<string:user_id>", methods=["GET"])
 def get_favorite_books(user_id: str) -> Any:
     '''
     Returns users favorite books according to the user id.
@@ -170,16 +958,11 @@ def get_favorite_books(user_id: str) -> Any:
     favorite = Favorite.query.get(user_id)
     
     if favorite:
-        favorite_list = favorite.to_dict()['book_list_id']['list']
-        book_list = []
-        for fav in favorite_list:
-            book = get_book_by_id(fav)
-            book_list.append(book)
-        return jsonify(book_list)
+        return book_objects_response(favorite)
     else:
         return jsonify({"error": f"favorite not found for user: {user_id}"}), 404
 
-@app.route("/favorites", methods=["POST"])
+@bp.route("/favorites", methods=["POST"])
 def post_favorites() -> Any:
     '''
     Creates favorites for user. 
@@ -197,14 +980,15 @@ def post_favorites() -> Any:
     '''
     data = request.get_json()
     
-    new_favorite = Favorite(user=data["user"], book_list_id=data["book_list_id"])
+    new_favorite = Favorite(user=data["user"])
 
     db.session.add(new_favorite)
+    set_book_list(Favorite.LIST_TYPE, new_favorite.user, data["book_list_id"]["list"])
     db.session.commit()
 
     return jsonify(new_favorite.to_dict()), 201
 
-@app.route("/favorites/<string:user_id>", methods=["PUT"])
+@bp.route("/favorites/<string:user_id>", methods=["PUT"])
 def update_favorites(user_id: str) -> Any:
     '''
     Updates favorites for user.
@@ -224,8 +1008,12 @@ def update_favorites(user_id: str) -> Any:
 
     favorite = Favorite.query.get(user_id)
     if favorite:
-        favorite.user = data.get('user', favorite.user)
-        favorite.book_list_id = data.get('book_list_id', favorite.book_list_id)
+        new_user = data.get('user', favorite.user)
+        if new_user != favorite.user:
+            rename_book_list(Favorite.LIST_TYPE, favorite.user, new_user)
+            favorite.user = new_user
+        if 'book_list_id' in data:
+            set_book_list(Favorite.LIST_TYPE, favorite.user, data['book_list_id']['list'])
 
         db.session.commit()
         return jsonify(favorite.to_dict())
@@ -233,7 +1021,7 @@ def update_favorites(user_id: str) -> Any:
         return jsonify({"error": "favorite not found"}), 404
 
 
-@app.route("/favorites/<string:user_id>", methods=["DELETE"])
+@bp.route("/favorites/<string:user_id>", methods=["DELETE"])
 def delete_favorites(user_id: str) -> Any:
     '''
     Deletes the favorites of user with user_id.
@@ -241,13 +1029,14 @@ def delete_favorites(user_id: str) -> Any:
     favorite = Favorite.query.get(user_id)
     if favorite:
         db.session.delete(favorite)
+        set_book_list(Favorite.LIST_TYPE, user_id, [])
         db.session.commit()
 
         return jsonify({"message": "favorite was deleted"})
     else:
         return jsonify({"error": "favorite not found"}), 404
     
-@app.route("/favorites/<string:user_id>/add/<string:book_id>", methods=["POST"])
+@bp.route("/favorites/<string:user_id>/add/<string:book_id>", methods=["POST"])
 def add_book_id_to_favorites(user_id: str, book_id: str) -> Any:
     '''
     The post request does not need body information, the book_id is given in the url of the request.
@@ -255,20 +1044,17 @@ def add_book_id_to_favorites(user_id: str, book_id: str) -> Any:
 
     favorite = Favorite.query.get(user_id)
     if favorite:
-        if book_id not in favorite.book_list_id['list']:
-            favorite.book_list_id['list'].append(book_id)
-            flag_modified(favorite, 'book_list_id')
-            db.session.commit()
+        add_book_to_list(Favorite.LIST_TYPE, user_id, book_id)
         return jsonify({'success': True, 'data': favorite.to_dict()})
     else:
         # Create new favorite list for user
-        new_favorite = Favorite(user=user_id, book_list_id={'list': [book_id]})
+        new_favorite = Favorite(user=user_id)
         db.session.add(new_favorite)
-        db.session.commit()
+        add_book_to_list(Favorite.LIST_TYPE, user_id, book_id)
         return jsonify({'success': True, 'data': new_favorite.to_dict()}), 201
 
 
-@app.route("/favorites/<string:user_id>/delete/<string:book_id>", methods=["POST"])
+@bp.route("/favorites/<string:user_id>/delete/<string:book_id>", methods=["POST"])
 def delete_book_id_to_favorites(user_id: str, book_id: str) -> Any:
     '''
     The post request does not need body information, the book_id is given in the url of the request
@@ -276,31 +1062,33 @@ def delete_book_id_to_favorites(user_id: str, book_id: str) -> Any:
 
     favorite = Favorite.query.get(user_id)
     if favorite:
-        favorite.book_list_id['list'].remove(book_id)
-
-        flag_modified(favorite, 'book_list_id')
-        db.session.commit()
+        remove_book_from_list(Favorite.LIST_TYPE, user_id, book_id)
         return jsonify({'created': favorite.to_dict()})
     else:
         return jsonify({'error': 'user not found'}), 404
 
 
-    
+@bp.route("/favorites/<string:user_id>/bulk", methods=["POST"])
+def bulk_favorites(user_id: str) -> Any:
+    '''
+    Adds, removes and moves many books at once, see bulk_book_list_response for the request body.
+    '''
+    return bulk_book_list_response(Favorite, user_id)
+
 #endregion
 
 
 #region read book app routes
-@app.route("/read_books", methods=["GET"])
+@bp.route("/read_books", methods=["GET"])
 def get_read_books() -> Any:
     '''
-    Returns all read books stored in the database.
-    The return is a list of book id's
+    Returns all read books stored in the database, a page at a time.
+    The return is a list of book id's, see book_lists_response for the paging parameters.
     '''
-    read_books = ReadBooks.query.all()
-    return jsonify({"read books": [read_book.to_dict() for read_book in read_books]})
+    return book_lists_response(ReadBooks, "read books")
 
 
-@app.route("/read_books/<string:user_id>", methods=["GET"])
+@bp.route("/read_books/<string:user_id>", methods=["GET"])
 def get_read_book(user_id: str) -> Any:
     '''
     Returns users read books according to user id.
@@ -313,7 +1101,7 @@ def get_read_book(user_id: str) -> Any:
     else:
         return jsonify({"error": f"read_book not found for user: {user_id}"}), 404
 
-@app.route("/read_book_objects/<string:user_id>", methods=["GET"])
+@bp.route("/read_book_objects/<string:user_id>", methods=["GET"])
 def get_read_book_object(user_id: str) -> Any:
     '''
     Returns users read books according to the user id.
@@ -322,16 +1110,11 @@ def get_read_book_object(user_id: str) -> Any:
     read_books = ReadBooks.query.get(user_id)
     
     if read_books:
-        read_book_list = read_books.to_dict()['book_list_id']['list']
-        book_list = []
-        for read in read_book_list:
-            book = get_book_by_id(read)
-            book_list.append(book)
-        return jsonify(book_list)
+        return book_objects_response(read_books)
     else:
         return jsonify({"error": f"read_book not found for user: {user_id}"}), 404
 
-@app.route("/read_books", methods=["POST"])
+@bp.route("/read_books", methods=["POST"])
 def post_read_books() -> Any:
     '''
     Creates read books for user. 
@@ -349,14 +1132,15 @@ def post_read_books() -> Any:
     '''
     data = request.get_json()
     
-    new_read_book = ReadBooks(user=data["user"], book_list_id=data["book_list_id"])
+    new_read_book = ReadBooks(user=data["user"])
 
     db.session.add(new_read_book)
+    set_book_list(ReadBooks.LIST_TYPE, new_read_book.user, data["book_list_id"]["list"])
     db.session.commit()
 
     return jsonify(new_read_book.to_dict()), 201
 
-@app.route("/read_books/<string:user_id>", methods=["PUT"])
+@bp.route("/read_books/<string:user_id>", methods=["PUT"])
 def update_read_books(user_id: str) -> Any:
     '''
     Updates read books for user.
@@ -376,8 +1160,12 @@ def update_read_books(user_id: str) -> Any:
 
     read_book = ReadBooks.query.get(user_id)
     if read_book:
-        read_book.user = data.get('user', read_book.user)
-        read_book.book_list_id = data.get('book_list_id', read_book.book_list_id)
+        new_user = data.get('user', read_book.user)
+        if new_user != read_book.user:
+            rename_book_list(ReadBooks.LIST_TYPE, read_book.user, new_user)
+            read_book.user = new_user
+        if 'book_list_id' in data:
+            set_book_list(ReadBooks.LIST_TYPE, read_book.user, data['book_list_id']['list'])
 
         db.session.commit()
         return jsonify(read_book.to_dict())
@@ -385,7 +1173,7 @@ def update_read_books(user_id: str) -> Any:
         return jsonify({"error": "read_book not found"}), 404
 
 
-@app.route("/read_books/<string:user_id>", methods=["DELETE"])
+@bp.route("/read_books/<string:user_id>", methods=["DELETE"])
 def delete_read_books(user_id: str) -> Any:
     '''
     Deletes the read books of user with user_id.
@@ -393,6 +1181,7 @@ def delete_read_books(user_id: str) -> Any:
     read_book = ReadBooks.query.get(user_id)
     if read_book:
         db.session.delete(read_book)
+        set_book_list(ReadBooks.LIST_TYPE, user_id, [])
         db.session.commit()
 
         return jsonify({"message": "read_book was deleted"})
@@ -400,7 +1189,7 @@ def delete_read_books(user_id: str) -> Any:
         return jsonify({"error": "read_book not found"}), 404
 
 
-@app.route("/read_books/<string:user_id>/add/<string:book_id>", methods=["POST"])
+@bp.route("/read_books/<string:user_id>/add/<string:book_id>", methods=["POST"])
 def add_book_id_to_read_books(user_id: str, book_id: str) -> Any:
     '''
     The post request does not need body information, the book_id is given in the url of the request
@@ -408,20 +1197,17 @@ def add_book_id_to_read_books(user_id: str, book_id: str) -> Any:
 
     read_book = ReadBooks.query.get(user_id)
     if read_book:
-        if book_id not in read_book.book_list_id['list']:
-            read_book.book_list_id['list'].append(book_id)
-            flag_modified(read_book, 'book_list_id')
-            db.session.commit()
+        add_book_to_list(ReadBooks.LIST_TYPE, user_id, book_id)
         return jsonify({'success': True, 'data': read_book.to_dict()})
     else:
         # Create new read books list for user
-        new_read_book = ReadBooks(user=user_id, book_list_id={'list': [book_id]})
+        new_read_book = ReadBooks(user=user_id)
         db.session.add(new_read_book)
-        db.session.commit()
+        add_book_to_list(ReadBooks.LIST_TYPE, user_id, book_id)
         return jsonify({'success': True, 'data': new_read_book.to_dict()}), 201
 
 
-@app.route("/read_books/<string:user_id>/delete/<string:book_id>", methods=["POST"])
+@bp.route("/read_books/<string:user_id>/delete/<string:book_id>", methods=["POST"])
 def delete_book_id_to_read_books(user_id: str, book_id: str) -> Any:
     '''
     The post request does not need body information, the book_id is given in the url of the request
@@ -429,31 +1215,34 @@ def delete_book_id_to_read_books(user_id: str, book_id: str) -> Any:
 
     read_book = ReadBooks.query.get(user_id)
     if read_book:
-        read_book.book_list_id['list'].remove(book_id)
-
-        flag_modified(read_book, 'book_list_id')
-        db.session.commit()
+        remove_book_from_list(ReadBooks.LIST_TYPE, user_id, book_id)
         return jsonify({'created': read_book.to_dict()})
     else:
         return jsonify({'error': 'user not found'}), 404
 
 
 
+@bp.route("/read_books/<string:user_id>/bulk", methods=["POST"])
+def bulk_read_books(user_id: str) -> Any:
+    '''
+    Adds, removes and moves many books at once, see bulk_book_list_response for the request body.
+    '''
+    return bulk_book_list_response(ReadBooks, user_id)
+
 #endregion
 
 
 #region want to read app routes
-@app.route("/want_to_reads", methods=["GET"])
+@bp.route("/want_to_reads", methods=["GET"])
 def get_want_to_reads() -> Any:
     '''
-    Returns all want to read books stored in the database.
-    The return is a list of book id's
+    Returns all want to read books stored in the database, a page at a time.
+    The return is a list of book id's, see book_lists_response for the paging parameters.
     '''
-    want_to_reads = WantToRead.query.all()
-    return jsonify({"want to read books": [want_to_read.to_dict() for want_to_read in want_to_reads]})
+    return book_lists_response(WantToRead, "want to read books")
 
 
-@app.route("/want_to_reads/<string:user_id>", methods=["GET"])
+@bp.route("/want_to_reads/<string:user_id>", methods=["GET"])
 def get_want_to_read(user_id: str) -> Any:
     '''
     Returns users want to read books according to user id.
@@ -466,7 +1255,7 @@ def get_want_to_read(user_id: str) -> Any:
     else:
         return jsonify({"error": f"want_to_read not found for user: {user_id}"}), 404
 
-@app.route("/want_to_read_books/<string:user_id>", methods=["GET"])
+@bp.route("/want_to_read_books/<string:user_id>", methods=["GET"])
 def get_want_to_read_books(user_id: str) -> Any:
     '''
     Returns users want to read books according to the user id.
@@ -475,16 +1264,11 @@ def get_want_to_read_books(user_id: str) -> Any:
     want_to_reads = WantToRead.query.get(user_id)
     
     if want_to_reads:
-        want_to_read_list = want_to_reads.to_dict()['book_list_id']['list']
-        book_list = []
-        for read in want_to_read_list:
-            book = get_book_by_id(read)
-            book_list.append(book)
-        return jsonify(book_list)
+        return book_objects_response(want_to_reads)
     else:
         return jsonify({"error": f"want_to_read not found for user: {user_id}"}), 404
 
-@app.route("/want_to_reads", methods=["POST"])
+@bp.route("/want_to_reads", methods=["POST"])
 def post_want_to_read_books() -> Any:
     '''
     Creates want to read books for user. 
@@ -502,14 +1286,15 @@ def post_want_to_read_books() -> Any:
     '''
     data = request.get_json()
     
-    new_want_to_read = WantToRead(user=data["user"], book_list_id=data["book_list_id"])
+    new_want_to_read = WantToRead(user=data["user"])
 
     db.session.add(new_want_to_read)
+    set_book_list(WantToRead.LIST_TYPE, new_want_to_read.user, data["book_list_id"]["list"])
     db.session.commit()
 
     return jsonify(new_want_to_read.to_dict()), 201
 
-@app.route("/want_to_reads/<string:user_id>", methods=["PUT"])
+@bp.route("/want_to_reads/<string:user_id>", methods=["PUT"])
 def update_want_to_read(user_id: str) -> Any:
     '''
     Updates want to read books for user.
@@ -529,8 +1314,12 @@ def update_want_to_read(user_id: str) -> Any:
 
     want_to_read = WantToRead.query.get(user_id)
     if want_to_read:
-        want_to_read.user = data.get('user', want_to_read.user)
-        want_to_read.book_list_id = data.get('book_list_id', want_to_read.book_list_id)
+        new_user = data.get('user', want_to_read.user)
+        if new_user != want_to_read.user:
+            rename_book_list(WantToRead.LIST_TYPE, want_to_read.user, new_user)
+            want_to_read.user = new_user
+        if 'book_list_id' in data:
+            set_book_list(WantToRead.LIST_TYPE, want_to_read.user, data['book_list_id']['list'])
 
         db.session.commit()
         return jsonify(want_to_read.to_dict())
@@ -538,7 +1327,7 @@ def update_want_to_read(user_id: str) -> Any:
         return jsonify({"error": "want_to_reads not found"}), 404
 
 
-@app.route("/want_to_reads/<string:user_id>", methods=["DELETE"])
+@bp.route("/want_to_reads/<string:user_id>", methods=["DELETE"])
 def delete_want_to_read(user_id: str) -> Any:
     '''
     Deletes the want to read books of user with user_id.
@@ -546,6 +1335,7 @@ def delete_want_to_read(user_id: str) -> Any:
     want_to_read = WantToRead.query.get(user_id)
     if want_to_read:
         db.session.delete(want_to_read)
+        set_book_list(WantToRead.LIST_TYPE, user_id, [])
         db.session.commit()
 
         return jsonify({"message": "want_to_read was deleted"})
@@ -553,7 +1343,7 @@ def delete_want_to_read(user_id: str) -> Any:
         return jsonify({"error": "want_to_read not found"}), 404
     
 
-@app.route("/want_to_reads/<string:user_id>/add/<string:book_id>", methods=["POST"])
+@bp.route("/want_to_reads/<string:user_id>/add/<string:book_id>", methods=["POST"])
 def add_book_id_to_want_to_read(user_id: str, book_id: str) -> Any:
     '''
     The post request does not need body information, the book_id is given in the url of the request
@@ -561,20 +1351,17 @@ def add_book_id_to_want_to_read(user_id: str, book_id: str) -> Any:
 
     want_to_read = WantToRead.query.get(user_id)
     if want_to_read:
-        if book_id not in want_to_read.book_list_id['list']:
-            want_to_read.book_list_id['list'].append(book_id)
-            flag_modified(want_to_read, 'book_list_id')
-            db.session.commit()
+        add_book_to_list(WantToRead.LIST_TYPE, user_id, book_id)
         return jsonify({'success': True, 'data': want_to_read.to_dict()})
     else:
         # Create new want to read list for user
-        new_want_to_read = WantToRead(user=user_id, book_list_id={'list': [book_id]})
+        new_want_to_read = WantToRead(user=user_id)
         db.session.add(new_want_to_read)
-        db.session.commit()
+        add_book_to_list(WantToRead.LIST_TYPE, user_id, book_id)
         return jsonify({'success': True, 'data': new_want_to_read.to_dict()}), 201
 
 
-@app.route("/want_to_reads/<string:user_id>/delete/<string:book_id>", methods=["POST"])
+@bp.route("/want_to_reads/<string:user_id>/delete/<string:book_id>", methods=["POST"])
 def delete_book_id_to_want_to_read(user_id: str, book_id: str) -> Any:
     '''
     The post request does not need body information, the book_id is given in the url of the request
@@ -582,27 +1369,137 @@ def delete_book_id_to_want_to_read(user_id: str, book_id: str) -> Any:
 
     want_to_read = WantToRead.query.get(user_id)
     if want_to_read:
-        want_to_read.book_list_id['list'].remove(book_id)
-
-        flag_modified(want_to_read, 'book_list_id')
-        db.session.commit()
+        remove_book_from_list(WantToRead.LIST_TYPE, user_id, book_id)
         return jsonify({'created': want_to_read.to_dict()})
     else:
         return jsonify({'error': 'user not found'}), 404
 
 
+@bp.route("/want_to_reads/<string:user_id>/bulk", methods=["POST"])
+def bulk_want_to_read(user_id: str) -> Any:
+    '''
+    Adds, removes and moves many books at once, see bulk_book_list_response for the request body.
+    '''
+    return bulk_book_list_response(WantToRead, user_id)
+
 #endregion
 
 
-@app.route("/get_book/<string:book_id>", methods=["GET"])
+def fetch_volume(book_id: str) -> Dict[str, Any]:
+    '''
+    Returns a book object from the given book_id the same as the Google Books API.
+    The volume is served from the volume cache when possible, only existing volumes are cached.
+    '''
+    book = volume_cache.get(book_id)
+    if book is not None:
+        return book
+
+    book_request = google_books.get(f"/volumes/{book_id}", target="volume")
+    book = book_request.json()
+    if book.get("kind") == "books#volume":
+        volume_cache.set(book_id, book)
+    return book
+
+def is_final_volume(book: Dict[str, Any]) -> bool:
+    '''
+    Returns: a bool, True when the book exists or Google Books rejected its id (400 invalid, 404 unknown),
+    fetching it again would give the same result. Other errors can be gone on the next try.
+    '''
+    return book.get("kind") == "books#volume" or book.get("error", {}).get("code") in (400, 404)
+
+def register_volumes(books: List[Dict[str, Any]]) -> None:
+    '''
+    Records that the volumes in a Google Books search result exist, so reviews of them skip the upstream check.
+    '''
+    volume_cache.mark_verified(book["id"] for book in books if book.get("kind") == "books#volume" and book.get("id"))
+
+def book_objects_response(book_list: Any) -> Any:
+    '''
+    Returns the books of a list the same as Google Books, with an ETag of the list revision and its book id's.
+    The books are only fetched when the If-None-Match header of the client does not match, then a 304 response is sent.
+    '''
+    book_ids = get_book_list(book_list.LIST_TYPE, book_list.user)
+    etag = etag_of([book_list.LIST_TYPE, book_list.revision, book_ids])
+    response = not_modified(etag)
+    if response:
+        return response
+
+    books = fetch_volumes(book_ids)
+    response = jsonify(books)
+    # books that failed or were not fetched before the deadline make this an incomplete version, it is not tagged
+    if all(book.get("kind") == "books#volume" for book in books):
+        response.set_etag(etag)
+    return response
+
+def fetch_volumes(book_ids: List[str]) -> List[Dict[str, Any]]:
+    '''
+    Fetches the books of a list of book id's concurrently.
+    Returns: a list, the books in the same order as book_ids. A book that could not be fetched
+    before the deadline is replaced with an error object, like Google Books returns for unknown id's.
+    '''
+    books, errors = fan_out.map(fetch_volume, book_ids)
+
+    book_list = []
+    for book_id in book_ids:
+        if book_id in books:
+            book_list.append(books[book_id])
+        else:
+            book_list.append({"id": book_id, "error": {"code": 504, "message": errors.get(book_id, "book could not be fetched")}})
+    return book_list
+
+@bp.route("/get_book/<string:book_id>", methods=["GET"])
 def get_book_by_id(book_id: str) -> Any:
     '''
     Returns a book object from the given book_id the same as the Google Books API.
+    Existing books have an ETag of their content, a matching If-None-Match header gets a 304 response.
     '''
-    book_request = requests.get(f"https://www.googleapis.com/books/v1/volumes/{book_id}")
-    return book_request.json()
+    book = fetch_volume(book_id)
+    if book.get("kind") != "books#volume":
+        return jsonify(book)
 
-@app.route("/recommendations/<string:user_id>", methods=["GET"])
+    etag = etag_of(book)
+    response = not_modified(etag) or jsonify(book)
+    response.set_etag(etag)
+    return response
+
+@bp.route("/get_books", methods=["GET", "POST"])
+def get_books_by_ids() -> Any:
+    '''
+    Returns many book objects in one request, keyed by book id.
+    The id's are given as a comma separated ids query parameter, or as a json body:
+    {
+        "ids": ["book id 1", "book id 2"]
+    }
+    Duplicate id's are fetched once, concurrently, fetch_volume serves the cached books from the volume cache.
+    Returns: a json response with the found books and the errors of the id's that could not be fetched
+    '''
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        book_ids = data.get("ids", [])
+    else:
+        book_ids = request.args.get("ids", "").split(",")
+
+    if not isinstance(book_ids, list) or not all(isinstance(book_id, str) for book_id in book_ids):
+        return jsonify({"error": "ids should be a list of book id's"}), 400
+
+    book_ids = list(dict.fromkeys(book_id.strip() for book_id in book_ids if book_id.strip()))
+    if len(book_ids) > current_app.config['BATCH_MAX_IDS']:
+        return jsonify({"error": f"a maximum of {current_app.config['BATCH_MAX_IDS']} book id's can be requested at once"}), 400
+
+    books: dict = {}
+    errors: dict = {}
+    fetched, fetch_errors = fan_out.map(fetch_volume, book_ids)
+    for book_id, book in fetched.items():
+        if book.get("kind") == "books#volume":
+            books[book_id] = book
+        else:
+            errors[book_id] = book.get("error", {"message": "book was not found"})
+    for book_id, message in fetch_errors.items():
+        errors[book_id] = {"code": 504, "message": message}
+
+    return jsonify({"books": books, "errors": errors})
+
+@bp.route("/recommendations/<string:user_id>", methods=["GET"])
 def get_recommendations(user_id: str) -> Any:
     '''
     Gets recommmendations for user. If user does not exist it will still return recommendations.
@@ -612,72 +1509,82 @@ def get_recommendations(user_id: str) -> Any:
     # if the user does not exist or does not have favorite books
     if not favorite_book_ids:
         standard_genre: str = "Fiction"
-        get_recommended_books = requests.get(f'https://www.googleapis.com/books/v1/volumes?q=subject:"{standard_genre}"&printType=books&projection=full')
-
-        return jsonify({"recommendations": get_recommended_books.json(), "genre": "Fiction"})
+        return recommendations_response(standard_genre)
 
-    favorites: list = []
-    genre_ranking: dict = {}
+    return recommendations_response(favorite_genre(user_id))
 
-    for book_id in favorite_book_ids.book_list_id['list']:
-        book = get_book_by_id(book_id)
-        favorites.append(book)
-
-        # check if book has categories
-        if "volumeInfo" in book and "categories" in book["volumeInfo"]:
-            genres = book["volumeInfo"]["categories"]
-            genres_per_book: list = []
-            # we only want to get one of each genre per book.
-            for genre in genres:
-                book_genre_list = genre.split('/')
-                for book_genre in book_genre_list:
-                    book_genre = book_genre.strip()
+def favorite_genre(user_id: str) -> str:
+    '''
+    Returns: a str, the genre that appears in the most favorite books of the user, or "Fiction" when there is none
+    '''
+    # the genre profile is kept up to date when favorites change, "General" is not a useful genre.
+    top_count = (db.session.query(func.max(UserGenre.genre_count))
+                 .filter(UserGenre.user == user_id, UserGenre.genre != "General", UserGenre.genre_count > 0)
+                 .scalar())
+    if not top_count:
+        return "Fiction"  # Default fallback
+    top_genres = {row.genre for row in UserGenre.query.filter(UserGenre.user == user_id, UserGenre.genre != "General",
+                                                                 UserGenre.genre_count == top_count)}
+    if len(top_genres) == 1:
+        return top_genres.pop()
 
-                    if book_genre not in genres_per_book:
-                        genres_per_book.append(book_genre)
-                        genre_ranking[book_genre] = genre_ranking.get(book_genre, 0) + 1
+    # a tie goes to the genre that is seen first in the favorites, in the order of the list
+    favorites = (db.session.query(BookGenre.genres)
+                 .join(BookListEntry, BookListEntry.book_id == BookGenre.book_id)
+                 .filter(BookListEntry.user == user_id, BookListEntry.list_type == Favorite.LIST_TYPE)
+                 .order_by(BookListEntry.position, BookListEntry.id))
+    for favorite in favorites.yield_per(100):
+        for genre in favorite.genres:
+            if genre in top_genres:
+                return genre
+    return min(top_genres)
 
-    # we want to grab the most common genre.
-    most_common_genre: str = "Fiction"  # Default fallback
-    highest_genre_count: int = 0
-    for genre, count in genre_ranking.items():
-        if count > highest_genre_count and genre != "General": #exclude general genre
-            highest_genre_count = count
-            most_common_genre = genre
+def recommendations_response(genre: str) -> Any:
+    '''
+    Returns the recommended books of a genre, from the recommendation cache when possible.
+    The cache_age in the response is the age of the recommendations in seconds.
+    '''
+    try:
+        recommendations, age = recommendation_cache.get(genre, lambda: search_books_by_genre(genre))
+    except (RequestException, ValueError):
+        return jsonify({"error": f"recommendations could not be loaded for genre: {genre}"}), 502
 
-    # search books by genre:
-    get_recommended_books = requests.get(f'https://www.googleapis.com/books/v1/volumes?q=subject:"{most_common_genre}"&printType=books&projection=full')
+    return jsonify({"recommendations": recommendations, "genre": genre, "cache_age": int(age)})
 
-    return jsonify({"recommendations": get_recommended_books.json(), "genre": most_common_genre})
+def search_books_by_genre(genre: str) -> Dict[str, Any]:
+    '''
+    Searches Google Books for books of a genre, failing requests raise an exception so they are not cached.
+    Returns: a dict, the search result the same as Google Books
+    '''
+    get_recommended_books = google_books.get("/volumes", params={"q": f'subject:"{genre}"', "printType": "books", "projection": "full"}, target="search")
+    get_recommended_books.raise_for_status()
+    recommended_books = get_recommended_books.json()
+    register_volumes(recommended_books.get("items", []))
+    return recommended_books
 
 
-@app.route("/most_favorites", methods=["GET"])
+@bp.route("/most_favorites", methods=["GET"])
 def get_most_favorites() -> Any:
     '''
-    Returns a list of maximum 10 most favorite books according to the amount of favorites it has.
+    Returns a list of the most favorite books according to the amount of favorites it has.
+    The limit query parameter sets the amount of books, the default is 10 and the maximum is 100.
     '''
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "limit should be a number"}), 400
 
-    favorites = Favorite.query.all()
-    
-
-    favorites_ranking: dict = {}
-
-    for favorite in favorites:
-        book_ids = favorite.book_list_id['list']
-
-        for book_id in book_ids:
-            favorites_ranking[book_id] = favorites_ranking.get(book_id, 0) + 1
-
-    # sorts the list based on the values, high to low.
-    favorites_sorted =  dict(sorted(favorites_ranking.items(), key=lambda x:x[1], reverse=True))
-    top_favorites = list(favorites_sorted.keys())
-    print(top_favorites)
+    # the favorite counts are kept up to date when favorites change, so this is an index scan.
+    top_favorites = (db.session.query(BookPopularity.book_id)
+                     .filter(BookPopularity.favorite_count > 0)
+                     .order_by(BookPopularity.favorite_count.desc(), BookPopularity.book_id)
+                     .limit(limit))
 
-    return jsonify({"most_favorites": top_favorites})
+    return jsonify({"most_favorites": [favorite.book_id for favorite in top_favorites]})
 
 
 #search region
-@app.route('/search', methods=['GET'])
+@bp.route('/search', methods=['GET'])
 def search() -> Any:
     '''
     This is the search endpoint for the google books api.
@@ -690,6 +1597,28 @@ def search() -> Any:
     max_results = 10
     start_index = (page - 1) * max_results
 
+    key = search_cache_key(query, order_by, lg, start_index, max_results)
+    try:
+        books, _ = search_cache.get(key, lambda: search_books(*key))
+    except (RequestException, ValueError):
+        books = []
+    return jsonify(books)
+
+def search_cache_key(query: Optional[str], order_by: Optional[str], lg: Optional[str], start_index: int, max_results: int) -> tuple:
+    '''
+    Normalizes the search parameters, so searches that only differ in case or whitespace share a cache entry.
+    Returns: a tuple, (query, order_by, lang, start_index, max_results)
+    '''
+    query = " ".join((query or "").lower().split())
+    order_by = (order_by or "").strip().lower() or None
+    lg = (lg or "").strip().lower() or None
+    return (query, order_by, lg, start_index, max_results)
+
+def search_books(query: str, order_by: Optional[str], lg: Optional[str], start_index: int, max_results: int) -> List[Dict[str, Any]]:
+    '''
+    Searches Google Books with the given parameters, failing requests raise an exception so they are not cached.
+    Returns: a list, the found books the same as Google books
+    '''
     url = search_url_build(
         query=query,
         order_by=order_by,
@@ -699,12 +1628,14 @@ def search() -> Any:
         api_key= os.environ["API_KEY"]
     )
 
-    response = requests.get(url)
+    response = google_books.get(url, target="search")
+    response.raise_for_status()
     books = response.json().get("items", [])
-    return jsonify(books)
+    register_volumes(books)
+    return books
 
 
-@app.route("/api/chat", methods=["POST"])
+@bp.route("/api/chat", methods=["POST"])
 def chat_endpoint() -> Any:
     '''
     This is the chat endpoint for the gemini api.
@@ -718,60 +1649,13 @@ def chat_endpoint() -> Any:
         user_message = data["message"]
         user_id = data["user_id"]
         
-        # Build system prompt with role definition
-        system_prompt = "You are BookBuddy, a helpful book recommendation assistant. You help users discover new books based on their reading preferences and answer questions about books and reading.\n\n"
-        
-        # Get user's book context
-        user_context = "User's reading profile:\n"
-        has_reading_data = False
-        
-        # Get favorites
-        favorites = Favorite.query.get(user_id)
-        if favorites:
-            favorite_books = []
-            for book_id in favorites.book_list_id.get('list', []):
-                book_info = get_book_by_id(book_id)
-                if 'volumeInfo' in book_info:
-                    favorite_books.append(book_info['volumeInfo'].get('title', 'Unknown Title'))
-            if favorite_books:
-                user_context += f"- Favorite books: {', '.join(favorite_books)}\n"
-                has_reading_data = True
+        system_instruction = chat_system_instruction(user_id)
         
-        # Get read books
-        read = ReadBooks.query.get(user_id)
-        if read:
-            read_books = []
-            for book_id in read.book_list_id.get('list', []):
-                book_info = get_book_by_id(book_id)
-                if 'volumeInfo' in book_info:
-                    read_books.append(book_info['volumeInfo'].get('title', 'Unknown Title'))
-            if read_books:
-                user_context += f"- Books they've read: {', '.join(read_books)}\n"
-                has_reading_data = True
-        
-        # Get want to read books
-        want_to_read = WantToRead.query.get(user_id)
-        if want_to_read:
-            want_to_read_books = []
-            for book_id in want_to_read.book_list_id.get('list', []):
-                book_info = get_book_by_id(book_id)
-                if 'volumeInfo' in book_info:
-                    want_to_read_books.append(book_info['volumeInfo'].get('title', 'Unknown Title'))
-            if want_to_read_books:
-                user_context += f"- Books they want to read: {', '.join(want_to_read_books)}\n"
-                has_reading_data = True
-        
-        if not has_reading_data:
-            user_context += "- No reading history available yet\n"
-        
-        # Combine everything for the AI
-        full_message = f"{system_prompt}{user_context}\nUser's question: {user_message}\n\nPlease provide a helpful response as BookBuddy."
-        
-        # Send message to gemini and get response
-        response = chat.send_message(full_message)
+        # Send message to the gemini chat session of the user and get response
+        response_text = chat_sessions.send_message(user_id, user_message, system_instruction)
         
         return jsonify({
-            "response": response.text,
+            "response": response_text,
             "status": "success"
         })
     except Exception as e:
@@ -780,16 +1664,139 @@ def chat_endpoint() -> Any:
             "status": "error"
         }), 500
 
+@bp.route("/api/chat/stream", methods=["POST"])
+def chat_stream_endpoint() -> Any:
+    '''
+    This is the streaming chat endpoint for the gemini api, it takes the same body as /api/chat.
+    The answer is sent as Server-Sent Events while gemini writes it: "data: {"text": ...}" events with
+    the parts of the answer, then a "done" event, or an "error" event when something goes wrong.
+    '''
+    data = request.get_json(silent=True)
+    if not data or "message" not in data or "user_id" not in data:
+        return jsonify({"error": "No message or user_id provided"}), 400
+
+    user_message = data["message"]
+    user_id = data["user_id"]
+    try:
+        system_instruction = chat_system_instruction(user_id)
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+
+    def generate() -> Any:
+        try:
+            for text in chat_sessions.stream_message(user_id, user_message, system_instruction):
+                yield sse_event({"text": text})
+            yield sse_event({"status": "success"}, event="done")
+        except Exception as e:
+            yield sse_event({"error": str(e), "status": "error"}, event="error")
+
+    # the gemini calls of the stream are made after this function returned, they still count for this request
+    response = Response(stream_with_context(request_accounting.stream(generate())), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # stops proxies like nginx from buffering the events
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+def chat_system_instruction(user_id: str) -> str:
+    '''
+    Builds the system instruction for the chat: the role of BookBuddy and the reading profile of the user.
+    Returns: a str, the system instruction
+    '''
+    # Build system prompt with role definition
+    system_prompt = "You are BookBuddy, a helpful book recommendation assistant. You help users discover new books based on their reading preferences and answer questions about books and reading.\n\n"
+    
+    # Get user's book context, cached until one of the lists of the user changes
+    user_context = get_reading_profile(user_id)
+    
+    # Combine everything for the AI, the profile is part of the system instruction so it is not repeated in the history
+    return f"{system_prompt}{user_context}\nPlease provide a helpful response as BookBuddy."
+
+def get_reading_profile(user_id: str) -> str:
+    '''
+    Returns the reading profile of the user for the chat, from the cache when none of the lists changed.
+    Returns: a str, the titles of the favorite, read and want to read books
+    '''
+    revisions = get_book_list_revisions(user_id)
+    cached = reading_profile_cache.get(user_id)
+    if cached is not None and cached[0] == revisions:
+        return cached[1]
+
+    user_context, complete = build_reading_profile(user_id)
+    # a profile without the books that failed would stay incomplete until a list changes, so it is not cached
+    if complete:
+        reading_profile_cache.set(user_id, (revisions, user_context))
+    return user_context
+
+def build_reading_profile(user_id: str) -> Tuple[str, bool]:
+    '''
+    Builds the reading profile of the user for the chat, only the books that can be shown are fetched,
+    concurrently and mostly from the volume cache, so heavy readers do not make huge and slow prompts.
+    Returns: a tuple, the ranked titles of the user within the CHAT_CONTEXT_MAX_CHARS budget
+    and False when some of the books could not be fetched
+    '''
+    config = current_app.config
+    favorites = get_book_list(Favorite.LIST_TYPE, user_id)
+    top_favorites = favorites[::-1][:config['CHAT_CONTEXT_FAVORITES']]
+
+    other_lists = [ReadBooks.LIST_TYPE, WantToRead.LIST_TYPE]
+    other_total = BookListEntry.query.filter(BookListEntry.user == user_id, BookListEntry.list_type.in_(other_lists)).count()
+    recent = (db.session.query(BookListEntry.book_id, BookListEntry.list_type)
+              .filter(BookListEntry.user == user_id, BookListEntry.list_type.in_(other_lists))
+              .order_by(BookListEntry.added_at.desc(), BookListEntry.id.desc())
+              .limit(config['CHAT_CONTEXT_RECENT']).all())
+
+    top_genres = [row.genre for row in (UserGenre.query.filter_by(user=user_id)
+                  .order_by(UserGenre.genre_count.desc(), UserGenre.genre).limit(config['CHAT_CONTEXT_GENRES']))]
+    genre_total = UserGenre.query.filter_by(user=user_id).count()
+
+    # the representative titles of the top genres are looked up in a sample spread over the read books
+    shown = set(top_favorites) | {row.book_id for row in recent}
+    candidates = [book_id for book_id in get_book_list(ReadBooks.LIST_TYPE, user_id) if book_id not in shown] if top_genres else []
+    step = max(1, len(candidates) // max(1, config['CHAT_CONTEXT_GENRE_SAMPLE']))
+    sample = candidates[::step][:config['CHAT_CONTEXT_GENRE_SAMPLE']]
+
+    books, errors = fan_out.map(fetch_volume, list(dict.fromkeys(top_favorites + [row.book_id for row in recent] + sample)))
+    complete = not errors and all(is_final_volume(book) for book in books.values())
+
+    def title(book_id: str) -> Optional[str]:
+        book_info = books.get(book_id, {})
+        if 'volumeInfo' not in book_info:
+            return None
+        return book_info['volumeInfo'].get('title', 'Unknown Title')
+
+    favorite_titles = [title(book_id) for book_id in top_favorites if title(book_id)]
+    recent_titles = []
+    for row in recent:
+        if title(row.book_id):
+            suffix = " (want to read)" if row.list_type == WantToRead.LIST_TYPE else ""
+            recent_titles.append(f"{title(row.book_id)}{suffix}")
+
+    genre_titles = []
+    examples: set = set()
+    for genre in top_genres:
+        example = next((book_id for book_id in top_favorites + sample
+                        if book_id not in examples and genre in book_genres(books.get(book_id, {}))), None)
+        examples.add(example)
+        genre_titles.append(f"{genre} (like {title(example)})" if example else genre)
+
+    return compact_reading_profile([
+        ("Favorite books", favorite_titles, len(favorites)),
+        ("Recently added books", recent_titles, other_total),
+        ("Favorite genres", genre_titles, genre_total),
+    ], config['CHAT_CONTEXT_MAX_CHARS']), complete
+
 def book_search_title(query: str) -> List[Dict[str, Any]]:
     '''
     Searches for books by title using the Google Books API and returns a list of matching book items.
     '''
     spliced = query.lower().split()
-    spliced = "+".join(spliced)
-    resonse = requests.request("GET", f"https://www.googleapis.com/books/v1/volumes?q=intitle:{spliced}&orderBY=relevance&key={os.environ['API_KEY']}")
-    return resonse.json()["items"]
+    spliced = " ".join(spliced)
+    resonse = google_books.get("/volumes", params={"q": f"intitle:{spliced}", "orderBY": "relevance", "key": os.environ['API_KEY']}, target="search")
+    books = resonse.json()["items"]
+    register_volumes(books)
+    return books
 
-@app.route("/submit_review", methods=["POST"])
+@bp.route("/submit_review", methods=["POST"])
 def submit_review() -> Any:
     '''
     Lets the user submit a review about a book they've written.
@@ -809,9 +1816,11 @@ def submit_review() -> Any:
     if 0.0 > rating or rating > 5.0:
         return jsonify({"Error":"Please pick a number between 0 and 5."}), 400
     
-    book = get_book_by_id(book_id)
-    if "error" in book or book.get("kind") != "books#volume":
-        return jsonify({"Error":"Book was not found, please pick an existing book within our library."}), 404
+    # only volumes that were never seen before are checked with Google Books, fetch_volume records them
+    if not volume_cache.is_verified(book_id):
+        book = fetch_volume(book_id)
+        if "error" in book or book.get("kind") != "books#volume":
+            return jsonify({"Error":"Book was not found, please pick an existing book within our library."}), 404
     
     review_exists = Review.query.filter_by(user=user, book_id=book_id).first()
     if review_exists:
@@ -819,11 +1828,17 @@ def submit_review() -> Any:
     
     new_review = Review(book_id=book_id, user=user, rating=rating, message=message)
     db.session.add(new_review)
-    db.session.commit()
+    change_book_rating(book_id, rating, 1)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a review of the same user and book was submitted at the same time
+        db.session.rollback()
+        return jsonify({"Error":"Review has already been submitted. Please delete your old review before posting a new one or edit your current review."}), 400
 
     return jsonify({"Message":"Review was submitted successfully!", "review_id": new_review.id}), 201
 
-@app.route("/update_review/<int:review_id>", methods=["PUT"])
+@bp.route("/update_review/<int:review_id>", methods=["PUT"])
 def update_review(review_id: int) -> Any:
     '''
     Lets the user update one of their existing reviews.
@@ -845,13 +1860,15 @@ def update_review(review_id: int) -> Any:
     if not old_review:
         return jsonify({"Error":"Review was not found."}), 404
     
+    change_book_rating(old_review.book_id, old_review.rating, -1)
+    change_book_rating(old_review.book_id, updated_rating, 1)
     old_review.rating = updated_rating
     old_review.message = updated_message
     db.session.commit()
 
     return jsonify({"Message":"Review was updated successfully!"}), 200    
 
-@app.route("/delete_review", methods=["DELETE"])
+@bp.route("/delete_review", methods=["DELETE"])
 def delete_review_by_user() -> Any:
     '''
     Lets the user delete one of their existing reviews.
@@ -867,50 +1884,91 @@ def delete_review_by_user() -> Any:
         return jsonify({"Error":"Review was not found."}), 404
     
     db.session.delete(review)
+    change_book_rating(review.book_id, review.rating, -1)
     db.session.commit()
 
     return jsonify({"Message":"Review has been deleted successfully!"}), 200
 
-@app.route("/reviews_sorted", methods=["GET"])
+@bp.route("/reviews_sorted", methods=["GET"])
 def get_sorted_reviews() -> Any:
     '''
     Lets the user sort reviews of a book by their rating or date in either
     an ascending or descending order.
+    The reviews are returned a page at a time, see collection_response for the paging parameters.
     '''
     sort_by = request.args.get("sort_by", "rating")
     order = request.args.get("order", "asc")
 
+    type_order, error = review_order(sort_by, order)
+    if error:
+        return jsonify({"Error": error}), 404
+
+    sort_column = Review.rating if sort_by == "rating" else Review.date
+
+    def fetch_page(after: Optional[list], limit: int) -> list:
+        query = Review.query.order_by(*type_order)
+        if after:
+            sort_value = datetime.fromisoformat(after[0]) if sort_by == "date" else after[0]
+            key = tuple_(sort_column, Review.id)
+            query = query.filter(key < (sort_value, after[1]) if order == "desc" else key > (sort_value, after[1]))
+        return query.limit(limit).all()
+
+    def key_of(review: Review) -> list:
+        return [review.date.isoformat() if sort_by == "date" else review.rating, review.id]
+
+    def serialize_page(reviews: list) -> list:
+        return [{"user": review.user, "rating":review.rating, "message":review.message, "date":review.date.isoformat()} for review in reviews]
+
+    return collection_response(fetch_page, key_of, serialize_page, lambda items: items)
+
+
+def review_order(sort_by: str, order: str) -> Tuple[tuple, Optional[str]]:
+    '''
+    Builds the order by clauses for reviews, sort_by can be rating or date and order can be asc or desc.
+    The review id is used as tiebreaker, so the order of reviews with the same rating is stable.
+    Returns: a tuple, the order by clauses and an error message if sort_by or order is not known
+    '''
     if sort_by == "rating":
-        category_order = Review.rating 
+        category_order = Review.rating
     elif sort_by == "date":
         category_order = Review.date
     else:
-        return jsonify({"Error":"Order Category not found."}), 404
-    
+        return (), "Order Category not found."
+
     if order == "asc":
-        type_order = category_order.asc()
+        return (category_order.asc(), Review.id.asc()), None
     elif order == "desc":
-        type_order = category_order.desc()
+        return (category_order.desc(), Review.id.desc()), None
     else:
-        return jsonify({"Error":"Order Type not found."}), 404
-    
-    reviews = Review.query.order_by(type_order).all()
-
-    return jsonify([{"user": review.user, "rating":review.rating, "message":review.message, "date":review.date.isoformat()} for review in reviews]) 
+        return (), "Order Type not found."
 
 
-@app.route("/reviews_book/<string:book_id>", methods=["GET"])
+@bp.route("/reviews_book/<string:book_id>", methods=["GET"])
 def get_reviews_by_book_id(book_id: str) -> Any:
     '''
-    Gets all reviews related to the book with book_id
+    Gets all reviews related to the book with book_id.
+    The optional sort_by (rating or date), order (asc or desc) and limit (1 to MAX_PAGE_SIZE) query parameters
+    sort and limit the reviews, by default the reviews are sorted by date from old to new.
     '''
+    type_order, error = review_order(request.args.get("sort_by", "date"), request.args.get("order", "asc"))
+    if error:
+        return jsonify({"Error": error}), 404
+
+    reviews = (db.session.query(Review.user, Review.rating, Review.message, Review.date, Review.book_id)
+               .filter(Review.book_id == book_id)
+               .order_by(*type_order))
 
-    all_reviews = Review.query.all()
+    if "limit" in request.args:
+        max_limit = current_app.config['MAX_PAGE_SIZE']
+        try:
+            limit = int(request.args["limit"])
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= max_limit:
+            return jsonify({"Error":f"Limit should be a number between 1 and {max_limit}."}), 400
+        reviews = reviews.limit(limit)
 
-    reviews_with_book_id: list = []
-    for review in all_reviews:
-        if review.book_id == book_id:
-            reviews_with_book_id.append({"user": review.user, "rating": review.rating, "message": review.message, "date": review.date, "book_id": review.book_id})
+    reviews_with_book_id = [{"user": review.user, "rating": review.rating, "message": review.message, "date": review.date, "book_id": review.book_id} for review in reviews]
 
     if reviews_with_book_id:
         return jsonify({"reviews": reviews_with_book_id})
@@ -918,6 +1976,47 @@ def get_reviews_by_book_id(book_id: str) -> Any:
         return jsonify({"reviews": None})
 
 
+@bp.route("/ratings_book/<string:book_id>", methods=["GET"])
+def get_rating_by_book_id(book_id: str) -> Any:
+    '''
+    Gets the rating aggregate of the book with book_id: the review count, the sum and mean rating and a 1-5 histogram.
+    A book without reviews has a count of 0 and a mean of None.
+    '''
+    book_rating = BookRating.query.get(book_id) or BookRating(book_id=book_id, review_count=0, rating_sum=0.0,
+                                                              rating_1=0, rating_2=0, rating_3=0, rating_4=0, rating_5=0)
+    return jsonify(book_rating.to_dict())
+
+
+@bp.route("/ratings_books", methods=["GET", "POST"])
+def get_ratings_by_book_ids() -> Any:
+    '''
+    Gets the rating aggregates of many books in one request, keyed by book id.
+    The id's are given as a comma separated ids query parameter, or as a json body:
+    {
+        "ids": ["book id 1", "book id 2"]
+    }
+    Books without reviews are left out of the result.
+    '''
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        book_ids = data.get("ids", [])
+    else:
+        book_ids = request.args.get("ids", "").split(",")
+
+    if not isinstance(book_ids, list) or not all(isinstance(book_id, str) for book_id in book_ids):
+        return jsonify({"Error":"ids should be a list of book id's."}), 400
+
+    book_ids = list(dict.fromkeys(book_id.strip() for book_id in book_ids if book_id.strip()))
+    if len(book_ids) > current_app.config['BATCH_MAX_IDS']:
+        return jsonify({"Error":f"A maximum of {current_app.config['BATCH_MAX_IDS']} book id's can be requested at once."}), 400
+
+    book_ratings = BookRating.query.filter(BookRating.book_id.in_(book_ids), BookRating.review_count > 0)
+    return jsonify({"ratings": {book_rating.book_id: book_rating.to_dict() for book_rating in book_ratings}})
+
+
 if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        upgrade_db()
     app.run(debug=True)
 
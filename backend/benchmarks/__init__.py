@@ -0,0 +1,3 @@
+'''
+Offline benchmarks of BookBuddy, see benchmarks.run.
+'''
@@ -0,0 +1,270 @@
+'''
+Offline benchmarks of the core database paths of BookBuddy.
+
+A synthetic SQLite database is seeded with users, book lists and reviews, then the routes are timed through the
+Flask test client. Google Books is never called: the synthetic volumes are put in the volume cache.
+
+Run from the backend directory:
+    python -m benchmarks.run --scale small --output results.json
+    python -m benchmarks.run --scale small --baseline results.json
+
+With --baseline the results are compared to an earlier run, the exit code is 1 when the median of a benchmark
+is more than --threshold times the median of the baseline.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import insert
+
+import app as bookbuddy
+from app import BookListEntry, Favorite, ReadBooks, Review, WantToRead, create_app, db, upgrade_db
+
+SCALES: Dict[str, Dict[str, int]] = {
+    "tiny": {"users": 20, "books": 200, "favorites": 5, "read": 10, "want_to_read": 5, "reviews": 500},
+    "small": {"users": 1_000, "books": 10_000, "favorites": 10, "read": 50, "want_to_read": 20, "reviews": 50_000},
+    "medium": {"users": 10_000, "books": 50_000, "favorites": 20, "read": 100, "want_to_read": 30, "reviews": 500_000},
+    "large": {"users": 50_000, "books": 200_000, "favorites": 20, "read": 200, "want_to_read": 50, "reviews": 2_000_000},
+}
+GENRES = ["Fiction", "Fantasy", "Science Fiction", "Mystery", "Romance", "History", "Biography", "Poetry",
+          "Horror", "Thriller", "Philosophy", "Science", "Travel", "Cooking", "Art", "Religion"]
+INSERT_BATCH_SIZE = 10_000
+
+
+def book_id(index: int) -> str:
+    return f"bk{index:010d}"
+
+
+def volume(index: int) -> Dict[str, Any]:
+    '''
+    Returns: a dict, a synthetic volume the same as Google Books, with two genres
+    '''
+    genres = f"{GENRES[index % len(GENRES)]} / {GENRES[index // len(GENRES) % len(GENRES)]}"
+    return {"kind": "books#volume", "id": book_id(index), "volumeInfo": {"title": f"Book {index}", "categories": [genres]}}
+
+
+class Seeder:
+    '''
+    Fills the database with synthetic data. Popular books are picked more often than others, like real favorites.
+    '''
+
+    def __init__(self, scale: Dict[str, int], seed: int) -> None:
+        self.scale = scale
+        self.random = random.Random(seed)
+        # a Zipf like popularity, book i is picked with a weight of 1 / (i + 1)
+        self.cumulative_weights: List[float] = []
+        total = 0.0
+        for index in range(scale["books"]):
+            total += 1 / (index + 1)
+            self.cumulative_weights.append(total)
+
+    def pick_books(self, amount: int) -> List[int]:
+        amount = min(amount, self.scale["books"])
+        picked: Dict[int, None] = {}
+        population = range(self.scale["books"])
+        while len(picked) < amount:
+            for index in self.random.choices(population, cum_weights=self.cumulative_weights, k=amount - len(picked)):
+                picked[index] = None
+        return list(picked)
+
+    def insert(self, model: Any, rows: List[Dict[str, Any]]) -> None:
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            db.session.execute(insert(model), rows[start:start + INSERT_BATCH_SIZE])
+
+    def seed(self) -> Dict[str, float]:
+        '''
+        Seeds the database and rebuilds the aggregates the same as upgrade_db.
+        Returns: a dict, the seconds every step took
+        '''
+        timings = {}
+        start = time.perf_counter()
+        users = [f"user{index}" for index in range(self.scale["users"])]
+        for model in (Favorite, ReadBooks, WantToRead):
+            self.insert(model, [{"user": user} for user in users])
+
+        entries = []
+        now = datetime.utcnow()
+        for user in users:
+            for list_type, size in ((Favorite.LIST_TYPE, "favorites"), (ReadBooks.LIST_TYPE, "read"),
+                                    (WantToRead.LIST_TYPE, "want_to_read")):
+                for position, index in enumerate(self.pick_books(self.scale[size])):
+                    added_at = now - timedelta(minutes=self.random.randrange(1_000_000))
+                    entries.append({"user": user, "list_type": list_type, "book_id": book_id(index),
+                                    "position": position, "added_at": added_at})
+        self.insert(BookListEntry, entries)
+        timings["book_lists"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reviews_per_user = max(1, self.scale["reviews"] // len(users))
+        reviews = []
+        for user in users:
+            for index in self.pick_books(reviews_per_user):
+                reviews.append({"book_id": book_id(index), "user": user, "rating": self.random.randint(0, 10) / 2,
+                                "date": now - timedelta(minutes=self.random.randrange(1_000_000)),
+                                "message": "A synthetic review of a synthetic book."})
+        self.insert(Review, reviews)
+        db.session.commit()
+        timings["reviews"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        upgrade_db()
+        db.session.commit()
+        timings["aggregates"] = time.perf_counter() - start
+        return timings
+
+
+def measure(name: str, run: Callable[[int], Any], repeat: int) -> Dict[str, Any]:
+    '''
+    Runs a benchmark once to warm up and then repeat times, run gets the number of the run.
+    Returns: a dict, the timings of the benchmark in milliseconds
+    '''
+    run(-1)
+    timings = []
+    for number in range(repeat):
+        start = time.perf_counter()
+        run(number)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+    }
+
+
+def run_benchmarks(scale: Dict[str, int], repeat: int = 20, seed: int = 1) -> Dict[str, Any]:
+    '''
+    Seeds a temporary database with the given scale and times every benchmark.
+    Returns: a dict, the scale, the environment, the seed timings and the results per benchmark
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        application = create_app({
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'benchmark.db')}",
+            "VOLUME_CACHE_PATH": None,
+            "VOLUME_CACHE_SIZE": scale["books"] + 1,
+            "REQUEST_BUDGET_FAIL": False,
+        })
+        with application.app_context():
+            # every synthetic volume is cached, so Google Books is never called
+            for index in range(scale["books"]):
+                bookbuddy.volume_cache.memory.set(book_id(index), volume(index))
+            db.create_all()
+            seed_timings = Seeder(scale, seed).seed()
+
+        client = application.test_client()
+        popular_book = book_id(0)
+        user = "user0"
+
+        def get(url: str) -> Callable[[int], Any]:
+            def run(number: int) -> None:
+                response = client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+            return run
+
+        def add_and_remove(list_path: str, action: str) -> Callable[[int], Any]:
+            # books that are in no list, the add and the remove of a run use the same book
+            def run(number: int) -> None:
+                response = client.post(f"/{list_path}/{user}/{action}/new{number + 1}")
+                assert response.status_code in (200, 201), (list_path, action, response.status_code)
+            return run
+
+        def favorite_genre(number: int) -> None:
+            with application.app_context():
+                bookbuddy.favorite_genre(f"user{number % scale['users'] if number >= 0 else 0}")
+
+        for index in range(repeat + 1):
+            bookbuddy.volume_cache.memory.set(f"new{index}", volume(index) | {"id": f"new{index}"})
+
+        benchmarks: Dict[str, Callable[[int], Any]] = {
+            "most_favorites": get("/most_favorites?limit=10"),
+            "reviews_book_popular": get(f"/reviews_book/{popular_book}?limit=100"),
+            "reviews_sorted_rating": get("/reviews_sorted?sort_by=rating&order=desc&limit=100"),
+            "reviews_sorted_date": get("/reviews_sorted?sort_by=date&order=asc&limit=100"),
+            "favorite_genre": favorite_genre,
+            "read_books_add": add_and_remove("read_books", "add"),
+            "read_books_remove": add_and_remove("read_books", "delete"),
+            "favorites_add": add_and_remove("favorites", "add"),
+            "favorites_remove": add_and_remove("favorites", "delete"),
+        }
+        results = {name: measure(name, run, repeat) for name, run in benchmarks.items()}
+
+        with application.app_context():
+            db.engine.dispose()
+
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "scale": scale,
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "machine": platform.machine()},
+        "seed_seconds": {step: round(seconds, 3) for step, seconds in seed_timings.items()},
+        "results": results,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    '''
+    Compares the medians of two runs.
+    Returns: a list, a line per benchmark that is slower than threshold times its baseline
+    '''
+    regressions = []
+    for name, result in results["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before or not before["median_ms"]:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        result["baseline_median_ms"] = before["median_ms"]
+        result["ratio"] = round(ratio, 3)
+        if ratio > threshold:
+            regressions.append(f"{name}: {result['median_ms']} ms, baseline {before['median_ms']} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="small", help="the preset size of the synthetic database")
+    for option in SCALES["small"]:
+        parser.add_argument(f"--{option.replace('_', '-')}", type=int, help=f"overrides the {option} of the scale")
+    parser.add_argument("--repeat", type=int, default=20, help="the amount of timed runs per benchmark")
+    parser.add_argument("--seed", type=int, default=1, help="the seed of the synthetic data")
+    parser.add_argument("--output", help="writes the results as json to this file instead of stdout")
+    parser.add_argument("--baseline", help="a results file of an earlier run to compare to")
+    parser.add_argument("--threshold", type=float, default=1.5, help="the allowed slowdown compared to the baseline")
+    args = parser.parse_args(argv)
+
+    scale = dict(SCALES[args.scale])
+    for option in scale:
+        if getattr(args, option) is not None:
+            scale[option] = getattr(args, option)
+
+    results = run_benchmarks(scale, repeat=args.repeat, seed=args.seed)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    for regression in regressions:
+        print(f"regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
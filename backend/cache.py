@@ -0,0 +1,362 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class LRUCache:
+    '''
+    Thread safe in-memory cache with a maximum size and a time to live per entry.
+    When the cache is full the least recently used entry is evicted.
+    '''
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        '''
+        Returns the cached value for key, or None if it is missing or expired.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        '''
+        Stores value under key. The ttl argument overrides the default time to live of the cache.
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        '''
+        Removes key from the cache if it is present.
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        '''
+        Removes every entry from the cache, the counters are kept.
+        '''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        '''
+        Returns: a dict, containing the size of the cache and the hit, miss and eviction counters
+        '''
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class VolumeCache:
+    '''
+    Two tier cache for Google Books volumes.
+    The first tier is an in-process LRU cache, the second tier is a SQLite table that survives restarts,
+    so a freshly started worker can serve popular volumes without calling Google Books.
+    The id's of volumes that are known to exist are kept in a registry that does not expire,
+    so they do not have to be checked with Google Books again.
+    Expired volumes are deleted from SQLite on start and at most once per PRUNE_INTERVAL when volumes are stored.
+    '''
+
+    PRUNE_INTERVAL = 60 * 60
+
+    def __init__(self, db_path: Optional[str] = None, max_size: int = 2048, ttl: float = 60 * 60,
+                 persistent_ttl: float = 7 * 24 * 60 * 60, registry_size: int = 100_000) -> None:
+        self.db_path = db_path
+        self.persistent_ttl = persistent_ttl
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.verified = LRUCache(max_size=registry_size)
+        self.persistent_hits = 0
+        self.persistent_misses = 0
+        self._pruned_at = 0.0
+        if db_path:
+            self._create_table()
+
+    def init_app(self, app: Any) -> None:
+        '''
+        Configures the cache from the Flask config.
+        VOLUME_CACHE_PATH, VOLUME_CACHE_SIZE, VOLUME_CACHE_TTL, VOLUME_CACHE_PERSISTENT_TTL
+        and VOLUME_REGISTRY_SIZE are read.
+        '''
+        self.db_path = app.config.get("VOLUME_CACHE_PATH", self.db_path)
+        self.persistent_ttl = app.config.get("VOLUME_CACHE_PERSISTENT_TTL", self.persistent_ttl)
+        self.memory = LRUCache(
+            max_size=app.config.get("VOLUME_CACHE_SIZE", self.memory.max_size),
+            ttl=app.config.get("VOLUME_CACHE_TTL", self.memory.ttl)
+        )
+        self.verified = LRUCache(max_size=app.config.get("VOLUME_REGISTRY_SIZE", self.verified.max_size))
+        if self.db_path:
+            self._create_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _create_table(self) -> None:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS volume_cache ("
+                "book_id TEXT PRIMARY KEY, payload TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS verified_volume (book_id TEXT PRIMARY KEY, verified_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_volume_cache_fetched_at ON volume_cache (fetched_at)")
+            self._prune(connection)
+            connection.commit()
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        '''
+        Deletes the volumes older than the persistent time to live, the caller commits.
+        '''
+        now = time.time()
+        connection.execute("DELETE FROM volume_cache WHERE fetched_at <= ?", (now - self.persistent_ttl,))
+        self._pruned_at = now
+
+    def get(self, book_id: str) -> Optional[Dict[str, Any]]:
+        '''
+        Returns the cached volume for book_id, looking in memory first and in SQLite second.
+        Returns: a dict, the volume the same as Google Books, or None when it is not cached.
+        '''
+        volume = self.memory.get(book_id)
+        if volume is not None or not self.db_path:
+            return volume
+
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT payload FROM volume_cache WHERE book_id = ? AND fetched_at > ?",
+                (book_id, time.time() - self.persistent_ttl)
+            ).fetchone()
+
+        if row is None:
+            self.persistent_misses += 1
+            return None
+
+        self.persistent_hits += 1
+        volume = json.loads(row[0])
+        self.memory.set(book_id, volume)
+        return volume
+
+    def set(self, book_id: str, volume: Dict[str, Any]) -> None:
+        '''
+        Stores a volume in both tiers and records that it exists in the registry.
+        The stored dict is shared between callers and should not be modified.
+        '''
+        self.memory.set(book_id, volume)
+        self.verified.set(book_id, True)
+        if not self.db_path:
+            return
+
+        with closing(self._connect()) as connection:
+            if time.time() - self._pruned_at >= self.PRUNE_INTERVAL:
+                self._prune(connection)
+            connection.execute(
+                "INSERT OR REPLACE INTO volume_cache (book_id, payload, fetched_at) VALUES (?, ?, ?)",
+                (book_id, json.dumps(volume), time.time())
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO verified_volume (book_id, verified_at) VALUES (?, ?)", (book_id, time.time())
+            )
+            connection.commit()
+
+    def mark_verified(self, book_ids: Iterable[str]) -> None:
+        '''
+        Records that the volumes exist, for example because Google Books returned them as search results.
+        '''
+        new_book_ids = [book_id for book_id in dict.fromkeys(book_ids) if self.verified.get(book_id) is None]
+        for book_id in new_book_ids:
+            self.verified.set(book_id, True)
+        if not new_book_ids or not self.db_path:
+            return
+
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO verified_volume (book_id, verified_at) VALUES (?, ?)",
+                [(book_id, now) for book_id in new_book_ids]
+            )
+            connection.commit()
+
+    def is_verified(self, book_id: str) -> bool:
+        '''
+        Returns: a bool, True if the volume is known to exist in Google Books
+        '''
+        if not book_id:
+            return False
+        if self.verified.get(book_id) is not None:
+            return True
+        if not self.db_path:
+            return False
+
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT 1 FROM verified_volume WHERE book_id = ?", (book_id,)).fetchone()
+        if row is None:
+            return False
+        self.verified.set(book_id, True)
+        return True
+
+    def delete(self, book_id: str) -> None:
+        '''
+        Removes a volume from both tiers.
+        '''
+        self.memory.delete(book_id)
+        if not self.db_path:
+            return
+
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM volume_cache WHERE book_id = ?", (book_id,))
+            connection.commit()
+
+    def stats(self) -> Dict[str, int]:
+        '''
+        Returns: a dict, containing the in-memory counters, the SQLite hit and miss counters and the size of the registry
+        '''
+        stats = self.memory.stats()
+        stats["persistent_hits"] = self.persistent_hits
+        stats["persistent_misses"] = self.persistent_misses
+        stats["verified_size"] = len(self.verified)
+        return stats
+
+
+class RefreshingCache:
+    '''
+    Cache for upstream results that keeps serving an entry after it went stale while a fresh copy
+    is loaded in the background. Empty results are cached for a shorter time than normal results.
+    '''
+
+    def __init__(self, config_prefix: str, max_size: int = 512, fresh_ttl: float = 5 * 60,
+                 stale_ttl: float = 60 * 60, negative_ttl: float = 30) -> None:
+        self.config_prefix = config_prefix
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.entries = LRUCache(max_size=max_size)
+        self.submit: Optional[Callable[..., Any]] = None
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def init_app(self, app: Any, submit: Optional[Callable[..., Any]] = None) -> None:
+        '''
+        Configures the cache from the Flask config, using the config prefix of the cache.
+        For the prefix SEARCH_CACHE, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL
+        and SEARCH_CACHE_NEGATIVE_TTL are read. Background refreshes are run with submit.
+        '''
+        prefix = self.config_prefix
+        self.fresh_ttl = app.config.get(f"{prefix}_TTL", self.fresh_ttl)
+        self.stale_ttl = app.config.get(f"{prefix}_STALE_TTL", self.stale_ttl)
+        self.negative_ttl = app.config.get(f"{prefix}_NEGATIVE_TTL", self.negative_ttl)
+        self.entries = LRUCache(max_size=app.config.get(f"{prefix}_SIZE", self.entries.max_size))
+        self.submit = submit
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Tuple[Any, float]:
+        '''
+        Returns the cached value for key. A missing value is loaded with loader, a stale value is returned
+        as it is and refreshed in the background. Exceptions of loader are raised on a miss.
+        Returns: a tuple, the value and its age in seconds
+        '''
+        entry = self.entries.get(key)
+        if entry is not None:
+            stored_at, fresh_for, value = entry
+            age = time.monotonic() - stored_at
+            if age >= fresh_for:
+                self.stale_hits += 1
+                self._refresh_in_background(key, loader)
+            return value, age
+
+        value = loader()
+        self._store(key, value)
+        return value, 0.0
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        if value:
+            self.entries.set(key, (time.monotonic(), self.fresh_ttl, value), ttl=self.stale_ttl)
+        else:
+            # empty results are not served stale, they could be filled by now
+            self.entries.set(key, (time.monotonic(), self.negative_ttl, value), ttl=self.negative_ttl)
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh() -> None:
+            try:
+                self._store(key, loader())
+                self.refreshes += 1
+            except Exception:
+                # keep serving the stale value, the next stale hit tries again
+                self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        if self.submit is None:
+            refresh()
+        else:
+            self.submit(refresh)
+
+    def clear(self) -> None:
+        '''
+        Removes every entry from the cache.
+        '''
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        '''
+        Returns: a dict, containing the LRU counters and the stale hit and refresh counters
+        '''
+        stats = self.entries.stats()
+        stats["stale_hits"] = self.stale_hits
+        stats["refreshes"] = self.refreshes
+        stats["refresh_errors"] = self.refresh_errors
+        return stats
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from cache import LRUCache
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+
+class ChatSession:
+    '''
+    The chat history of one user, as a list of (role, text) turns.
+    '''
+
+    def __init__(self) -> None:
+        self.history: List[tuple] = []
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        '''
+        Returns: an int, the amount of characters in the history
+        '''
+        return sum(len(text) for _, text in self.history)
+
+    def contents(self) -> List["types.Content"]:
+        '''
+        Returns: a list, the history in the format of the Gemini API
+        '''
+        from google.genai import types
+        return [types.Content(role=role, parts=[types.Part(text=text)]) for role, text in self.history]
+
+    def add_turn(self, message: str, response: str, max_turns: int, max_chars: int) -> None:
+        '''
+        Adds a question and its answer to the history, then drops the oldest turns
+        until the history has at most max_turns turns and max_chars characters.
+        '''
+        self.history += [("user", message), ("model", response)]
+        while self.history and (len(self.history) > 2 * max_turns or self.size > max_chars):
+            self.history = self.history[2:]
+
+
+class ChatSessions:
+    '''
+    Gemini chat sessions, one per user.
+    Every session keeps a bounded history, idle sessions are dropped and the least recently used sessions
+    are evicted when the histories of all sessions together are larger than the memory budget.
+    Answers are cached on the normalized question and the system instruction, so the same question of users
+    with the same reading profile is answered without calling the model. Only the first question of a session
+    is cached, later answers depend on the history of the user and are never shared with another user.
+    Every model call is reported to observer("gemini", seconds, status), status is "ok" or "error".
+    '''
+
+    def __init__(self, model: str = "gemini-2.0-flash", max_turns: int = 10, max_chars: int = 20000,
+                 memory_budget: int = 20_000_000, idle_ttl: float = 30 * 60,
+                 answer_cache_size: int = 1024, answer_cache_ttl: float = 60 * 60) -> None:
+        self.model = model
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        self.api_key: Optional[str] = None
+        self.base_url: Optional[str] = None
+        self._client: Any = None
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.answers = LRUCache(max_size=answer_cache_size, ttl=answer_cache_ttl)
+        self.observer: Optional[Callable[[str, float, str], None]] = None
+        self.evictions = 0
+        self.expirations = 0
+
+    def init_app(self, app: Any) -> None:
+        '''
+        Configures the sessions from the Flask config.
+        GEMINI_API_KEY, CHAT_MODEL, CHAT_MAX_TURNS, CHAT_MAX_HISTORY_CHARS, CHAT_MEMORY_BUDGET, CHAT_IDLE_TTL,
+        CHAT_ANSWER_CACHE_SIZE and CHAT_ANSWER_CACHE_TTL are read, GEMINI_BASE_URL can point to a stand-in server.
+        '''
+        self.api_key = app.config.get("GEMINI_API_KEY", self.api_key)
+        self.base_url = app.config.get("GEMINI_BASE_URL", self.base_url)
+        self._client = None
+        self.model = app.config.get("CHAT_MODEL", self.model)
+        self.max_turns = app.config.get("CHAT_MAX_TURNS", self.max_turns)
+        self.max_chars = app.config.get("CHAT_MAX_HISTORY_CHARS", self.max_chars)
+        self.memory_budget = app.config.get("CHAT_MEMORY_BUDGET", self.memory_budget)
+        self.idle_ttl = app.config.get("CHAT_IDLE_TTL", self.idle_ttl)
+        self.answers = LRUCache(
+            max_size=app.config.get("CHAT_ANSWER_CACHE_SIZE", self.answers.max_size),
+            ttl=app.config.get("CHAT_ANSWER_CACHE_TTL", self.answers.ttl)
+        )
+
+    @property
+    def client(self) -> Any:
+        '''
+        The Gemini client is created on first use. Tests can set it to a fake client.
+        google-genai is only imported then, it is slow to import and most workers never chat.
+        '''
+        with self._lock:
+            if self._client is None:
+                from google import genai
+                http_options = genai.types.HttpOptions(base_url=self.base_url) if self.base_url else None
+                self._client = genai.Client(api_key=self.api_key, http_options=http_options)
+            return self._client
+
+    @client.setter
+    def client(self, client: Any) -> None:
+        self._client = client
+
+    def session(self, user_id: str) -> ChatSession:
+        '''
+        Returns the session of the user, a new one is started when the user has none.
+        '''
+        with self._lock:
+            self._drop_idle_sessions()
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = self._sessions[user_id] = ChatSession()
+            self._sessions.move_to_end(user_id)
+            session.last_used = time.monotonic()
+            return session
+
+    def reset(self, user_id: str) -> None:
+        '''
+        Forgets the history of the user.
+        '''
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def send_message(self, user_id: str, message: str, system_instruction: str) -> str:
+        '''
+        Sends a message in the session of the user, the system instruction is sent with every message
+        so it can change without being stored in the history.
+        Messages of the same user are sent one at a time, so the history stays in order.
+        Returns: a str, the answer of the model
+        '''
+        session = self.session(user_id)
+        key = answer_key(message, system_instruction)
+        with session.lock:
+            cacheable = not session.history
+            answer = self.answers.get(key) if cacheable else None
+            if answer is None:
+                chat = self.client.chats.create(
+                    model=self.model,
+                    config=generate_content_config(system_instruction),
+                    history=session.contents()
+                )
+                with self._observe():
+                    answer = chat.send_message(message).text
+                if cacheable:
+                    self.answers.set(key, answer)
+            session.add_turn(message, answer, self.max_turns, self.max_chars)
+
+        self._enforce_memory_budget()
+        return answer
+
+    def stream_message(self, user_id: str, message: str, system_instruction: str) -> Iterator[str]:
+        '''
+        Sends a message in the session of the user and yields the answer in parts while the model writes it.
+        The turn is only added to the history when the whole answer was received.
+        Returns: an iterator, the parts of the answer
+        '''
+        session = self.session(user_id)
+        key = answer_key(message, system_instruction)
+        with session.lock:
+            cacheable = not session.history
+            answer = self.answers.get(key) if cacheable else None
+            if answer is not None:
+                yield answer
+            else:
+                chat = self.client.chats.create(
+                    model=self.model,
+                    config=generate_content_config(system_instruction),
+                    history=session.contents()
+                )
+                parts = []
+                with self._observe():
+                    for chunk in chat.send_message_stream(message):
+                        if chunk.text:
+                            parts.append(chunk.text)
+                            yield chunk.text
+                answer = "".join(parts)
+                if cacheable:
+                    self.answers.set(key, answer)
+            session.add_turn(message, answer, self.max_turns, self.max_chars)
+
+        self._enforce_memory_budget()
+
+    @contextmanager
+    def _observe(self) -> Iterator[None]:
+        start = time.perf_counter()
+        status = "error"
+        try:
+            yield
+            status = "ok"
+        finally:
+            if self.observer is not None:
+                self.observer("gemini", time.perf_counter() - start, status)
+
+    def _drop_idle_sessions(self) -> None:
+        # the sessions are ordered from least to most recently used
+        now = time.monotonic()
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.idle_ttl:
+                break
+            del self._sessions[user_id]
+            self.expirations += 1
+
+    def _enforce_memory_budget(self) -> None:
+        with self._lock:
+            total = sum(session.size for session in self._sessions.values())
+            while len(self._sessions) > 1 and total > self.memory_budget:
+                _, session = self._sessions.popitem(last=False)
+                total -= session.size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        '''
+        Returns: a dict, containing the amount of sessions, the size of their histories, the eviction counters
+        and the counters of the answer cache
+        '''
+        answers = self.answers.stats()
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "history_chars": sum(session.size for session in self._sessions.values()),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "answer_cache_size": answers["size"],
+                "answer_cache_hits": answers["hits"],
+                "answer_cache_misses": answers["misses"],
+                "answer_cache_evictions": answers["evictions"],
+            }
+
+
+def generate_content_config(system_instruction: str) -> "types.GenerateContentConfig":
+    '''
+    Returns: a GenerateContentConfig, the config of a chat with the system instruction
+    '''
+    from google.genai import types
+    return types.GenerateContentConfig(system_instruction=system_instruction)
+
+
+def answer_key(message: str, system_instruction: str) -> str:
+    '''
+    Normalizes the question, ignoring case, whitespace and the punctuation at its end,
+    and hashes it together with the system instruction that holds the reading profile.
+    Returns: a str, the key of the answer cache
+    '''
+    question = " ".join(message.casefold().split()).rstrip(" .?!")
+    return hashlib.sha256(f"{system_instruction}\0{question}".encode()).hexdigest()
+
+
+def compact_reading_profile(sections: List[Tuple[str, List[str], int]], max_chars: int) -> str:
+    '''
+    Formats the reading profile for the chat within max_chars characters (roughly 4 characters per token).
+    sections is a list of (label, titles, total) in order of importance, titles that do not fit the budget
+    are left out and every section tells how many of its total books are shown.
+    Returns: a str, the reading profile
+    '''
+    header = "User's reading profile:\n"
+    user_context = header
+    for label, titles, total in sections:
+        budget = max_chars - len(user_context) - len(f"- {label} ({total} of {total}): \n")
+        shown: List[str] = []
+        for title in titles:
+            cost = len(title) + (2 if shown else 0)
+            if cost > budget:
+                break
+            shown.append(title)
+            budget -= cost
+        if shown:
+            count = f"{len(shown)} of {total}" if len(shown) < total else f"{total}"
+            user_context += f"- {label} ({count}): {', '.join(shown)}\n"
+
+    if user_context == header:
+        user_context += "- No reading history available yet\n"
+    return user_context
+
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    '''
+    Formats data as a Server-Sent Event.
+    Returns: a str, the event with its json data
+    '''
+    lines = f"event: {event}\n" if event else ""
+    return f"{lines}data: {json.dumps(data)}\n\n"
@@ -0,0 +1,98 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+_DONE = object()
+
+
+class FanOut:
+    '''
+    Runs blocking calls, like Google Books requests, concurrently on a shared bounded thread pool.
+    Every call to map has its own cap on the amount of calls in flight and an overall deadline,
+    so one large request can not take over the whole pool.
+    Calls run in a copy of the context of the caller, so context variables like the request accounting are kept.
+    '''
+
+    def __init__(self, max_workers: int = 16, max_in_flight: int = 8, deadline: float = 20.0) -> None:
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.deadline = deadline
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Any) -> None:
+        '''
+        Configures the pool from the Flask config.
+        FANOUT_MAX_WORKERS, FANOUT_MAX_IN_FLIGHT and FANOUT_DEADLINE are read.
+        '''
+        self.max_workers = app.config.get("FANOUT_MAX_WORKERS", self.max_workers)
+        self.max_in_flight = app.config.get("FANOUT_MAX_IN_FLIGHT", self.max_in_flight)
+        self.deadline = app.config.get("FANOUT_DEADLINE", self.deadline)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        '''
+        The pool is created on first use and recreated after a fork, threads do not survive a fork.
+        '''
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fanout")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(self, func: Callable[..., Any], *args: Any) -> Future:
+        '''
+        Runs func in the background on the shared pool.
+        '''
+        return self.executor.submit(contextvars.copy_context().run, func, *args)
+
+    def map(self, func: Callable[[Any], Any], keys: Iterable[Hashable], max_in_flight: Optional[int] = None,
+            deadline: Optional[float] = None) -> Tuple[Dict[Hashable, Any], Dict[Hashable, str]]:
+        '''
+        Calls func for every key, with at most max_in_flight calls running at the same time.
+        Keys that raise an exception or are not finished before the deadline end up in the errors.
+        Returns: a tuple, a dict of key to result and a dict of key to error message
+        '''
+        max_in_flight = max(1, max_in_flight or self.max_in_flight)
+        deadline = self.deadline if deadline is None else deadline
+        end = time.monotonic() + deadline
+
+        keys_to_run = iter(dict.fromkeys(keys))
+        results: Dict[Hashable, Any] = {}
+        errors: Dict[Hashable, str] = {}
+        pending: Dict[Future, Hashable] = {}
+
+        def fill() -> None:
+            while len(pending) < max_in_flight:
+                key = next(keys_to_run, _DONE)
+                if key is _DONE:
+                    return
+                pending[self.executor.submit(contextvars.copy_context().run, func, key)] = key
+
+        fill()
+        while pending:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    errors[key] = str(e)
+            fill()
+
+        # whatever is left did not finish before the deadline
+        for future, key in pending.items():
+            future.cancel()
+            errors[key] = "deadline exceeded"
+        for key in keys_to_run:
+            errors[key] = "deadline exceeded"
+
+        return results, errors
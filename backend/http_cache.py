@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Optional
+
+from flask import Response, current_app, request
+
+
+def etag_of(value: Any) -> str:
+    '''
+    Hashes a json serializable value, equal values get equal tags.
+    Returns: a str, the tag to use as a strong ETag
+    '''
+    return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    '''
+    Checks the If-None-Match header of the request, so the caller can skip building the response.
+    The weak comparison is used because compressed responses get a weak ETag.
+    Returns: a Response with status 304 when the client already has the current version, otherwise None
+    '''
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+class Compress:
+    '''
+    Compresses large responses with gzip when the client accepts it.
+    Streamed responses are not compressed, so their first rows are not held back.
+    '''
+
+    def __init__(self, min_size: int = 1024, level: int = 6) -> None:
+        self.min_size = min_size
+        self.level = level
+
+    def init_app(self, app: Any) -> None:
+        '''
+        Configures the compression from the Flask config, COMPRESS_MIN_SIZE and COMPRESS_LEVEL are read.
+        '''
+        self.min_size = app.config.get("COMPRESS_MIN_SIZE", self.min_size)
+        self.level = app.config.get("COMPRESS_LEVEL", self.level)
+        app.after_request(self.compress)
+
+    def compress(self, response: Response) -> Response:
+        '''
+        Compresses the body of a response, it is used as an after request function.
+        Returns: the response
+        '''
+        response.vary.add("Accept-Encoding")
+        if ("gzip" not in request.headers.get("Accept-Encoding", "")
+                or response.status_code != 200
+                or response.is_streamed
+                or response.direct_passthrough
+                or "Content-Encoding" in response.headers
+                or response.mimetype != "application/json"
+                or response.content_length is None
+                or response.content_length < self.min_size):
+            return response
+
+        response.set_data(gzip.compress(response.get_data(), compresslevel=self.level))
+        response.headers["Content-Encoding"] = "gzip"
+        # the compressed body is another representation, so the ETag can only be a weak one
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,151 @@
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from flask import Response, g, request
+
+from accounting import current_account
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    '''
+    Counts observations in buckets, like a Prometheus histogram.
+    '''
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: Dict[str, str]) -> List[str]:
+        '''
+        Returns: a list, the lines of the histogram in the Prometheus text format, the buckets are cumulative
+        '''
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': str(bucket)})} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+        return lines
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    '''
+    Returns: a str, the labels in the Prometheus text format, like {route="/",method="GET"}
+    '''
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    '''
+    In-process metrics of the application, served in the Prometheus text format.
+    It records the requests and their latency per route, the SQL queries per request, the upstream calls per target
+    and the counters of every registered cache. Every gunicorn worker has its own metrics, they are summed by Prometheus.
+    '''
+
+    def __init__(self, prefix: str = "bookbuddy") -> None:
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        self.request_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.request_queries: Dict[Tuple[str, str], Histogram] = {}
+        self.upstream_requests: Dict[Tuple[str, str], int] = {}
+        self.upstream_latency: Dict[str, Histogram] = {}
+        self.caches: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+    def init_app(self, app: Any) -> None:
+        '''
+        Times every request of the application, the SQL queries are counted by the request accounting.
+        '''
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def register_cache(self, name: str, stats: Callable[[], Dict[str, int]]) -> None:
+        '''
+        Adds a cache to the metrics, stats returns its counters like LRUCache.stats.
+        '''
+        self.caches[name] = stats
+
+    def observe_upstream(self, target: str, seconds: float, status: str) -> None:
+        '''
+        Records an upstream call, it is used as the observer of the upstream clients.
+        '''
+        with self._lock:
+            key = (target, status)
+            self.upstream_requests[key] = self.upstream_requests.get(key, 0) + 1
+            self.upstream_latency.setdefault(target, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def _start_request(self) -> None:
+        g.metrics_start = time.perf_counter()
+
+    def _finish_request(self, response: Response) -> Response:
+        if "metrics_start" not in g:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        seconds = time.perf_counter() - g.metrics_start
+        account = current_account.get()
+        queries = account.sql if account is not None else 0
+        with self._lock:
+            key = (route, request.method, str(response.status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.request_latency.setdefault((route, request.method), Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.request_queries.setdefault((route, request.method), Histogram(QUERY_BUCKETS)).observe(queries)
+        return response
+
+    def render(self) -> str:
+        '''
+        Returns: a str, every metric in the Prometheus text format
+        '''
+        prefix = self.prefix
+        lines: List[str] = []
+        with self._lock:
+            lines += [f"# HELP {prefix}_http_requests_total Requests per route, method and status.",
+                      f"# TYPE {prefix}_http_requests_total counter"]
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f"{prefix}_http_requests_total{format_labels({'route': route, 'method': method, 'status': status})} {count}")
+
+            lines += [f"# HELP {prefix}_http_request_duration_seconds Request latency per route and method.",
+                      f"# TYPE {prefix}_http_request_duration_seconds histogram"]
+            for (route, method), histogram in sorted(self.request_latency.items()):
+                lines += histogram.lines(f"{prefix}_http_request_duration_seconds", {"route": route, "method": method})
+
+            lines += [f"# HELP {prefix}_db_queries_per_request SQL queries sent by one request, per route and method.",
+                      f"# TYPE {prefix}_db_queries_per_request histogram"]
+            for (route, method), histogram in sorted(self.request_queries.items()):
+                lines += histogram.lines(f"{prefix}_db_queries_per_request", {"route": route, "method": method})
+
+            lines += [f"# HELP {prefix}_upstream_requests_total Upstream calls per target and status.",
+                      f"# TYPE {prefix}_upstream_requests_total counter"]
+            for (target, status), count in sorted(self.upstream_requests.items()):
+                lines.append(f"{prefix}_upstream_requests_total{format_labels({'target': target, 'status': status})} {count}")
+
+            lines += [f"# HELP {prefix}_upstream_request_duration_seconds Upstream latency per target.",
+                      f"# TYPE {prefix}_upstream_request_duration_seconds histogram"]
+            for target, histogram in sorted(self.upstream_latency.items()):
+                lines += histogram.lines(f"{prefix}_upstream_request_duration_seconds", {"target": target})
+
+        cache_stats = {name: stats() for name, stats in sorted(self.caches.items())}
+        for stat in sorted({stat for stats in cache_stats.values() for stat in stats}):
+            lines.append(f"# TYPE {prefix}_cache_{stat} gauge")
+            for name, stats in cache_stats.items():
+                if stat in stats:
+                    lines.append(f"{prefix}_cache_{stat}{format_labels({'cache': name})} {stats[stat]}")
+        lines.append(f"# TYPE {prefix}_cache_hit_ratio gauge")
+        for name, stats in cache_stats.items():
+            lookups = stats.get("hits", 0) + stats.get("misses", 0)
+            if lookups:
+                lines.append(f"{prefix}_cache_hit_ratio{format_labels({'cache': name})} {stats.get('hits', 0) / lookups}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,76 @@
+import base64
+import json
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+# rows are read in batches of this size when a collection is streamed
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(key: List[Any]) -> str:
+    '''
+    Encodes the sort key of the last row of a page.
+    Returns: a str, an opaque url safe cursor
+    '''
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    '''
+    Decodes a cursor made by encode_cursor, an invalid cursor raises a ValueError.
+    Returns: a list, the sort key of the last row of the previous page
+    '''
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(key, list):
+        raise ValueError("invalid cursor")
+    return key
+
+
+def collection_response(fetch_page: Callable[[Optional[List[Any]], int], List[Any]],
+                        key_of: Callable[[Any], List[Any]],
+                        serialize_page: Callable[[List[Any]], List[Dict]],
+                        wrap: Callable[[List[Dict]], Any]) -> Any:
+    '''
+    Returns one page of a collection, using keyset pagination on a stable sort key.
+    fetch_page(after, limit) returns at most limit rows that sort after the key after,
+    key_of(row) returns the sort key of a row, serialize_page(rows) converts rows to json
+    and wrap(items) builds the response body of a page.
+
+    Query parameters:
+    - limit: the page size, capped at the MAX_PAGE_SIZE config
+    - cursor: the X-Next-Cursor header of the previous page
+    - format=ndjson: streams every row from the cursor on as newline delimited json, read in batches
+    '''
+    try:
+        after = decode_cursor(request.args["cursor"]) if "cursor" in request.args else None
+        limit = int(request.args.get("limit", current_app.config["PAGE_SIZE"]))
+    except ValueError:
+        return jsonify({"error": "invalid cursor or limit"}), 400
+    limit = min(max(limit, 1), current_app.config["MAX_PAGE_SIZE"])
+
+    streaming = request.args.get("format") == "ndjson"
+    try:
+        # one extra row tells if there is a next page
+        rows = fetch_page(after, STREAM_BATCH_SIZE if streaming else limit + 1)
+    except (ValueError, TypeError, IndexError):
+        return jsonify({"error": "invalid cursor or limit"}), 400
+
+    if streaming:
+        def generate(rows: List[Any]) -> Iterator[str]:
+            while True:
+                for item in serialize_page(rows):
+                    yield json.dumps(item) + "\n"
+                if len(rows) < STREAM_BATCH_SIZE:
+                    return
+                rows = fetch_page(key_of(rows[-1]), STREAM_BATCH_SIZE)
+
+        return Response(stream_with_context(generate(rows)), mimetype="application/x-ndjson")
+
+    response = jsonify(wrap(serialize_page(rows[:limit])))
+    if len(rows) > limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(key_of(rows[limit - 1]))
+    return response
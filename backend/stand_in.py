@@ -0,0 +1,212 @@
+'''
+A local stand-in server for Google Books and Gemini, so the app can be tested and load tested without quota.
+
+It has three modes:
+- record: the calls are sent to the real APIs and the responses are saved as fixtures
+- replay: the recorded fixtures are served, nothing leaves the machine
+- synthetic: made up volumes, search results and answers are served, the same request gets the same response
+Replayed and synthetic responses wait for the latency of the profile and can fail, see upstream.LatencyProfile.
+
+Run from the backend directory, then point the app to it:
+    python stand_in.py --mode replay --fixtures fixtures --profile typical --port 5050
+    GOOGLE_BOOKS_URL=http://127.0.0.1:5050/books/v1 GEMINI_BASE_URL=http://127.0.0.1:5050 python app.py
+The fixtures are shared with UPSTREAM_MODE=record and UPSTREAM_MODE=replay of the app itself.
+'''
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import requests
+from flask import Flask, Response, request
+
+from upstream import UNRECORDED_STATUSES, Fixtures, LatencyProfile, PROFILES
+
+GOOGLE_BOOKS_UPSTREAM = "https://www.googleapis.com"
+GEMINI_UPSTREAM = "https://generativelanguage.googleapis.com"
+GENRES = ["Fiction", "Fantasy", "Science Fiction", "Mystery", "Romance", "History", "Biography", "Poetry",
+          "Horror", "Thriller", "Philosophy", "Science", "Travel", "Cooking", "Art", "Religion"]
+SYNTHETIC_TOTAL_ITEMS = 200
+# the headers that are sent on to the real APIs when recording, the api key of gemini is a header
+FORWARDED_HEADERS = ("Content-Type", "Accept", "x-goog-api-key", "x-goog-api-client")
+
+
+def digest(text: str) -> int:
+    return int(hashlib.sha1(text.encode()).hexdigest()[:8], 16)
+
+
+def error_body(status: int, message: str, state: str) -> str:
+    '''
+    Returns: a str, an error in the format of the Google APIs
+    '''
+    return json.dumps({"error": {"code": status, "message": message, "status": state}})
+
+
+def synthetic_volume(book_id: str, genre: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Returns: a dict, a made up volume in the format of Google Books, the same id gets the same volume
+    '''
+    number = digest(book_id)
+    return {
+        "kind": "books#volume",
+        "id": book_id,
+        "volumeInfo": {
+            "title": f"Stand-in Book {number % 100000}",
+            "authors": [f"Author {number % 997}"],
+            "publishedDate": str(1900 + number % 125),
+            "description": "A synthetic volume served by the stand-in server.",
+            "pageCount": 100 + number % 700,
+            "categories": [genre or GENRES[number % len(GENRES)]],
+            "averageRating": (number % 9) / 2 + 1,
+            "language": "en",
+        },
+    }
+
+
+def synthetic_search(params: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    Returns: a dict, a page of made up search results, a subject:"Genre" query only finds volumes of that genre
+    '''
+    query = params.get("q", "")
+    subject = re.search(r'subject:"?([^"]+)"?', query)
+    start = max(int(params.get("startIndex", 0)), 0)
+    amount = min(max(int(params.get("maxResults", 10)), 0), 40)
+    items = [synthetic_volume(f"si{digest(query):08x}{index:03d}", subject.group(1) if subject else None)
+             for index in range(start, min(start + amount, SYNTHETIC_TOTAL_ITEMS))]
+    return {"kind": "books#volumes", "totalItems": SYNTHETIC_TOTAL_ITEMS, "items": items}
+
+
+def synthetic_answer(body: Dict[str, Any], model: str) -> str:
+    '''
+    Returns: a str, a made up answer to the last message of a Gemini request
+    '''
+    question = ""
+    for content in body.get("contents", []):
+        if content.get("role", "user") == "user":
+            question = " ".join(part.get("text", "") for part in content.get("parts", []))
+    return f"This is a stand-in answer from {model} to: {question[:200]}"
+
+
+def gemini_response(text: str, model: str) -> Dict[str, Any]:
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "modelVersion": model,
+    }
+
+
+def synthetic_response(path: str, params: Dict[str, str], body: Optional[Dict[str, Any]]) -> Tuple[int, str, str]:
+    '''
+    Returns: a tuple, the status, content type and body of the made up response to a request
+    '''
+    volume = re.fullmatch(r"books/v1/volumes/([^/]+)", path)
+    if volume:
+        return 200, "application/json", json.dumps(synthetic_volume(volume.group(1)))
+    if path == "books/v1/volumes":
+        return 200, "application/json", json.dumps(synthetic_search(params))
+
+    generate = re.fullmatch(r"v1\w*/models/([^:]+):(generateContent|streamGenerateContent)", path)
+    if generate and body is not None:
+        model, method = generate.groups()
+        answer = synthetic_answer(body, model)
+        if method == "generateContent":
+            return 200, "application/json", json.dumps(gemini_response(answer, model))
+        # the answer is streamed in a few parts, like the real API
+        words = answer.split(" ")
+        parts = [" ".join(words[index:index + 8]) + " " for index in range(0, len(words), 8)]
+        events = "".join(f"data: {json.dumps(gemini_response(part, model))}\r\n\r\n" for part in parts)
+        return 200, "text/event-stream", events
+
+    return 404, "application/json", error_body(404, f"The stand-in does not know {path}", "NOT_FOUND")
+
+
+def create_stand_in(mode: str = "synthetic", fixtures: Optional[str] = None, profile: Optional[LatencyProfile] = None,
+                    seed: Optional[int] = None, google_books_upstream: str = GOOGLE_BOOKS_UPSTREAM,
+                    gemini_upstream: str = GEMINI_UPSTREAM) -> Flask:
+    '''
+    Builds the stand-in server. Google Books is served under /books/v1 and Gemini under /v1beta,
+    the same paths as the real APIs, so only the base urls of the app change.
+    Returns: a Flask application
+    '''
+    if mode not in ("record", "replay", "synthetic"):
+        raise ValueError(f"unknown stand-in mode: {mode}")
+    if mode != "synthetic" and not fixtures:
+        raise ValueError(f"the stand-in mode {mode} needs a fixtures directory")
+
+    app = Flask(__name__)
+    store = Fixtures(fixtures or ".")
+    profile = profile or PROFILES["none"]
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    session = requests.Session()
+
+    def forward(path: str, body: bytes) -> Tuple[int, str, str]:
+        upstream = google_books_upstream if path.startswith("books/") else gemini_upstream
+        headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+        response = session.request(request.method, f"{upstream}/{path}", params=list(request.args.items(multi=True)),
+                                   data=body or None, headers=headers, timeout=60)
+        return response.status_code, response.headers.get("Content-Type", "application/json"), response.text
+
+    @app.route("/<path:path>", methods=["GET", "POST"])
+    def serve(path: str) -> Response:
+        body = request.get_data()
+        identity = Fixtures.request_of(request.method, request.url, body)
+
+        if mode == "record":
+            status, content_type, text = forward(path, body)
+            if status not in UNRECORDED_STATUSES:
+                store.save(identity, status, content_type, text)
+            return Response(text, status=status, content_type=content_type)
+
+        with rng_lock:
+            delay, error_status = profile.sample(rng)
+        time.sleep(delay)
+        if error_status is not None:
+            return Response(error_body(error_status, "Injected by the latency profile", "UNAVAILABLE"),
+                            status=error_status, content_type="application/json")
+
+        if mode == "replay":
+            recorded = store.load(identity)
+            if recorded is None:
+                return Response(error_body(404, f"No fixture for {request.method} /{path}", "NOT_FOUND"),
+                                status=404, content_type="application/json")
+            status, content_type, text = recorded["status"], recorded["content_type"], recorded["body"]
+        else:
+            status, content_type, text = synthetic_response(path, request.args.to_dict(), json.loads(body) if body else None)
+
+        if content_type.startswith("text/event-stream"):
+            return Response(stream_events(text), status=status, content_type=content_type)
+        return Response(text, status=status, content_type=content_type)
+
+    return app
+
+
+def stream_events(text: str) -> Iterator[str]:
+    '''
+    Sends the Server-Sent Events of a recorded stream one at a time.
+    Returns: an iterator, the events
+    '''
+    for event in re.findall(r".+?(?:\r\n\r\n|\n\n|$)", text, flags=re.S):
+        yield event
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="A stand-in server for Google Books and Gemini.")
+    parser.add_argument("--mode", choices=["record", "replay", "synthetic"], default="synthetic")
+    parser.add_argument("--fixtures", help="the directory of the recorded responses, needed to record and replay")
+    parser.add_argument("--profile", default="none",
+                        help=f"the latency profile, one of {', '.join(PROFILES)} or like latency=0.2,jitter=0.05,error_rate=0.01")
+    parser.add_argument("--seed", type=int, help="the seed of the latency and errors, for reproducible runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    args = parser.parse_args()
+
+    app = create_stand_in(args.mode, args.fixtures, LatencyProfile.parse(args.profile), args.seed)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
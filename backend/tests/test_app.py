@@ -0,0 +1,697 @@
+import unittest
+import sys
+import os
+import json
+import sqlite3
+import subprocess
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+from unittest import mock
+
+from requests import HTTPError
+from sqlalchemy import inspect
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from accounting import RequestBudgetExceeded
+from app import BookListEntry, BookPopularity, Favorite, Review, UserGenre, chat_sessions, create_app, db, fan_out, favorite_genre, get_reading_profile, google_books, migrate_json_book_lists, rebuild_genre_profiles, request_accounting, upgrade_db, volume_cache
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+class FakeGoogleBooks:
+    '''
+    Stand-in for the get method of the Google Books client, it serves volumes from a dict and counts the calls.
+    When down is True every call gets the 503 error body of Google Books, ids with a space are rejected with a 400.
+    '''
+
+    @staticmethod
+    def response(status_code: int, body: Dict[str, Any]) -> Any:
+        def raise_for_status() -> None:
+            if status_code >= 400:
+                raise HTTPError(f"{status_code} Error")
+        return mock.Mock(status_code=status_code, json=lambda: body, raise_for_status=raise_for_status)
+
+    def __init__(self, volumes: Dict[str, Dict[str, Any]]) -> None:
+        self.volumes = volumes
+        self.down = False
+        self.calls = 0
+
+    def get(self, path: str, params: Optional[Dict[str, Any]] = None, target: str = "default", **kwargs: Any) -> Any:
+        self.calls += 1
+        if self.down:
+            return self.response(503, {"error": {"code": 503, "message": "Backend Error"}})
+        if path == "/volumes":
+            return self.response(200, {"kind": "books#volumes", "items": list(self.volumes.values())})
+        book_id = path.rsplit("/", 1)[1]
+        if " " in book_id:
+            return self.response(400, {"error": {"code": 400, "message": "The volume ID could not be parsed."}})
+        if book_id not in self.volumes:
+            return self.response(404, {"error": {"code": 404, "message": "The volume ID could not be found."}})
+        return self.response(200, self.volumes[book_id])
+
+def volume(book_id: str, categories: str, title: Optional[str] = None) -> Dict[str, Any]:
+    return {"kind": "books#volume", "id": book_id, "volumeInfo": {"title": title or book_id, "categories": [categories]}}
+
+class AppFactoryTests(unittest.TestCase):
+    '''
+    Test class for the application factory, the application uses a temporary database and no server is needed.
+    '''
+
+    def setUp(self) -> None:
+        '''
+        Creates an application with a temporary database.
+        '''
+        self.directory = tempfile.TemporaryDirectory()
+        self.create_test_app()
+
+    def create_test_app(self, **config: Any) -> None:
+        '''
+        Creates the application with the temporary database and sets up its tables, config overrides the settings.
+        '''
+        self.app = create_app({
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(self.directory.name, 'bookbuddy.db')}",
+            "VOLUME_CACHE_PATH": os.path.join(self.directory.name, "volume_cache.db"),
+            **config,
+        })
+        with self.app.app_context():
+            upgrade_db()
+        self.client = self.app.test_client()
+
+    def tearDown(self) -> None:
+        with self.app.app_context():
+            db.engine.dispose()
+        self.directory.cleanup()
+
+    def test_0010_home(self) -> None:
+        '''
+        Tests the home page of the application.
+        '''
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"message": "Welcome to BookBuddy"})
+
+    def test_0020_read_books(self) -> None:
+        '''
+        Tests that a book added to a list is stored in the temporary database.
+        '''
+        response = self.client.post("/read_books/user1/add/5zl-KQEACAAJ")
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get("/read_books/user1")
+        self.assertEqual(response.get_json(), {"user": "user1", "book_list_id": {"list": ["5zl-KQEACAAJ"]}})
+
+    def test_0030_upgrade_db_command(self) -> None:
+        '''
+        Tests the upgrade-db command, running it on an upgraded database changes nothing.
+        '''
+        result = self.app.test_cli_runner().invoke(args=["upgrade-db"])
+        self.assertIn("Database is up to date.", result.output)
+
+    def test_0035_migrate_json_book_lists(self) -> None:
+        '''
+        Tests that a database with the old json book lists is migrated in order without duplicates,
+        that the missing indexes are created, that the responses keep their shape and that upgrading again changes nothing.
+        '''
+        with self.app.app_context():
+            db.engine.dispose()
+        path = os.path.join(self.directory.name, "old.db")
+        with closing(sqlite3.connect(path)) as connection, connection:
+            for table in ("favorite", "read_books", "want_to_read"):
+                connection.execute(f"CREATE TABLE {table} (user VARCHAR(100) PRIMARY KEY, book_list_id JSON)")
+            connection.execute("CREATE TABLE review (id INTEGER PRIMARY KEY, book_id VARCHAR(15) NOT NULL, user VARCHAR(30) NOT NULL, "
+                               "rating FLOAT NOT NULL, date DATETIME, message TEXT)")
+            connection.executemany("INSERT INTO favorite VALUES (?, ?)", [
+                ("user1", json.dumps({"list": ["book2", "book1", "book2", "book3"]})),
+                ("user2", json.dumps({"list": ["book1"]})),
+            ])
+            connection.execute("INSERT INTO read_books VALUES (?, ?)", ("user1", json.dumps({"list": ["book3", "book1"]})))
+            connection.execute("INSERT INTO want_to_read VALUES (?, ?)", ("user1", json.dumps({"list": []})))
+            connection.executemany("INSERT INTO review (book_id, user, rating, message) VALUES (?, ?, ?, ?)",
+                                   [("book1", "user1", 4, "first"), ("book1", "user1", 2, "again")])
+
+        fake = FakeGoogleBooks({f"book{i}": volume(f"book{i}", "Fiction") for i in range(1, 4)})
+        self.app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}", "VOLUME_CACHE_PATH": None})
+        self.client = self.app.test_client()
+        with mock.patch.object(google_books, "get", fake.get), self.app.app_context():
+            upgrade_db()
+            entries = BookListEntry.query.count()
+            upgrade_db()
+            self.assertEqual(BookListEntry.query.count(), entries)
+            self.assertEqual(migrate_json_book_lists(), 0)
+            self.assertEqual(db.session.get(BookPopularity, "book1").favorite_count, 2)
+            self.assertEqual(db.session.get(UserGenre, ("user1", "Fiction")).genre_count, 3)
+            self.assertEqual(Review.query.count(), 1)
+            indexes = {index["name"] for index in inspect(db.engine).get_indexes("review")}
+            self.assertLessEqual({"ix_review_rating_id", "ix_review_date_id", "uq_review_user_book_id"}, indexes)
+
+        self.assertEqual(self.client.get("/favorites/user1").get_json(), {"user": "user1", "book_list_id": {"list": ["book2", "book1", "book3"]}})
+        self.assertEqual(self.client.get("/read_books/user1").get_json(), {"user": "user1", "book_list_id": {"list": ["book3", "book1"]}})
+        self.assertEqual(self.client.get("/want_to_reads/user1").get_json(), {"user": "user1", "book_list_id": {"list": []}})
+        self.assertEqual(self.client.get("/favorites").get_json(), {"favorites": [
+            {"user": "user1", "book_list_id": {"list": ["book2", "book1", "book3"]}},
+            {"user": "user2", "book_list_id": {"list": ["book1"]}},
+        ]})
+
+    def test_0040_bulk_operations(self) -> None:
+        '''
+        Tests that the operations of a bulk request are applied in order and that every operation has a result.
+        '''
+        response = self.client.post("/read_books/user1/bulk", json={"operations": [
+            {"op": "add", "book_id": "book1"},
+            {"op": "add", "book_id": "book2"},
+            {"op": "add", "book_id": "book3"},
+            {"op": "add", "book_id": "book1"},
+            {"op": "move", "book_id": "book3", "position": 0},
+            {"op": "remove", "book_id": "book2"},
+            {"op": "remove", "book_id": "book4"},
+            {"op": "rename", "book_id": "book1"},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual([result["success"] for result in body["results"]], [True, True, True, False, True, True, False, False])
+        self.assertEqual(body["results"][3]["error"], "book is already in the list")
+        self.assertEqual(body["data"]["book_list_id"]["list"], ["book3", "book1"])
+
+        response = self.client.post("/read_books/user1/bulk", json={"operations": [
+            {"op": "remove", "book_id": "book3"},
+            {"op": "add", "book_id": "book4"},
+            {"op": "add", "book_id": "book3"},
+        ]})
+        self.assertEqual(response.get_json()["data"]["book_list_id"]["list"], ["book1", "book4", "book3"])
+
+        response = self.client.post("/read_books/user1/bulk", json={"operations": "add book1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_0045_bulk_creates_list_after_upstream(self) -> None:
+        '''
+        Tests that the first bulk request of a user does not lock the database while Google Books is called,
+        and that no list is created when every operation failed.
+        '''
+        fake = FakeGoogleBooks({"book1": volume("book1", "Fiction")})
+        writes = []
+
+        def get(path: str, *args: Any, **kwargs: Any) -> Any:
+            # another connection writes during the upstream call, it fails at once when the database is locked
+            with closing(sqlite3.connect(os.path.join(self.directory.name, "bookbuddy.db"), timeout=0)) as connection, connection:
+                connection.execute("INSERT INTO review (book_id, user, rating) VALUES (?, ?, ?)", ("book9", f"user{len(writes)}", 3))
+            writes.append(path)
+            return fake.get(path, *args, **kwargs)
+
+        with mock.patch.object(google_books, "get", get):
+            response = self.client.post("/favorites/user1/bulk", json={"operations": [{"op": "add", "book_id": "book1"}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["data"], {"user": "user1", "book_list_id": {"list": ["book1"]}})
+        self.assertEqual(writes, ["/volumes/book1"])
+
+        response = self.client.post("/favorites/user2/bulk", json={"operations": [{"op": "remove", "book_id": "book1"}]})
+        self.assertEqual(response.get_json()["data"], {"user": "user2", "book_list_id": {"list": []}})
+        with self.app.app_context():
+            self.assertIsNone(db.session.get(Favorite, "user2"))
+
+    def test_0050_review_of_known_volume(self) -> None:
+        '''
+        Tests that a review of a volume in the registry is stored without asking Google Books if the volume exists.
+        '''
+        volume_cache.mark_verified(["5zl-KQEACAAJ"])
+        response = self.client.post("/submit_review", json={"book_id": "5zl-KQEACAAJ", "user": "user1", "rating": 4, "message": "Great book"})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get("/ratings_book/5zl-KQEACAAJ")
+        self.assertEqual(response.get_json()["count"], 1)
+
+    def test_0055_reviews_of_book(self) -> None:
+        '''
+        Tests that only the reviews of the book are returned, sorted and limited as asked,
+        and that a limit that is not a number between 1 and MAX_PAGE_SIZE is rejected.
+        '''
+        with self.app.app_context():
+            db.session.add_all([
+                Review(book_id="book1", user="user1", rating=4.0, date=datetime(2024, 1, 3), message="third"),
+                Review(book_id="book1", user="user2", rating=2.0, date=datetime(2024, 1, 1), message="first"),
+                Review(book_id="book1", user="user3", rating=5.0, date=datetime(2024, 1, 2), message="second"),
+                Review(book_id="book2", user="user1", rating=1.0, date=datetime(2023, 1, 1), message="other book"),
+            ])
+            db.session.commit()
+
+        def messages(query: str) -> Any:
+            response = self.client.get(f"/reviews_book/book1{query}")
+            self.assertEqual(response.status_code, 200)
+            reviews = response.get_json()["reviews"]
+            self.assertEqual({review["book_id"] for review in reviews}, {"book1"})
+            return [review["message"] for review in reviews]
+
+        self.assertEqual(messages(""), ["first", "second", "third"])
+        self.assertEqual(messages("?order=desc"), ["third", "second", "first"])
+        self.assertEqual(messages("?sort_by=rating&order=desc"), ["second", "third", "first"])
+        self.assertEqual(messages("?sort_by=rating&order=asc&limit=2"), ["first", "third"])
+        self.assertEqual(messages("?limit=500"), ["first", "second", "third"])
+        self.assertEqual(self.client.get("/reviews_book/book3").get_json(), {"reviews": None})
+
+        for limit in ("ten", "0", "-1", "501"):
+            response = self.client.get(f"/reviews_book/book1?limit={limit}")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json(), {"Error": "Limit should be a number between 1 and 500."})
+        self.assertEqual(self.client.get("/reviews_book/book1?sort_by=title").status_code, 404)
+        self.assertEqual(self.client.get("/reviews_book/book1?order=up").status_code, 404)
+
+    def test_0060_conditional_get(self) -> None:
+        '''
+        Tests that a list of books is sent again only after the list changed, and that large responses are compressed.
+        '''
+        for i in range(20):
+            volume_cache.set(f"book{i}", {"kind": "books#volume", "id": f"book{i}", "volumeInfo": {"title": f"Title {i}" * 10}})
+        self.client.post("/read_books/user1/bulk", json={"operations": [{"op": "add", "book_id": f"book{i}"} for i in range(20)]})
+
+        response = self.client.get("/read_book_objects/user1")
+        etag = response.headers["ETag"]
+        self.assertEqual(len(response.get_json()), 20)
+        self.assertEqual(self.client.get("/read_book_objects/user1", headers={"If-None-Match": etag}).status_code, 304)
+
+        response = self.client.get("/read_book_objects/user1", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["ETag"], f"W/{etag}")
+
+        self.client.post("/read_books/user1/delete/book0")
+        self.assertEqual(self.client.get("/read_book_objects/user1", headers={"If-None-Match": etag}).status_code, 200)
+
+        response = self.client.get("/get_book/book1")
+        self.assertEqual(self.client.get("/get_book/book1", headers={"If-None-Match": response.headers["ETag"]}).status_code, 304)
+
+    def test_0065_conditional_get_of_failed_volume(self) -> None:
+        '''
+        Tests that a list with a book that Google Books failed to send is not tagged, so the client gets it again.
+        '''
+        fake = FakeGoogleBooks({"book1": volume("book1", "Fiction")})
+        self.client.post("/read_books/user1/bulk", json={"operations": [{"op": "add", "book_id": "book1"}]})
+        with mock.patch.object(google_books, "get", fake.get):
+            fake.down = True
+            response = self.client.get("/read_book_objects/user1")
+            self.assertEqual(response.get_json()[0]["error"]["code"], 503)
+            self.assertNotIn("ETag", response.headers)
+
+            fake.down = False
+            response = self.client.get("/read_book_objects/user1")
+            self.assertEqual(response.get_json()[0]["kind"], "books#volume")
+            self.assertIn("ETag", response.headers)
+
+    def test_0066_paginated_reviews(self) -> None:
+        '''
+        Tests that the pages of the sorted reviews follow each other with the X-Next-Cursor header,
+        that reviews with the same rating keep a stable order, and the ndjson format and invalid cursors.
+        '''
+        with self.app.app_context():
+            db.session.add_all(Review(book_id=f"book{i}", user=f"user{i}", rating=i % 2 + 3, message=f"review {i}") for i in range(7))
+            db.session.commit()
+
+        users = []
+        cursor = None
+        while True:
+            response = self.client.get("/reviews_sorted", query_string={"sort_by": "rating", "order": "desc", "limit": 3,
+                                                                         **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.get_json()), 3)
+            users += [review["user"] for review in response.get_json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        # the review id breaks ties, so every review is on exactly one page
+        self.assertEqual(users, ["user5", "user3", "user1", "user6", "user4", "user2", "user0"])
+
+        response = self.client.get("/reviews_sorted?sort_by=rating&order=desc&format=ndjson")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual([json.loads(line)["user"] for line in response.get_data(as_text=True).splitlines()], users)
+
+        self.assertEqual(self.client.get("/reviews_sorted?cursor=not-a-cursor").status_code, 400)
+        self.assertEqual(self.client.get("/reviews_sorted?limit=many").status_code, 400)
+
+    def test_0068_reading_profile(self) -> None:
+        '''
+        Tests that the reading profile of the chat is rebuilt after a list changes or is deleted and created again,
+        and that a profile with a book that could not be fetched is not cached.
+        '''
+        fake = FakeGoogleBooks({"book1": volume("book1", "Fiction", "Dune"), "book2": volume("book2", "Romance", "Emma")})
+        with mock.patch.object(google_books, "get", fake.get), self.app.test_request_context():
+            self.client.post("/read_books/user1/add/book1")
+            self.assertIn("Dune", get_reading_profile("user1"))
+            self.client.post("/read_books/user1/add/book2")
+            self.assertIn("Emma", get_reading_profile("user1"))
+
+            fake.down = True
+            self.client.post("/read_books/user1/add/book3")
+            self.assertNotIn("book3", get_reading_profile("user1"))
+            fake.down = False
+            fake.volumes["book3"] = volume("book3", "Fiction", "Ulysses")
+            self.assertIn("Ulysses", get_reading_profile("user1"))
+            calls = fake.calls
+            get_reading_profile("user1")
+            self.assertEqual(fake.calls, calls)
+
+            # a list that is deleted and created again does not get the revision of the deleted list
+            self.client.post("/favorites/user2/add/book1")
+            self.assertIn("Dune", get_reading_profile("user2"))
+            self.client.delete("/favorites/user2")
+            self.client.post("/favorites/user2/add/book2")
+            self.assertNotIn("Dune", get_reading_profile("user2"))
+            self.assertIn("Emma", get_reading_profile("user2"))
+
+            # an id that Google Books rejects will not be found later, the profile is cached without it
+            self.client.post("/read_books/user3/add/book1")
+            self.client.post("/read_books/user3/add/not an id")
+            self.assertIn("Dune", get_reading_profile("user3"))
+            calls = fake.calls
+            get_reading_profile("user3")
+            self.assertEqual(fake.calls, calls)
+
+    def test_0069_get_books(self) -> None:
+        '''
+        Tests that many books are fetched in one request with GET or POST, once per id,
+        and that books that could not be fetched are in the errors.
+        '''
+        fake = FakeGoogleBooks({"book1": volume("book1", "Fiction"), "book2": volume("book2", "Poetry")})
+        volume_cache.set("book3", volume("book3", "History"))
+        with mock.patch.object(google_books, "get", fake.get):
+            response = self.client.get("/get_books?ids=book1, book2,,book1 ,book3,missing")
+            body = response.get_json()
+            self.assertEqual(sorted(body["books"]), ["book1", "book2", "book3"])
+            self.assertEqual(body["errors"]["missing"]["code"], 404)
+            self.assertEqual(fake.calls, 3)
+            self.assertEqual(volume_cache.stats()["misses"], 3)
+
+            response = self.client.post("/get_books", json={"ids": ["book1", " ", "book2", "book2"]})
+            self.assertEqual(sorted(response.get_json()["books"]), ["book1", "book2"])
+            self.assertEqual(response.get_json()["errors"], {})
+            self.assertEqual(fake.calls, 3)
+
+        self.assertEqual(self.client.post("/get_books", json={"ids": "book1"}).status_code, 400)
+        self.assertEqual(self.client.post("/get_books", json={"ids": [f"book{i}" for i in range(101)]}).status_code, 400)
+        self.assertEqual(self.client.get("/get_books?ids=" + ",".join(["book1"] * 101)).status_code, 200)
+
+    def test_0070_metrics(self) -> None:
+        '''
+        Tests that requests are counted per route and that the SQL queries of a request are recorded.
+        '''
+        self.client.post("/read_books/user1/add/5zl-KQEACAAJ")
+        text = self.client.get("/metrics").get_data(as_text=True)
+
+        self.assertIn('bookbuddy_http_requests_total{route="/read_books/<string:user_id>/add/<string:book_id>",method="POST",status="201"}', text)
+        self.assertIn('bookbuddy_db_queries_per_request_count{route="/read_books/<string:user_id>/add/<string:book_id>",method="POST"}', text)
+
+    def test_0080_request_cost(self) -> None:
+        '''
+        Tests that the upstream calls, also the ones on fan-out threads, and the SQL statements of a request are counted.
+        '''
+        @self.app.route("/fan_out_test")
+        def fan_out_test() -> str:
+            fan_out.map(request_accounting.count_upstream, ["google_books_volume", "gemini"])
+            return "ok"
+
+        response = self.client.post("/read_books/user1/add/5zl-KQEACAAJ")
+        self.assertRegex(response.headers["X-Request-Cost"], r"^upstream=0; sql=\d+$")
+
+        response = self.client.get("/fan_out_test")
+        self.assertEqual(response.headers["X-Request-Cost"], "upstream=2; sql=0; gemini=1; google_books_volume=1")
+
+    def test_0090_request_budget(self) -> None:
+        '''
+        Tests that a request over its budget fails in test mode.
+        '''
+        with self.app.app_context():
+            db.engine.dispose()
+        self.create_test_app(REQUEST_BUDGET_SQL=1)
+        with self.assertRaises(RequestBudgetExceeded):
+            self.client.post("/read_books/user1/add/5zl-KQEACAAJ")
+
+    def test_0095_streamed_request_cost(self) -> None:
+        '''
+        Tests that the gemini calls of a streamed chat answer count for the request, they are made after the headers
+        were sent, so the budget is checked again when the stream ends.
+        '''
+        def create(model: str, config: Any, history: Any) -> Any:
+            return SimpleNamespace(send_message_stream=lambda message: iter([SimpleNamespace(text="An answer.")]))
+
+        chat_sessions.client = SimpleNamespace(chats=SimpleNamespace(create=create))
+        response = self.client.post("/api/chat/stream", json={"message": "What should I read?", "user_id": "user1"})
+        self.assertRegex(response.headers["X-Request-Cost"], r"^upstream=0; sql=\d+$")
+        self.assertIn("An answer.", response.get_data(as_text=True))
+
+        with self.app.app_context():
+            db.engine.dispose()
+        self.create_test_app(REQUEST_BUDGET_UPSTREAM=0)
+        chat_sessions.client = SimpleNamespace(chats=SimpleNamespace(create=create))
+        response = self.client.post("/api/chat/stream", json={"message": "What else should I read?", "user_id": "user1"})
+        with self.assertRaises(RequestBudgetExceeded) as raised:
+            response.get_data()
+        self.assertEqual(json.loads(str(raised.exception))["upstream"], {"gemini": 1})
+
+    def test_0100_import_is_lazy(self) -> None:
+        '''
+        Tests that importing the application does not import google-genai, it is imported on the first chat.
+        '''
+        code = "import sys, app; print('google.genai' in sys.modules)"
+        output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "False")
+
+    def test_0110_favorites_within_budget(self) -> None:
+        '''
+        Tests that large favorite changes keep the counts and the genre profile up to date within the default SQL budget.
+        '''
+        for i in range(20):
+            volume_cache.set(f"book{i}", {"kind": "books#volume", "id": f"book{i}",
+                                          "volumeInfo": {"categories": [f"Fiction / Genre {i % 4} / Genre {i % 5}"]}})
+
+        response = self.client.post("/favorites/user1/bulk", json={"operations": [{"op": "add", "book_id": f"book{i}"} for i in range(20)]})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post("/favorites", json={"user": "user2", "book_list_id": {"list": [f"book{i}" for i in range(15)]}})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post("/favorites/user1/bulk", json={"operations": [{"op": "remove", "book_id": f"book{i}"} for i in range(10)]})
+        self.assertEqual(response.status_code, 200)
+
+        with self.app.app_context():
+            self.assertEqual(db.session.get(BookPopularity, "book0").favorite_count, 1)
+            self.assertEqual(db.session.get(BookPopularity, "book19").favorite_count, 1)
+            self.assertEqual(db.session.get(BookPopularity, "book14").favorite_count, 2)
+            genres = {row.genre: row.genre_count for row in UserGenre.query.filter_by(user="user1")}
+            self.assertEqual(genres["Fiction"], 10)
+            self.assertEqual(genres["Genre 0"], 2 + 2)
+
+    def test_0120_genres_of_failed_fetch(self) -> None:
+        '''
+        Tests that a favorite whose fetch failed is added to the genre profile once Google Books works again,
+        and that removing favorites does not call Google Books.
+        '''
+        fake = FakeGoogleBooks({"book1": volume("book1", "Fiction / Fantasy"), "book2": volume("book2", "Fantasy")})
+        with mock.patch.object(google_books, "get", fake.get):
+            fake.down = True
+            self.client.post("/favorites/user1/add/book1")
+            with self.app.app_context():
+                self.assertEqual(UserGenre.query.filter_by(user="user1").count(), 0)
+
+            # the next change of the favorites retries the pending book
+            fake.down = False
+            self.client.post("/favorites/user1/add/book2")
+            with self.app.app_context():
+                genres = {row.genre: row.genre_count for row in UserGenre.query.filter_by(user="user1")}
+            self.assertEqual(genres, {"Fiction": 1, "Fantasy": 2})
+
+            # upgrade_db retries the books that are still pending
+            fake.down = True
+            self.client.post("/favorites/user2/add/book3")
+            fake.volumes["book3"] = volume("book3", "Poetry")
+            fake.down = False
+            with self.app.app_context():
+                upgrade_db()
+                self.assertEqual(UserGenre.query.filter_by(user="user2").one().genre, "Poetry")
+
+            fake.down = True
+            calls = fake.calls
+            self.client.post("/favorites/user1/delete/book2")
+            self.client.delete("/favorites/user2")
+            self.assertEqual(fake.calls, calls)
+            with self.app.app_context():
+                genres = {row.genre: row.genre_count for row in UserGenre.query.all()}
+            self.assertEqual(genres, {"Fiction": 1, "Fantasy": 1})
+
+    def test_0130_rebuild_genre_profiles(self) -> None:
+        '''
+        Tests that the rebuild of the genre profiles is not limited by the deadline of a request.
+        '''
+        with self.app.app_context():
+            db.engine.dispose()
+        self.create_test_app(FANOUT_DEADLINE=0.01, FANOUT_MAX_IN_FLIGHT=2)
+        fake = FakeGoogleBooks({f"book{i}": volume(f"book{i}", f"Genre {i % 3}") for i in range(20)})
+        slow_get = lambda *args, **kwargs: (time.sleep(0.01), fake.get(*args, **kwargs))[1]
+        with self.app.app_context():
+            db.session.add_all(BookListEntry(user=f"user{i}", list_type=Favorite.LIST_TYPE, book_id=f"book{i}", position=0) for i in range(20))
+            db.session.commit()
+            with mock.patch.object(google_books, "get", slow_get):
+                rebuild_genre_profiles()
+                db.session.commit()
+            self.assertEqual(UserGenre.query.count(), 20)
+
+    def test_0140_favorite_genre_ties(self) -> None:
+        '''
+        Tests that a tie between genres goes to the genre that is seen first in the favorites.
+        '''
+        for book_id, categories in (("book1", "Fiction / Fantasy"), ("book2", "Romance / Fantasy / Fiction")):
+            volume_cache.set(book_id, volume(book_id, categories))
+        self.client.post("/favorites", json={"user": "user1", "book_list_id": {"list": ["book1", "book2"]}})
+        self.client.post("/favorites", json={"user": "user2", "book_list_id": {"list": ["book2", "book1"]}})
+
+        with self.app.app_context():
+            self.assertEqual(favorite_genre("user1"), "Fiction")
+            self.assertEqual(favorite_genre("user2"), "Fantasy")
+            self.assertEqual(favorite_genre("user3"), "Fiction")
+
+    def test_0150_most_favorites(self) -> None:
+        '''
+        Tests that the favorite counts follow every change of the favorites, and the limit of the most favorites.
+        '''
+        for i in range(120):
+            volume_cache.set(f"book{i}", volume(f"book{i}", "Fiction"))
+
+        def most_favorites(query: str = "") -> Any:
+            return self.client.get(f"/most_favorites{query}").get_json()["most_favorites"]
+
+        self.client.post("/favorites", json={"user": "user1", "book_list_id": {"list": ["book1", "book2", "book3"]}})
+        self.client.post("/favorites/user2/add/book2")
+        self.client.post("/favorites/user3/add/book2")
+        self.client.post("/favorites/user3/add/book3")
+        self.assertEqual(most_favorites(), ["book2", "book3", "book1"])
+
+        self.client.post("/favorites/user3/delete/book2")
+        self.client.put("/favorites/user1", json={"book_list_id": {"list": ["book3", "book4"]}})
+        self.assertEqual(most_favorites(), ["book3", "book2", "book4"])
+
+        # a book that is no longer a favorite is not in the list, even though its count is kept
+        self.client.delete("/favorites/user2")
+        self.assertEqual(most_favorites(), ["book3", "book4"])
+        with self.app.app_context():
+            self.assertEqual(db.session.get(BookPopularity, "book2").favorite_count, 0)
+            self.assertEqual(db.session.get(BookPopularity, "book1").favorite_count, 0)
+
+        self.client.post("/favorites", json={"user": "user4", "book_list_id": {"list": [f"book{i}" for i in range(120)]}})
+        self.assertEqual(len(most_favorites()), 10)
+        self.assertEqual(most_favorites("?limit=2"), ["book3", "book4"])
+        self.assertEqual(len(most_favorites("?limit=500")), 100)
+        self.assertEqual(len(most_favorites("?limit=0")), 1)
+        response = self.client.get("/most_favorites?limit=ten")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json(), {"error": "limit should be a number"})
+
+    def test_0160_book_ratings(self) -> None:
+        '''
+        Tests that submitting, updating and deleting reviews keeps the rating aggregates up to date,
+        that low ratings are counted as 1 star and that the batch endpoint leaves out books without reviews.
+        '''
+        volume_cache.mark_verified(["book1", "book2", "book3"])
+
+        def submit(user: str, book_id: str, rating: float) -> Any:
+            response = self.client.post("/submit_review", json={"book_id": book_id, "user": user, "rating": rating, "message": "A review."})
+            self.assertEqual(response.status_code, 201)
+            return response.get_json()["review_id"]
+
+        review_id = submit("user1", "book1", 0.4)
+        submit("user2", "book1", 4.5)
+        submit("user3", "book1", 2.5)
+        submit("user1", "book2", 0)
+        submit("user1", "book3", 5)
+        rating = self.client.get("/ratings_book/book1").get_json()
+        self.assertEqual((rating["count"], rating["sum"]), (3, 7.4))
+        self.assertEqual(rating["histogram"], {"1": 1, "2": 0, "3": 1, "4": 0, "5": 1})
+        self.assertEqual(self.client.get("/ratings_book/book2").get_json()["histogram"]["1"], 1)
+        self.assertEqual(self.client.post("/submit_review", json={"book_id": "book1", "user": "user4", "rating": 5.5}).status_code, 400)
+
+        self.client.put(f"/update_review/{review_id}", json={"rating": 3.5, "message": "Better on a second read."})
+        rating = self.client.get("/ratings_book/book1").get_json()
+        self.assertEqual((rating["count"], rating["sum"], rating["mean"]), (3, 10.5, 3.5))
+        self.assertEqual(rating["histogram"], {"1": 0, "2": 0, "3": 1, "4": 1, "5": 1})
+
+        self.client.delete("/delete_review", json={"user": "user2", "book_id": "book1"})
+        self.client.delete("/delete_review", json={"user": "user1", "book_id": "book3"})
+        rating = self.client.get("/ratings_book/book1").get_json()
+        self.assertEqual((rating["count"], rating["sum"]), (2, 6.0))
+        self.assertEqual(rating["histogram"], {"1": 0, "2": 0, "3": 1, "4": 1, "5": 0})
+        rating = self.client.get("/ratings_book/book3").get_json()
+        self.assertEqual((rating["count"], rating["mean"]), (0, None))
+
+        ratings = self.client.get("/ratings_books?ids=book1,book2,book3,book4").get_json()["ratings"]
+        self.assertEqual(sorted(ratings), ["book1", "book2"])
+        self.assertEqual(ratings["book1"]["count"], 2)
+        ratings = self.client.post("/ratings_books", json={"ids": ["book2", " book2", "book4"]}).get_json()["ratings"]
+        self.assertEqual(list(ratings), ["book2"])
+        self.assertEqual(self.client.post("/ratings_books", json={"ids": "book1"}).status_code, 400)
+
+    def test_0165_search_cache(self) -> None:
+        '''
+        Tests that searches that only differ in case or whitespace share one cache entry and one upstream call,
+        and that empty results expire after SEARCH_CACHE_NEGATIVE_TTL instead of the normal time to live.
+        '''
+        urls = []
+
+        def get(url: str, *args: Any, **kwargs: Any) -> Any:
+            urls.append(url)
+            items = [] if "nothing" in url else [volume("book1", "Fiction", "Dune")]
+            return FakeGoogleBooks.response(200, {"kind": "books#volumes", "items": items})
+
+        with mock.patch.object(google_books, "get", get), mock.patch.dict(os.environ, {"API_KEY": "test"}):
+            for query in ("Dune", "  dune ", "DUNE", "dune&order_by=&lang="):
+                self.assertEqual(self.client.get(f"/search?q={query}").get_json()[0]["volumeInfo"]["title"], "Dune")
+            self.assertEqual(len(urls), 1)
+            self.client.get("/search?q=dune&page=2")
+            self.assertEqual(len(urls), 2)
+
+            self.assertEqual(self.client.get("/search?q=nothing at all").get_json(), [])
+            self.assertEqual(self.client.get("/search?q=Nothing  At all").get_json(), [])
+            self.assertEqual(len(urls), 3)
+
+            # after the negative time to live, but within the normal one
+            later = time.monotonic() + self.app.config["SEARCH_CACHE_NEGATIVE_TTL"] + 1
+            self.assertLess(later - time.monotonic(), self.app.config["SEARCH_CACHE_TTL"])
+            with mock.patch("time.monotonic", return_value=later):
+                self.client.get("/search?q=dune")
+                self.assertEqual(len(urls), 3)
+                self.client.get("/search?q=nothing at all")
+                self.assertEqual(len(urls), 4)
+
+    def test_0170_recommendations(self) -> None:
+        '''
+        Tests that users with the same favorite genre share the cached recommendations of that genre,
+        that the response tells the age of the cache and that a failing search is a 502 that is not cached.
+        '''
+        fake = FakeGoogleBooks({"book1": volume("book1", "Fantasy"), "book2": volume("book2", "Fantasy / Poetry")})
+        with mock.patch.object(google_books, "get", fake.get):
+            self.client.post("/favorites/user1/add/book1")
+            self.client.post("/favorites/user2/add/book2")
+            fake.calls = 0
+
+            first = self.client.get("/recommendations/user1").get_json()
+            second = self.client.get("/recommendations/user2").get_json()
+            self.assertEqual(fake.calls, 1)
+            self.assertEqual((first["genre"], second["genre"]), ("Fantasy", "Fantasy"))
+            self.assertEqual(first["cache_age"], 0)
+            self.assertEqual(second["recommendations"], first["recommendations"])
+            self.assertEqual(len(first["recommendations"]["items"]), 2)
+
+            later = time.monotonic() + 120
+            with mock.patch("time.monotonic", return_value=later):
+                self.assertGreaterEqual(self.client.get("/recommendations/user2").get_json()["cache_age"], 120)
+            self.assertEqual(fake.calls, 1)
+
+            # a user without favorites gets the Fiction recommendations, which can not be loaded now
+            fake.down = True
+            response = self.client.get("/recommendations/user3")
+            self.assertEqual(response.status_code, 502)
+            self.assertEqual(response.get_json(), {"error": "recommendations could not be loaded for genre: Fiction"})
+            fake.down = False
+            response = self.client.get("/recommendations/user3")
+            self.assertEqual(response.get_json()["genre"], "Fiction")
+            self.assertEqual(fake.calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.run import SCALES, compare, run_benchmarks
+
+
+class BenchmarkTests(unittest.TestCase):
+    '''
+    Test class for the benchmark suite, it runs on the smallest scale so it stays fast.
+    '''
+
+    def test_0010_run_benchmarks(self) -> None:
+        '''
+        Tests that every benchmark runs on a seeded database and is timed.
+        '''
+        results = run_benchmarks(SCALES["tiny"], repeat=2)
+
+        self.assertEqual(results["scale"], SCALES["tiny"])
+        self.assertIn("most_favorites", results["results"])
+        self.assertIn("favorites_remove", results["results"])
+        for result in results["results"].values():
+            self.assertEqual(result["runs"], 2)
+            self.assertLessEqual(result["min_ms"], result["median_ms"])
+
+    def test_0020_compare(self) -> None:
+        '''
+        Tests that only a benchmark slower than the threshold times its baseline is a regression.
+        '''
+        results = {"results": {"fast": {"median_ms": 1.0}, "slow": {"median_ms": 4.0}, "new": {"median_ms": 1.0}}}
+        baseline = {"results": {"fast": {"median_ms": 1.0}, "slow": {"median_ms": 2.0}}}
+
+        regressions = compare(results, baseline, 1.5)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("slow:"))
+        self.assertEqual(results["results"]["slow"]["ratio"], 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
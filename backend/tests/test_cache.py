@@ -0,0 +1,200 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+import sqlite3
+from contextlib import closing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import LRUCache, RefreshingCache, VolumeCache
+
+class LRUCacheTests(unittest.TestCase):
+    '''
+    Test class for the in-memory LRU cache, these tests do not need the flask application.
+    '''
+
+    def test_0010_get_and_set(self) -> None:
+        '''
+        Tests that a stored value is returned and that the hit and miss counters are updated.
+        '''
+        cache = LRUCache(max_size=2)
+        self.assertIsNone(cache.get("book1"))
+
+        cache.set("book1", {"id": "book1"})
+        self.assertEqual(cache.get("book1"), {"id": "book1"})
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_0020_evicts_least_recently_used(self) -> None:
+        '''
+        Tests that the least recently used entry is evicted when the cache is full.
+        '''
+        cache = LRUCache(max_size=2)
+        cache.set("book1", 1)
+        cache.set("book2", 2)
+        cache.get("book1")
+        cache.set("book3", 3)
+
+        self.assertEqual(cache.get("book1"), 1)
+        self.assertIsNone(cache.get("book2"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_0030_expires_entries(self) -> None:
+        '''
+        Tests that entries are no longer returned after their time to live.
+        '''
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set("book1", 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("book1"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+
+class VolumeCacheTests(unittest.TestCase):
+    '''
+    Test class for the two tier volume cache.
+    '''
+
+    def setUp(self) -> None:
+        '''
+        Creates a temporary SQLite file for the persistent tier.
+        '''
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "volume_cache.db")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_0010_persistent_tier_survives_restart(self) -> None:
+        '''
+        Tests that a new cache object, like a restarted worker, reads volumes stored by an old one.
+        '''
+        volume = {"kind": "books#volume", "id": "5zl-KQEACAAJ", "volumeInfo": {"title": "Flowers for Algernon"}}
+        VolumeCache(self.db_path).set("5zl-KQEACAAJ", volume)
+
+        restarted = VolumeCache(self.db_path)
+        self.assertEqual(restarted.get("5zl-KQEACAAJ"), volume)
+        self.assertEqual(restarted.stats()["persistent_hits"], 1)
+
+        # the volume has been promoted to the memory tier
+        self.assertEqual(restarted.get("5zl-KQEACAAJ"), volume)
+        self.assertEqual(restarted.stats()["persistent_hits"], 1)
+
+    def test_0020_persistent_ttl(self) -> None:
+        '''
+        Tests that volumes older than the persistent time to live are not returned.
+        '''
+        VolumeCache(self.db_path).set("book1", {"id": "book1"})
+
+        restarted = VolumeCache(self.db_path, persistent_ttl=-1)
+        self.assertIsNone(restarted.get("book1"))
+        self.assertEqual(restarted.stats()["persistent_misses"], 1)
+
+    def test_0030_delete(self) -> None:
+        '''
+        Tests that a deleted volume is removed from both tiers.
+        '''
+        cache = VolumeCache(self.db_path)
+        cache.set("book1", {"id": "book1"})
+        cache.delete("book1")
+
+        self.assertIsNone(cache.get("book1"))
+        self.assertIsNone(VolumeCache(self.db_path).get("book1"))
+
+    def test_0040_verified_registry(self) -> None:
+        '''
+        Tests that cached and registered volumes are known to exist, also after a restart and after the cache expired.
+        '''
+        cache = VolumeCache(self.db_path)
+        cache.set("book1", {"id": "book1"})
+        cache.mark_verified(["book2", "book2"])
+        self.assertFalse(cache.is_verified("book3"))
+
+        restarted = VolumeCache(self.db_path, persistent_ttl=-1)
+        self.assertTrue(restarted.is_verified("book1"))
+        self.assertTrue(restarted.is_verified("book2"))
+        self.assertFalse(restarted.is_verified("book3"))
+        self.assertIsNone(restarted.get("book1"))
+
+
+    def test_0050_prunes_expired_volumes(self) -> None:
+        '''
+        Tests that expired volumes are deleted from SQLite when the cache starts and when volumes are stored,
+        not only skipped when they are read.
+        '''
+        def stored() -> list:
+            with closing(sqlite3.connect(self.db_path)) as connection:
+                return [row[0] for row in connection.execute("SELECT book_id FROM volume_cache ORDER BY book_id")]
+
+        cache = VolumeCache(self.db_path)
+        cache.set("book1", {"id": "book1"})
+        cache.set("book2", {"id": "book2"})
+        with closing(sqlite3.connect(self.db_path)) as connection, connection:
+            connection.execute("UPDATE volume_cache SET fetched_at = fetched_at - 8 * 24 * 60 * 60 WHERE book_id = 'book1'")
+
+        VolumeCache(self.db_path)
+        self.assertEqual(stored(), ["book2"])
+
+        # a long running cache prunes once the interval passed
+        cache.persistent_ttl = -1
+        cache.set("book3", {"id": "book3"})
+        self.assertEqual(stored(), ["book2", "book3"])
+        cache._pruned_at -= VolumeCache.PRUNE_INTERVAL
+        cache.set("book4", {"id": "book4"})
+        self.assertEqual(stored(), ["book4"])
+
+
+class RefreshingCacheTests(unittest.TestCase):
+    '''
+    Test class for the stale-while-refresh cache used for search results.
+    '''
+
+    def test_0010_loads_once(self) -> None:
+        '''
+        Tests that a fresh entry is served without calling the loader again.
+        '''
+        calls = []
+        cache = RefreshingCache("SEARCH_CACHE")
+        loader = lambda: calls.append(1) or ["book1"]
+
+        self.assertEqual(cache.get("flowers", loader)[0], ["book1"])
+        self.assertEqual(cache.get("flowers", loader)[0], ["book1"])
+        self.assertEqual(len(calls), 1)
+
+    def test_0020_serves_stale_while_refreshing(self) -> None:
+        '''
+        Tests that a stale entry is returned as it is and replaced by the background refresh.
+        '''
+        background = []
+        cache = RefreshingCache("SEARCH_CACHE", fresh_ttl=0)
+        cache.submit = background.append
+
+        cache.get("flowers", lambda: ["old"])
+        value, age = cache.get("flowers", lambda: ["new"])
+        self.assertEqual(value, ["old"])
+        self.assertEqual(len(background), 1)
+
+        # a second stale hit does not start another refresh
+        cache.get("flowers", lambda: ["new"])
+        self.assertEqual(len(background), 1)
+
+        background[0]()
+        self.assertEqual(cache.get("flowers", lambda: ["newer"])[0], ["new"])
+        self.assertEqual(cache.stats()["refreshes"], 1)
+
+    def test_0030_negative_ttl(self) -> None:
+        '''
+        Tests that empty results expire after the negative time to live.
+        '''
+        cache = RefreshingCache("SEARCH_CACHE", negative_ttl=0.01)
+        cache.get("no such book", lambda: [])
+        time.sleep(0.02)
+
+        self.assertEqual(cache.get("no such book", lambda: ["book1"])[0], ["book1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
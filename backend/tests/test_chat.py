@@ -0,0 +1,185 @@
+import unittest
+import sys
+import os
+from types import SimpleNamespace
+from typing import Any, Iterator, List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from chat import ChatSessions, compact_reading_profile, sse_event
+
+class FakeChat:
+    '''
+    Stand-in for a Gemini chat, it answers with the message and remembers the history it was created with.
+    '''
+
+    def __init__(self, client: "FakeClient", history: List[Any]) -> None:
+        self.client = client
+        self.history = history
+
+    def send_message(self, message: str) -> SimpleNamespace:
+        self.client.histories.append(self.history)
+        return SimpleNamespace(text=f"answer to {message}")
+
+    def send_message_stream(self, message: str) -> Iterator[SimpleNamespace]:
+        self.client.histories.append(self.history)
+        for word in f"answer to {message}".split(" "):
+            yield SimpleNamespace(text=word + " ")
+
+
+class HistoryChat(FakeChat):
+    '''
+    Stand-in for a Gemini chat whose answer depends on the history, like a real follow-up answer.
+    '''
+
+    def send_message(self, message: str) -> SimpleNamespace:
+        self.client.histories.append(self.history)
+        return SimpleNamespace(text=f"answer to {message} after {len(self.history)} turns")
+
+
+class FakeClient:
+    '''
+    Stand-in for the Gemini client, so these tests do not call the Gemini API.
+    '''
+
+    def __init__(self) -> None:
+        self.histories: List[List[Any]] = []
+        self.chats = SimpleNamespace(create=lambda model, config, history: FakeChat(self, history))
+
+
+class ChatSessionsTests(unittest.TestCase):
+    '''
+    Test class for the per-user chat sessions.
+    '''
+
+    def setUp(self) -> None:
+        self.client = FakeClient()
+        self.sessions = ChatSessions(max_turns=2)
+        self.sessions.client = self.client
+
+    def test_0010_sessions_per_user(self) -> None:
+        '''
+        Tests that users do not see each others history.
+        '''
+        self.assertEqual(self.sessions.send_message("user1", "hello", "system"), "answer to hello")
+        self.sessions.send_message("user2", "hi", "system")
+        self.sessions.send_message("user1", "again", "system")
+
+        self.assertEqual(len(self.client.histories[1]), 0)
+        self.assertEqual(len(self.client.histories[2]), 2)
+        self.assertEqual(self.client.histories[2][0].parts[0].text, "hello")
+
+    def test_0020_history_is_bounded(self) -> None:
+        '''
+        Tests that only the last max_turns turns are kept.
+        '''
+        for i in range(5):
+            self.sessions.send_message("user1", f"message {i}", "system")
+
+        history = self.sessions.session("user1").history
+        self.assertEqual(len(history), 4)
+        self.assertEqual(history[0], ("user", "message 3"))
+
+    def test_0030_evicts_least_recently_used(self) -> None:
+        '''
+        Tests that the least recently used session is evicted when the memory budget is exceeded.
+        '''
+        self.sessions.memory_budget = 60
+        self.sessions.send_message("user1", "a" * 20, "system")
+        self.sessions.send_message("user2", "b" * 20, "system")
+
+        self.assertEqual(self.sessions.stats()["sessions"], 1)
+        self.assertEqual(self.sessions.stats()["evictions"], 1)
+        self.assertEqual(self.sessions.session("user1").history, [])
+
+    def test_0040_drops_idle_sessions(self) -> None:
+        '''
+        Tests that sessions that were not used for idle_ttl seconds are dropped.
+        '''
+        self.sessions.idle_ttl = 0
+        self.sessions.send_message("user1", "hello", "system")
+        self.sessions.session("user2")
+
+        self.assertEqual(self.sessions.stats()["expirations"], 1)
+
+    def test_0050_stream_message(self) -> None:
+        '''
+        Tests that a streamed answer is yielded in parts and added to the history once it is complete.
+        '''
+        parts = self.sessions.stream_message("user1", "hello", "system")
+        self.assertEqual(next(parts), "answer ")
+        self.assertEqual(self.sessions.session("user1").history, [])
+
+        self.assertEqual(list(parts), ["to ", "hello "])
+        self.assertEqual(self.sessions.session("user1").history, [("user", "hello"), ("model", "answer to hello ")])
+
+    def test_0060_answer_cache(self) -> None:
+        '''
+        Tests that the same question with the same profile is answered from the cache and still added to the history.
+        '''
+        self.sessions.send_message("user1", "Recommend me a book", "profile")
+        self.assertEqual(self.sessions.send_message("user2", "  recommend me a BOOK? ", "profile"), "answer to Recommend me a book")
+        self.assertEqual("".join(self.sessions.stream_message("user3", "recommend me a book", "profile")), "answer to Recommend me a book")
+
+        self.assertEqual(len(self.client.histories), 1)
+        self.assertEqual(self.sessions.stats()["answer_cache_hits"], 2)
+        self.assertEqual(self.sessions.session("user2").history[1], ("model", "answer to Recommend me a book"))
+
+        # another reading profile is a miss
+        self.sessions.send_message("user4", "recommend me a book", "other profile")
+        self.assertEqual(len(self.client.histories), 2)
+
+    def test_0065_answer_cache_ignores_history(self) -> None:
+        '''
+        Tests that an answer that depends on the history of one user is not given to another user.
+        '''
+        self.client.chats.create = lambda model, config, history: HistoryChat(self.client, history)
+        self.sessions.send_message("user1", "My name is Alice", "profile")
+        alice = self.sessions.send_message("user1", "Tell me more", "profile")
+        bob = self.sessions.send_message("user2", "tell me more.", "profile")
+
+        self.assertNotEqual(alice, bob)
+        self.assertEqual(bob, "answer to tell me more. after 0 turns")
+        self.assertEqual(len(self.client.histories), 3)
+
+    def test_0070_sse_event(self) -> None:
+        '''
+        Tests the format of Server-Sent Events.
+        '''
+        self.assertEqual(sse_event({"text": "hi"}), 'data: {"text": "hi"}\n\n')
+        self.assertEqual(sse_event({}, event="done"), 'event: done\ndata: {}\n\n')
+
+
+class ReadingProfileTests(unittest.TestCase):
+    '''
+    Test class for the size-bounded reading profile of the chat.
+    '''
+
+    def test_0010_within_budget(self) -> None:
+        '''
+        Tests that the profile stays within the budget, filling the sections in order and counting what is shown.
+        '''
+        sections = [
+            ("Favorite books", [f"Favorite {i}" for i in range(100)], 100),
+            ("Recently added books", ["Recent 1"], 1),
+        ]
+        profile = compact_reading_profile(sections, 200)
+
+        self.assertLessEqual(len(profile), 200)
+        self.assertIn("- Favorite books (12 of 100): Favorite 0, Favorite 1", profile)
+        self.assertNotIn("Recent 1", profile)
+
+        profile = compact_reading_profile(sections, 10000)
+        self.assertIn("- Favorite books (100): ", profile)
+        self.assertIn("- Recently added books (1): Recent 1\n", profile)
+
+    def test_0020_no_reading_history(self) -> None:
+        '''
+        Tests the profile of a user without books.
+        '''
+        self.assertEqual(compact_reading_profile([("Favorite books", [], 0)], 100),
+                         "User's reading profile:\n- No reading history available yet\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import sys
+import os
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fanout import FanOut
+
+class FanOutTests(unittest.TestCase):
+    '''
+    Test class for the concurrent fan-out, these tests do not need the flask application.
+    '''
+
+    def test_0010_returns_all_results(self) -> None:
+        '''
+        Tests that every key gets its result.
+        '''
+        results, errors = FanOut().map(lambda book_id: book_id.upper(), ["book1", "book2", "book3"])
+
+        self.assertEqual(results, {"book1": "BOOK1", "book2": "BOOK2", "book3": "BOOK3"})
+        self.assertEqual(errors, {})
+
+    def test_0020_caps_calls_in_flight(self) -> None:
+        '''
+        Tests that no more than max_in_flight calls run at the same time.
+        '''
+        lock = threading.Lock()
+        running = [0]
+        highest = [0]
+
+        def slow_call(book_id: str) -> str:
+            with lock:
+                running[0] += 1
+                highest[0] = max(highest[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return book_id
+
+        results, errors = FanOut(max_workers=8).map(slow_call, [f"book{i}" for i in range(12)], max_in_flight=3)
+
+        self.assertEqual(len(results), 12)
+        self.assertLessEqual(highest[0], 3)
+
+    def test_0030_partial_results(self) -> None:
+        '''
+        Tests that failing and slow keys are reported as errors while the other results are kept.
+        '''
+        def call(book_id: str) -> str:
+            if book_id == "broken":
+                raise ValueError("broken book")
+            if book_id == "slow":
+                time.sleep(0.5)
+            return book_id
+
+        results, errors = FanOut().map(call, ["book1", "broken", "slow"], deadline=0.1)
+
+        self.assertEqual(results, {"book1": "book1"})
+        self.assertEqual(errors["broken"], "broken book")
+        self.assertEqual(errors["slow"], "deadline exceeded")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,10 +13,12 @@ class GeminiAPITests(unittest.TestCase):
     
     def setUp(self) -> None:
         '''
-        Set up test cases by starting the gemini client
+        Set up test cases by starting the gemini client, GEMINI_BASE_URL can point it to the stand-in server
         '''
         self.api_key = os.getenv("GEMINI_API_KEY")
-        self.client = genai.Client(api_key=self.api_key)
+        base_url = os.getenv("GEMINI_BASE_URL")
+        http_options = genai.types.HttpOptions(base_url=base_url) if base_url else None
+        self.client = genai.Client(api_key=self.api_key, http_options=http_options)
 
     def test_api_connection(self) -> None:
         '''
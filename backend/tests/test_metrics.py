@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from metrics import Histogram, Metrics, format_labels
+
+class MetricsTests(unittest.TestCase):
+    '''
+    Test class for the Prometheus metrics, these tests do not need the flask application.
+    '''
+
+    def test_0010_histogram(self) -> None:
+        '''
+        Tests that the buckets of a histogram are cumulative and end with +Inf.
+        '''
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        lines = histogram.lines("latency", {"route": "/"})
+        self.assertEqual(lines[:3], [
+            'latency_bucket{route="/",le="0.1"} 2',
+            'latency_bucket{route="/",le="1.0"} 3',
+            'latency_bucket{route="/",le="+Inf"} 4',
+        ])
+        self.assertEqual(lines[4], 'latency_count{route="/"} 4')
+
+    def test_0020_labels_are_escaped(self) -> None:
+        '''
+        Tests that quotes and backslashes in label values are escaped.
+        '''
+        self.assertEqual(format_labels({"query": 'say "hi" \\'}), '{query="say \\"hi\\" \\\\"}')
+
+    def test_0030_upstream_and_caches(self) -> None:
+        '''
+        Tests that upstream calls are counted per target and that cache hit ratios are computed from their stats.
+        '''
+        metrics = Metrics()
+        metrics.observe_upstream("google_books_volume", 0.2, "200")
+        metrics.observe_upstream("google_books_volume", 0.3, "error")
+        metrics.register_cache("volume", lambda: {"hits": 3, "misses": 1})
+
+        text = metrics.render()
+        self.assertIn('bookbuddy_upstream_requests_total{target="google_books_volume",status="200"} 1', text)
+        self.assertIn('bookbuddy_upstream_request_duration_seconds_count{target="google_books_volume"} 2', text)
+        self.assertIn('bookbuddy_cache_hit_ratio{cache="volume"} 0.75', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
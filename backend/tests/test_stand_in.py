@@ -0,0 +1,97 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+
+from werkzeug.serving import make_server
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db, upgrade_db
+from stand_in import create_stand_in
+from upstream import LatencyProfile, UpstreamClient
+
+
+class StandInTests(unittest.TestCase):
+    '''
+    Test class for the stand-in server of Google Books and Gemini, nothing is sent to the real APIs.
+    '''
+
+    def setUp(self) -> None:
+        '''
+        Starts a synthetic stand-in server on a free port.
+        '''
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = make_server("127.0.0.1", 0, create_stand_in("synthetic"), threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_0010_app_with_stand_in(self) -> None:
+        '''
+        Tests that the app gets its books and chat answers from the stand-in when its urls point to it.
+        '''
+        app = create_app({
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(self.directory.name, 'bookbuddy.db')}",
+            "VOLUME_CACHE_PATH": None,
+            "GOOGLE_BOOKS_URL": f"{self.base_url}/books/v1",
+            "GEMINI_BASE_URL": self.base_url,
+            "GEMINI_API_KEY": "stand-in",
+        })
+        with app.app_context():
+            upgrade_db()
+        client = app.test_client()
+
+        response = client.get("/get_book/standin1")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()["volumeInfo"]["title"].startswith("Stand-in Book"))
+
+        response = client.post("/api/chat", json={"message": "Recommend me a fantasy book", "user_id": "user1"})
+        self.assertIn("Recommend me a fantasy book", response.get_json()["response"])
+
+        response = client.post("/api/chat/stream", json={"message": "What should I read next?", "user_id": "user2"})
+        self.assertIn("What should I read next?", response.get_data(as_text=True))
+
+        with app.app_context():
+            db.engine.dispose()
+
+    def test_0020_record_and_replay(self) -> None:
+        '''
+        Tests that fixtures recorded by the app are replayed by the stand-in, and that unknown calls get a 404.
+        '''
+        fixtures = os.path.join(self.directory.name, "fixtures")
+        recorder = UpstreamClient(f"{self.base_url}/books/v1", mode="record", fixtures=fixtures)
+        recorded = recorder.get("/volumes", params={"q": "intitle:dune", "maxResults": 3}).json()
+        recorder.close()
+
+        client = create_stand_in("replay", fixtures).test_client()
+        response = client.get("/books/v1/volumes?maxResults=3&q=intitle:dune")
+        self.assertEqual(response.get_json(), recorded)
+        self.assertEqual(len(recorded["items"]), 3)
+
+        response = client.get("/books/v1/volumes/unknown")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()["error"]["status"], "NOT_FOUND")
+
+    def test_0030_error_profile(self) -> None:
+        '''
+        Tests that the stand-in fails at the error rate of its profile, the seed makes the failures reproducible.
+        '''
+        profile = LatencyProfile.parse("error_rate=0.5")
+        statuses = []
+        for _ in range(2):
+            client = create_stand_in("synthetic", profile=profile, seed=7).test_client()
+            statuses.append([client.get("/books/v1/volumes/book1").status_code for _ in range(20)])
+
+        self.assertEqual(statuses[0], statuses[1])
+        self.assertEqual(set(statuses[0]), {200, 503})
+
+
+if __name__ == "__main__":
+    unittest.main()
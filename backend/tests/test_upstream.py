@@ -0,0 +1,114 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from upstream import FixtureNotFound, LatencyProfile, UpstreamClient
+
+class VolumeHandler(BaseHTTPRequestHandler):
+    '''
+    Small stand-in for Google Books, it counts the connections that are opened.
+    '''
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self) -> None:
+        VolumeHandler.connections += 1
+        super().setup()
+
+    def do_GET(self) -> None:
+        body = json.dumps({"kind": "books#volume", "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+class UpstreamClientTests(unittest.TestCase):
+    '''
+    Test class for the pooled upstream client, these tests run against a local server.
+    '''
+
+    def setUp(self) -> None:
+        VolumeHandler.connections = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), VolumeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = UpstreamClient(f"http://127.0.0.1:{self.server.server_port}/books/v1", pool_size=4)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_0010_relative_and_full_urls(self) -> None:
+        '''
+        Tests that relative paths are added to the base url and full urls are used as they are.
+        '''
+        response = self.client.get("/volumes/book1")
+        self.assertEqual(response.json()["path"], "/books/v1/volumes/book1")
+
+        response = self.client.get(f"http://127.0.0.1:{self.server.server_port}/other", params={"q": "flowers"})
+        self.assertEqual(response.json()["path"], "/other?q=flowers")
+
+    def test_0020_reuses_connections(self) -> None:
+        '''
+        Tests that sequential calls reuse one keep-alive connection.
+        '''
+        for _ in range(5):
+            self.assertEqual(self.client.get("/volumes/book1").status_code, 200)
+
+        self.assertEqual(VolumeHandler.connections, 1)
+
+    def test_0030_record_and_replay(self) -> None:
+        '''
+        Tests that recorded responses are replayed without a connection, and that the api key is not part of the request.
+        '''
+        with tempfile.TemporaryDirectory() as fixtures:
+            base_url = f"http://127.0.0.1:{self.server.server_port}/books/v1"
+            recorder = UpstreamClient(base_url, mode="record", fixtures=fixtures)
+            recorded = recorder.get("/volumes", params={"q": "flowers", "key": "secret"}).json()
+            recorder.close()
+            [name] = os.listdir(fixtures)
+            with open(os.path.join(fixtures, name)) as file:
+                self.assertEqual(json.load(file)["request"]["params"], [["q", "flowers"]])
+
+            replayer = UpstreamClient(base_url, mode="replay", fixtures=fixtures)
+            replayed = replayer.get("/volumes", params={"q": "flowers", "key": "other"}).json()
+            self.assertEqual(replayed, recorded)
+            self.assertEqual(VolumeHandler.connections, 1)
+
+            with self.assertRaises(FixtureNotFound):
+                replayer.get("/volumes", params={"q": "trees"})
+            replayer.close()
+
+    def test_0040_latency_profile(self) -> None:
+        '''
+        Tests that replayed calls wait for the latency of the profile and fail at its error rate.
+        '''
+        profile = LatencyProfile.parse("latency=0.05,jitter=0.01,error_rate=1,error_status=500")
+        self.assertEqual((profile.latency, profile.jitter, profile.error_rate, profile.error_status), (0.05, 0.01, 1.0, 500))
+        self.assertEqual(LatencyProfile.parse("slow").latency, 0.8)
+        with self.assertRaises(ValueError):
+            LatencyProfile.parse("delay=1")
+
+        with tempfile.TemporaryDirectory() as fixtures:
+            client = UpstreamClient("http://books.invalid/books/v1", mode="replay", fixtures=fixtures, profile=profile)
+            start = time.perf_counter()
+            response = client.get("/volumes/book1")
+            self.assertEqual(response.status_code, 500)
+            self.assertGreaterEqual(time.perf_counter() - start, 0.04)
+            client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+# query parameters and headers with credentials, they are left out of fixtures
+SECRET_PARAMS = {"key"}
+# transient failures are not recorded, a replay should not fail because the recording did
+UNRECORDED_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LatencyProfile:
+    '''
+    The latency and errors of a stand-in upstream: every response waits latency seconds plus or minus
+    up to jitter seconds, and a share of error_rate of the calls fails with error_status.
+    '''
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    @classmethod
+    def parse(cls, text: str) -> "LatencyProfile":
+        '''
+        Parses the name of a profile in PROFILES, or settings like "latency=0.2,jitter=0.05,error_rate=0.01".
+        Returns: a LatencyProfile
+        '''
+        if text in PROFILES:
+            return PROFILES[text]
+        settings: Dict[str, Any] = {}
+        for setting in filter(None, text.split(",")):
+            name, _, value = setting.partition("=")
+            name = name.strip()
+            if name not in ("latency", "jitter", "error_rate", "error_status"):
+                raise ValueError(f"unknown latency profile setting: {name}")
+            settings[name] = int(value) if name == "error_status" else float(value)
+        return cls(**settings)
+
+    def sample(self, rng: random.Random) -> Tuple[float, Optional[int]]:
+        '''
+        Returns: a tuple, the seconds to wait and the status to fail with, or None when the call succeeds
+        '''
+        delay = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+        return delay, self.error_status if rng.random() < self.error_rate else None
+
+
+PROFILES: Dict[str, LatencyProfile] = {
+    "none": LatencyProfile(),
+    "fast": LatencyProfile(latency=0.02, jitter=0.005),
+    "typical": LatencyProfile(latency=0.15, jitter=0.05, error_rate=0.005),
+    "slow": LatencyProfile(latency=0.8, jitter=0.3, error_rate=0.02),
+    "flaky": LatencyProfile(latency=0.2, jitter=0.15, error_rate=0.1),
+}
+
+
+class FixtureNotFound(requests.ConnectionError):
+    '''
+    A replayed call that was never recorded, the caller sees it as a failed upstream call.
+    '''
+
+
+class Fixtures:
+    '''
+    Recorded upstream responses, one json file per request in a directory.
+    A request is identified by its method, path, query parameters and body, credentials are left out,
+    so fixtures recorded with an API key can be replayed without one and can be checked in.
+    '''
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    @staticmethod
+    def request_of(method: str, url: str, body: Optional[bytes] = None) -> Dict[str, Any]:
+        '''
+        Returns: a dict, the parts of the request that identify it
+        '''
+        parts = urlsplit(url)
+        params = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if name not in SECRET_PARAMS)
+        try:
+            content = json.loads(body) if body else None
+        except ValueError:
+            content = body.decode(errors="replace") if isinstance(body, bytes) else body
+        return {"method": method.upper(), "path": parts.path, "params": params, "body": content}
+
+    @staticmethod
+    def key(request: Dict[str, Any]) -> str:
+        return hashlib.sha1(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def path(self, request: Dict[str, Any]) -> str:
+        name = request["path"].strip("/").replace("/", "_").replace(":", "_")[:80]
+        return os.path.join(self.directory, f"{name}-{self.key(request)[:16]}.json")
+
+    def load(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        '''
+        Returns: a dict with the status, content_type and body of the recorded response, or None when it was not recorded
+        '''
+        try:
+            with open(self.path(request)) as file:
+                return json.load(file)["response"]
+        except FileNotFoundError:
+            return None
+
+    def save(self, request: Dict[str, Any], status: int, content_type: str, body: str) -> None:
+        '''
+        Records a response, the file is replaced at once so a concurrent replay never reads half a fixture.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(request)
+        fixture = {"request": request, "response": {"status": status, "content_type": content_type, "body": body}}
+        with open(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp", "w") as file:
+            json.dump(fixture, file, indent=2)
+        os.replace(file.name, path)
+
+
+class FixtureTransport(BaseAdapter):
+    '''
+    A requests transport that records upstream responses to fixtures or replays them offline.
+    In "record" mode the calls go to the real upstream through live and the responses are saved,
+    in "replay" mode no connection is made: the recorded response is returned after the latency of the profile.
+    '''
+
+    def __init__(self, mode: str, fixtures: Fixtures, live: Optional[BaseAdapter] = None,
+                 profile: Optional[LatencyProfile] = None, seed: Optional[int] = None) -> None:
+        super().__init__()
+        if mode not in ("record", "replay"):
+            raise ValueError(f"unknown upstream mode: {mode}")
+        self.mode = mode
+        self.fixtures = fixtures
+        self.live = live or HTTPAdapter()
+        self.profile = profile or PROFILES["none"]
+        self.random = random.Random(seed)
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        body = request.body.encode() if isinstance(request.body, str) else request.body
+        identity = Fixtures.request_of(request.method or "GET", request.url or "", body)
+        if self.mode == "record":
+            response = self.live.send(request, **kwargs)
+            if response.status_code not in UNRECORDED_STATUSES:
+                self.fixtures.save(identity, response.status_code, response.headers.get("Content-Type", ""), response.text)
+            return response
+
+        delay, error_status = self.profile.sample(self.random)
+        time.sleep(delay)
+        if error_status is not None:
+            return build_response(request, error_status, "application/json", json.dumps(
+                {"error": {"code": error_status, "message": "Injected by the latency profile", "status": "UNAVAILABLE"}}))
+        recorded = self.fixtures.load(identity)
+        if recorded is None:
+            raise FixtureNotFound(f"no fixture for {identity['method']} {identity['path']}", request=request)
+        return build_response(request, recorded["status"], recorded["content_type"], recorded["body"])
+
+    def close(self) -> None:
+        self.live.close()
+
+
+def build_response(request: requests.PreparedRequest, status: int, content_type: str, body: str) -> requests.Response:
+    '''
+    Returns: a requests.Response with the given status and body, like one received from the network
+    '''
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict({"Content-Type": content_type})
+    response._content = body.encode()
+    response.encoding = "utf-8"
+    response.url = request.url or ""
+    response.request = request
+    return response
+
+
+class UpstreamClient:
+    '''
+    Shared HTTP client for an upstream API like Google Books.
+    All calls go through one requests session with a pool of keep-alive connections,
+    so the TCP and TLS handshakes are only paid once per connection instead of once per call.
+    Every call is reported to observer(target, seconds, status), status is "error" when no response was received.
+    With the mode "record" or "replay" the calls go through a FixtureTransport, see UpstreamClient.init_app.
+    '''
+
+    def __init__(self, base_url: str, pool_size: int = 16, timeout: float = 10.0, retries: int = 2,
+                 mode: str = "live", fixtures: Optional[str] = None, profile: Optional[LatencyProfile] = None) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.mode = mode
+        self.fixtures = fixtures
+        self.profile = profile
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.observer: Optional[Callable[[str, float, str], None]] = None
+
+    def init_app(self, app: Any) -> None:
+        '''
+        Configures the client from the Flask config.
+        UPSTREAM_POOL_SIZE, UPSTREAM_TIMEOUT and UPSTREAM_RETRIES are read, the pool size defaults
+        to the amount of fan-out workers so every worker thread can keep its own connection open.
+        UPSTREAM_MODE is "live", "record" or "replay", the fixtures are kept in the UPSTREAM_FIXTURES directory
+        and UPSTREAM_PROFILE sets the latency of replayed calls, see LatencyProfile.parse.
+        GOOGLE_BOOKS_URL can point the client to a stand-in server.
+        '''
+        self.base_url = app.config.get("GOOGLE_BOOKS_URL", self.base_url).rstrip("/")
+        self.pool_size = app.config.get("UPSTREAM_POOL_SIZE", app.config.get("FANOUT_MAX_WORKERS", self.pool_size))
+        self.timeout = app.config.get("UPSTREAM_TIMEOUT", self.timeout)
+        self.retries = app.config.get("UPSTREAM_RETRIES", self.retries)
+        self.mode = app.config.get("UPSTREAM_MODE", self.mode)
+        self.fixtures = app.config.get("UPSTREAM_FIXTURES", self.fixtures)
+        profile = app.config.get("UPSTREAM_PROFILE")
+        self.profile = LatencyProfile.parse(profile) if isinstance(profile, str) else profile or self.profile
+        if self.mode != "live" and not self.fixtures:
+            raise ValueError(f"UPSTREAM_FIXTURES is needed for the upstream mode {self.mode}")
+        self.close()
+
+    @property
+    def session(self) -> requests.Session:
+        '''
+        The session is created on first use and recreated after a fork,
+        connections should not be shared between gunicorn workers.
+        '''
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                self._session = self._create_session()
+                self._session_pid = os.getpid()
+            return self._session
+
+    def _create_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET"],
+            raise_on_status=False
+        )
+        adapter: BaseAdapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+        if self.mode != "live":
+            adapter = FixtureTransport(self.mode, Fixtures(self.fixtures or "."), live=adapter, profile=self.profile)
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self) -> None:
+        '''
+        Closes the pooled connections, a new session is created on the next call.
+        '''
+        with self._lock:
+            if self._session is not None and self._session_pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._session_pid = None
+
+    def get(self, path: str, params: Optional[Dict[str, Any]] = None, target: str = "default", **kwargs: Any) -> requests.Response:
+        '''
+        Sends a GET request to the upstream API. The path can be relative to the base url or a full url,
+        target names the kind of call for the observer, like "volume" or "search".
+        Returns: a requests.Response
+        '''
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session.get(url, params=params, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            if self.observer is not None:
+                self.observer(target, time.perf_counter() - start, status)
+
+
+google_books = UpstreamClient("https://www.googleapis.com/books/v1")
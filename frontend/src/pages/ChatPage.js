@@ -95,17 +95,15 @@ const ChatPage = () => {
     setIsLoading(true);
 
     try {
-      const response = await chatAPI.sendMessage(userMessage, currentUser.id);
-      
-      // Add AI response to chat
-      const newAIMessage = {
-        id: Date.now() + 1,
-        type: 'ai',
-        content: response.response,
-        timestamp: new Date(),
-      };
-      
-      setMessages(prev => [...prev, newAIMessage]);
+      // Add AI response to chat with the first part of the answer, then fill it in while BookBuddy writes it
+      const aiMessageId = Date.now() + 1;
+      await chatAPI.streamMessage(userMessage, currentUser.id, (content) => {
+        setIsLoading(false);
+        setMessages(prev => prev.some(message => message.id === aiMessageId)
+          ? prev.map(message => message.id === aiMessageId ? { ...message, content } : message)
+          : [...prev, { id: aiMessageId, type: 'ai', content, timestamp: new Date() }]
+        );
+      });
     } catch (error) {
       console.error('Error sending message:', error);
       toast.error('Failed to send message. Please try again.');
@@ -39,9 +39,9 @@ const HomePage = () => {
       if (mostFavorites?.most_favorites && Array.isArray(mostFavorites.most_favorites)) {
         setLoadingPopularBooks(true);
         try {
-          const bookPromises = mostFavorites.most_favorites.slice(0, 6).map((bookId) => bookAPI.getBook(bookId));
-          const books = await Promise.all(bookPromises);
-          setPopularBooks(books.filter(Boolean));
+          const bookIds = mostFavorites.most_favorites.slice(0, 6);
+          const { books } = await bookAPI.getBooks(bookIds);
+          setPopularBooks(bookIds.map((bookId) => books[bookId]).filter(Boolean));
         } catch (err) {
           setPopularBooks([]);
         } finally {
@@ -1,6 +1,6 @@
 import React, { useState } from 'react';
 import { useUser } from '../context/UserContext';
-import { useQuery } from 'react-query';
+import { useInfiniteQuery } from 'react-query';
 import { reviewsAPI } from '../services/api';
 import StarRating from '../components/common/StarRating';
 import { MessageSquare, Loader } from 'lucide-react';
@@ -11,13 +11,16 @@ const ReviewsPage = () => {
   const [sortBy, setSortBy] = useState('rating');
   const [order, setOrder] = useState('desc');
 
-  const { data, isLoading, error } = useQuery(
+  // one page of reviews is loaded at a time, the next one when the user asks for more
+  const { data, isLoading, error, fetchNextPage, hasNextPage, isFetchingNextPage } = useInfiniteQuery(
     ['sortedReviews', sortBy, order],
-    () => reviewsAPI.getSortedReviews(sortBy, order),
+    ({ pageParam = null }) => reviewsAPI.getSortedReviews(sortBy, order, pageParam),
     {
+      getNextPageParam: (lastPage) => lastPage.nextCursor || undefined,
       staleTime: 5 * 60 * 1000,
     }
   );
+  const reviews = data ? data.pages.flatMap(page => page.reviews) : [];
 
   if (!isAuthenticated) {
     return (
@@ -57,9 +60,9 @@ const ReviewsPage = () => {
           <p className="text-red-600 mb-2">Error loading reviews</p>
           <p className="text-book-500 text-sm mb-4">{error.message}</p>
         </div>
-      ) : data && data.length > 0 ? (
+      ) : reviews.length > 0 ? (
         <div className="space-y-4">
-          {data.map((review, idx) => (
+          {reviews.map((review, idx) => (
             <div key={idx} className="p-4 border border-book-200 rounded-lg">
               <div className="flex items-center justify-between mb-2">
                 <span className="font-medium text-book-900">{review.user}</span>
@@ -71,6 +74,13 @@ const ReviewsPage = () => {
               )}
             </div>
           ))}
+          {hasNextPage && (
+            <div className="text-center">
+              <button onClick={() => fetchNextPage()} disabled={isFetchingNextPage} className="btn-secondary">
+                {isFetchingNextPage ? 'Loading...' : 'Load more reviews'}
+              </button>
+            </div>
+          )}
         </div>
       ) : (
         <div className="text-center py-8">
@@ -17,6 +17,12 @@ export const bookAPI = {
     return response.data;
   },
 
+  // Get many books by ID in one request, returns { books: { id: book }, errors: { id: error } }
+  getBooks: async (bookIds) => {
+    const response = await api.post('/get_books', { ids: bookIds });
+    return response.data;
+  },
+
   // Search books
   searchBooks: async (query, page = 1, orderBy = null, lang = null) => {
     const params = { q: query, page };
@@ -89,6 +95,12 @@ export const userListsAPI = {
     const response = await api.post(`/want_to_reads/${userId}/delete/${bookId}`);
     return response.data;
   },
+
+  // Many add, remove and move operations in one request, list is 'favorites', 'read_books' or 'want_to_reads'
+  updateListInBulk: async (userId, list, operations) => {
+    const response = await api.post(`/${list}/${userId}/bulk`, { operations });
+    return response.data;
+  },
 };
 
 // Reviews API calls
@@ -123,12 +135,25 @@ export const reviewsAPI = {
     return response.data;
   },
 
-  getSortedReviews: async (sortBy = 'rating', order = 'desc') => {
-    const response = await api.get('/reviews_sorted', {
-      params: { sort_by: sortBy, order },
-    });
+  // Get the review count, mean rating and 1-5 histogram of a book
+  getBookRating: async (bookId) => {
+    const response = await api.get(`/ratings_book/${bookId}`);
     return response.data;
   },
+
+  // Get the rating aggregates of many books, returns { ratings: { id: rating } }
+  getBookRatings: async (bookIds) => {
+    const response = await api.post('/ratings_books', { ids: bookIds });
+    return response.data;
+  },
+
+  // The reviews are sent a page at a time, the X-Next-Cursor header of a page points to the next one
+  getSortedReviews: async (sortBy = 'rating', order = 'desc', cursor = null, limit = 50) => {
+    const params = { sort_by: sortBy, order, limit };
+    if (cursor) params.cursor = cursor;
+    const response = await api.get('/reviews_sorted', { params });
+    return { reviews: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+  },
 };
 
 // Chat API calls
@@ -140,6 +165,41 @@ export const chatAPI = {
     });
     return response.data;
   },
+
+  // Streams the answer as Server-Sent Events, onText is called with every part of the answer
+  streamMessage: async (message, userId, onText) => {
+    const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message, user_id: userId }),
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Chat stream failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // events are separated by an empty line
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+      for (const event of events) {
+        const type = event.match(/^event: (.*)$/m)?.[1];
+        const data = JSON.parse(event.match(/^data: (.*)$/m)?.[1] || '{}');
+        if (type === 'error') throw new Error(data.error);
+        if (type === 'done') return text;
+        text += data.text;
+        onText(text);
+      }
+    }
+    return text;
+  },
 };
 
 export default api; 
\ No newline at end of file